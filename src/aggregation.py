@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from src.storage import connect
+from src.inventory_writer import InventoryWriter
+from src.log import get_logger
+from src import metrics
+
+logger = get_logger(__name__)
+
+POLICIES = ('sum', 'min', 'max', 'primary')
+
+def _store_matches(store: str, target: Optional[str]) -> bool:
+    """True si la tienda (URL de API) es target, dado como URL o como ID de Tiendanube"""
+    if not target:
+        return False
+    return store == target or store.rstrip('/').rsplit('/', 1)[-1] == str(target)
+
+def combine(quantities: Dict[str, int], policy: str, primary: Optional[str] = None) -> int:
+    """
+    Combina las cantidades de un item informadas por varias tiendas
+    
+    Args:
+        quantities (Dict[str, int]): URL de API de la tienda -> última cantidad conocida
+        policy (str): 'sum', 'min', 'max' o 'primary'
+        primary (str, optional): Tienda principal (URL o ID) para la política 'primary'
+    
+    Returns:
+        int: Cantidad a escribir en Shopify
+    """
+    primary_value = next((quantity for store, quantity in quantities.items() if _store_matches(store, primary)), None)
+    return combine_values(list(quantities.values()), policy, primary_value)
+
+def combine_values(values: List[int], policy: str, primary_value: Optional[int] = None) -> int:
+    """
+    Combina una lista de cantidades según la política
+    
+    Args:
+        values (List[int]): Cantidades de todas las tiendas que tienen el item
+        policy (str): 'sum', 'min', 'max' o 'primary'
+        primary_value (int, optional): Cantidad de la tienda principal, si tiene el item;
+            si no la tiene, la política 'primary' usa el máximo de las demás
+    
+    Returns:
+        int: Cantidad combinada
+    """
+    if policy == 'sum':
+        return sum(values)
+    if policy == 'min':
+        return min(values)
+    if policy == 'primary' and primary_value is not None:
+        return primary_value
+    return max(values)
+
+class StockAggregator:
+    def __init__(self, policy: str, primary: Optional[str] = None, path: Optional[str] = None):
+        """
+        Combina el stock de varias tiendas de Tiendanube que alimentan el mismo item de Shopify
+        
+        Cada tienda registra su última cantidad conocida por (inventory_item_id, location_id);
+        los items que cambiaron quedan marcados y flush() escribe una sola vez el valor
+        combinado. Las cantidades se guardan en SYNC_DB_PATH, así una ejecución incremental
+        (que solo trae lo que cambió en una tienda) combina con lo último de las demás.
+        
+        Args:
+            policy (str): 'sum', 'min', 'max' o 'primary'
+            primary (str, optional): Tienda principal (URL o ID) para la política 'primary'
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Política de agregación desconocida: {policy} (opciones: {', '.join(POLICIES)})")
+        if policy == 'primary' and not primary:
+            raise ValueError("La política 'primary' requiere STOCK_AGGREGATION_PRIMARY")
+        self.policy = policy
+        self.primary = primary
+        self._lock = threading.Lock()
+        # Un flush a la vez: sin esto, dos flush concurrentes leen los mismos pendientes y los escriben dos veces
+        self._flush_lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            # dirty = 1 mientras el valor combinado del item no se haya escrito en Shopify
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS store_quantities (
+                    inventory_item_id TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    store TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    sku TEXT,
+                    dirty INTEGER NOT NULL DEFAULT 1,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (inventory_item_id, location_id, store)
+                )
+            """)
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS store_quantities_dirty ON store_quantities (dirty)'
+            )
+
+    def is_primary(self, store: str) -> bool:
+        """True si la tienda es la principal de la política 'primary'"""
+        return self.policy == 'primary' and _store_matches(store, self.primary)
+
+    def record(self, store: str, entries: Iterable[Tuple[str, str, int, Optional[str]]]) -> int:
+        """
+        Guarda las cantidades informadas por una tienda
+        
+        Args:
+            store (str): URL de API de la tienda
+            entries (Iterable[Tuple]): Tuplas (inventory_item_id, location_id, cantidad, sku)
+        
+        Returns:
+            int: Número de items registrados
+        """
+        now = time.time()
+        rows = [(str(item), str(location), quantity, sku, store, now) for item, location, quantity, sku in entries]
+        with self._lock, self._conn:
+            # Solo se marca el item si la cantidad de la tienda cambió
+            self._conn.executemany("""
+                INSERT INTO store_quantities (inventory_item_id, location_id, quantity, sku, store, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (inventory_item_id, location_id, store) DO UPDATE SET
+                    dirty = CASE WHEN store_quantities.quantity != excluded.quantity THEN 1
+                                 ELSE store_quantities.dirty END,
+                    quantity = excluded.quantity,
+                    sku = excluded.sku,
+                    updated_at = excluded.updated_at
+            """, rows)
+        return len(rows)
+
+    def store_writer(self, store: str) -> 'StoreQuantityWriter':
+        """Writer con la interfaz de InventoryWriter que registra las cantidades de una tienda"""
+        return StoreQuantityWriter(self, store)
+
+    def pending(self) -> Dict[Tuple[str, str], Dict]:
+        """
+        Items con cambios sin escribir y las cantidades de todas las tiendas que los alimentan
+        
+        Returns:
+            Dict[Tuple[str, str], Dict]: (inventory_item_id, location_id) -> {'quantities', 'skus'}
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT q.inventory_item_id, q.location_id, q.store, q.quantity, q.sku
+                FROM store_quantities q
+                JOIN (SELECT DISTINCT inventory_item_id, location_id FROM store_quantities WHERE dirty = 1) d
+                  ON d.inventory_item_id = q.inventory_item_id AND d.location_id = q.location_id
+            """).fetchall()
+        items = {}
+        for row in rows:
+            entry = items.setdefault((row['inventory_item_id'], row['location_id']), {'quantities': {}, 'skus': set()})
+            entry['quantities'][row['store']] = row['quantity']
+            if row['sku']:
+                entry['skus'].add(row['sku'])
+        return items
+
+    def flush(self, shopify, writer: Optional[InventoryWriter] = None) -> Dict[Tuple[str, str], bool]:
+        """
+        Escribe en Shopify el valor combinado de cada item con cambios (una escritura por item)
+        
+        Los items cuya escritura falla quedan marcados y se reintentan en el próximo flush.
+        Los flush concurrentes (por ejemplo, de varios hilos de tiendas) se aplican de a uno.
+        
+        Args:
+            shopify (ShopifyAPI): Cliente de Shopify
+            writer (InventoryWriter, optional): Writer en lote. Si no se proporciona, se crea uno
+        
+        Returns:
+            Dict[Tuple[str, str], bool]: Resultado de cada item
+        """
+        with self._flush_lock:
+            started_at = time.time()
+            items = self.pending()
+            if not items:
+                return {}
+            writer = writer or InventoryWriter(shopify)
+            
+            reports = 0
+            for (inventory_item_id, location_id), entry in sorted(items.items()):
+                quantity = combine(entry['quantities'], self.policy, self.primary)
+                reports += len(entry['quantities'])
+                for sku in sorted(entry['skus']) or [None]:
+                    writer.add(inventory_item_id, location_id, quantity, sku=sku)
+            writer.flush()
+            results = {key: writer.results[key] for key in items if key in writer.results}
+            
+            self._mark_written([key for key, ok in results.items() if ok], started_at)
+            written = sum(1 for ok in results.values() if ok)
+            metrics.ITEMS.inc(len(items), stage='aggregation', result='combinado')
+            metrics.ITEMS.inc(len(results) - written, stage='aggregation', result='fallido')
+            logger.info("🧮 Stock combinado (%s): %s items de %s cantidades por tienda, %s escritos",
+                        self.policy, len(items), reports, written,
+                        extra={'policy': self.policy, 'items': len(items), 'store_reports': reports, 'written': written})
+            return results
+
+    def _mark_written(self, keys: List[Tuple[str, str]], before: float) -> None:
+        """Desmarca los items escritos (salvo las cantidades que otra tienda registró mientras tanto)"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE store_quantities SET dirty = 0 '
+                'WHERE inventory_item_id = ? AND location_id = ? AND updated_at <= ?',
+                [(key[0], key[1], before) for key in keys]
+            )
+
+class StoreQuantityWriter:
+    # Las cantidades se guardan en SQLite: no hace falta cortar en lotes
+    auto_flush = False
+
+    def __init__(self, aggregator: StockAggregator, store: str):
+        """
+        Reemplaza a InventoryWriter dentro de sync_store cuando hay agregación entre tiendas
+        
+        Args:
+            aggregator (StockAggregator): Agregador compartido
+            store (str): URL de API de la tienda
+        """
+        self.aggregator = aggregator
+        self.store = store
+        self.pending: Dict[Tuple[str, str], Tuple[int, Optional[str]]] = {}
+        self.results: Dict[Tuple[str, str], bool] = {}
+        # Los fallos de escritura se reintentan desde la tabla, no frenan la marca de agua
+        self.failed_refs: Set = set()
+        self.failed_entries: List = []
+        self.skipped = 0
+        self.full = False
+
+    def add(self, inventory_item_id, location_id, quantity: int, sku: Optional[str] = None, ref=None) -> Tuple[str, str]:
+        key = (str(inventory_item_id), str(location_id))
+        self.pending[key] = (quantity, sku)
+        return key
+
+    def flush(self) -> Dict[Tuple[str, str], bool]:
+        """Registra las cantidades de la tienda en el agregador"""
+        entries: List[Tuple] = [(key[0], key[1], quantity, sku) for key, (quantity, sku) in self.pending.items()]
+        self.aggregator.record(self.store, entries)
+        flushed = {key: True for key in self.pending}
+        self.results.update(flushed)
+        self.pending.clear()
+        return flushed
+
+def from_env() -> Optional[StockAggregator]:
+    """
+    Crea el agregador si STOCK_AGGREGATION indica una política
+    
+    Returns:
+        Optional[StockAggregator]: Agregador, o None si cada tienda escribe por su cuenta (por defecto)
+    """
+    load_dotenv()
+    policy = os.getenv('STOCK_AGGREGATION', '').strip().lower()
+    if not policy or policy in ('off', 'none', 'false'):
+        return None
+    return StockAggregator(policy, os.getenv('STOCK_AGGREGATION_PRIMARY'))
@@ -0,0 +1,707 @@
+import asyncio
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+import pytz
+from src.store_config import StoreConfig
+from src.http_client import TokenBucket, retry_after_seconds, shopify_rate_limit, tiendanube_rate_limit
+from src.shopify import (
+    ShopifyAPI, INVENTORY_SET_QUANTITIES, FAILURE_SKU_NOT_FOUND, FAILURE_NO_INVENTORY_ITEM, FAILURE_ERROR,
+    PERMANENT_FAILURES, BULK_VARIANTS_QUERY, BULK_OPERATION_RUN_QUERY, BULK_OPERATION_STATUS, BULK_OPERATION_CANCEL,
+    _match_location, _index_params, _index_variants, _index_bulk_variant, _bulk_operation_id, _bulk_operation_done,
+    _variant_result, _throttle_delay, _set_quantities_variables, _failed_items, _merge_results, _report
+)
+from src.tiendanube import TiendanubeAPI, parse_updated_at
+from src.models import Product, parse_products
+from src.inventory_writer import InventoryWriter
+from src.sync_state import SyncState
+from src.sync_products import _fetch_window, _advance_watermark, _update_dead_letters
+from src.dead_letter import product_failures
+from src.sharding import StoreLeases, leases_from_env, shard_from_env
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+def available() -> bool:
+    """True si aiohttp está instalado (el motor asíncrono es opcional)"""
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class AsyncHttp:
+    def __init__(self, per_host: Optional[int] = None):
+        """
+        Sesión HTTP asíncrona compartida, con un límite de conexiones simultáneas por host
+        
+        Args:
+            per_host (int, optional): Peticiones simultáneas por host. Si no se proporciona,
+                se usa ASYNC_MAX_CONNECTIONS_PER_HOST (por defecto 8)
+        """
+        import aiohttp
+        import yarl
+        load_dotenv()
+        self.aiohttp = aiohttp
+        self.yarl = yarl
+        self.per_host = per_host or int(os.getenv('ASYNC_MAX_CONNECTIONS_PER_HOST', 8))
+        self.retryable = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.per_host),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=float(os.getenv('HTTP_CONNECT_TIMEOUT', 10)),
+                sock_read=float(os.getenv('HTTP_READ_TIMEOUT', 60))
+            )
+        )
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, url: str) -> asyncio.Semaphore:
+        """Semáforo del host de una URL (uno por host, compartido por todas las tiendas)"""
+        host = urlsplit(url).netloc
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        return semaphore
+
+    async def close(self) -> None:
+        """Cierra la sesión y sus conexiones"""
+        await self.session.close()
+
+class AsyncResponse:
+    def __init__(self, status_code: int, headers, content: bytes, links: Dict[str, Dict[str, str]]):
+        """Respuesta ya leída, con la parte de la interfaz de requests.Response que usa el proyecto"""
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.links = links
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncApiClient:
+    def __init__(self, name: str, http: AsyncHttp, capacity: float, refill_rate: float,
+                 rate_limit_parser: Optional[Callable] = None, scope: str = ''):
+        """
+        Equivalente asíncrono de ApiClient: mismo balde de peticiones, reintentos y métricas
+        
+        Args:
+            name (str): Nombre de la API, para los mensajes
+            http (AsyncHttp): Sesión compartida
+            capacity (float): Tamaño del balde de peticiones
+            refill_rate (float): Peticiones por segundo sostenibles
+            rate_limit_parser (Callable, optional): Función que lee (disponibles, capacidad) de la respuesta
+            scope (str): Identifica el balde en las métricas cuando hay varios por API
+        """
+        load_dotenv()
+        self.name = name
+        self.http = http
+        self.scope = scope
+        self.bucket = TokenBucket(capacity, refill_rate)
+        self.rate_limit_parser = rate_limit_parser
+        self.max_retries = int(os.getenv('HTTP_MAX_RETRIES', 5))
+        self.backoff_base = float(os.getenv('HTTP_BACKOFF_BASE', 1.0))
+        self.backoff_max = float(os.getenv('HTTP_BACKOFF_MAX', 60.0))
+        self.requests_sent = 0
+
+    def _backoff(self, attempt: int) -> float:
+        """Espera exponencial con jitter completo"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _acquire(self, tokens: float) -> None:
+        """
+        Espera (sin bloquear el loop) hasta que haya tokens disponibles y los consume
+        
+        Las peticiones que no consumen tokens (tokens=0) igual esperan a que termine una pausa por 429.
+        """
+        if tokens <= 0:
+            wait = self.bucket.paused_for()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.bucket.paused_for()
+            return
+        while True:
+            wait = self.bucket.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, method: str, url: str, endpoint: str, **kwargs) -> AsyncResponse:
+        # Las URLs del header Link ya vienen codificadas: no volver a codificarlas
+        target = self.http.yarl.URL(url, encoded=True)
+        async with self.http.semaphore(url):
+            started = time.monotonic()
+            try:
+                # El cuerpo se lee completo y la conexión vuelve al pool al salir del bloque,
+                # así un 429/5xx que se reintenta no retiene la conexión
+                async with self.http.session.request(method, target, **kwargs) as raw:
+                    content = await raw.read()
+                    links = {str(rel): {'url': str(link.get('url'))} for rel, link in raw.links.items()}
+                    return AsyncResponse(raw.status, raw.headers, content, links)
+            finally:
+                metrics.HTTP_LATENCY.observe(time.monotonic() - started, api=self.name, endpoint=endpoint)
+
+    async def request(self, method: str, url: str, tokens: float = 1, **kwargs) -> AsyncResponse:
+        """
+        Realiza una petición respetando el límite de la API y reintentando errores transitorios
+        
+        Args:
+            method (str): Método HTTP
+            url (str): URL completa
+            tokens (float): Tokens del balde que consume la petición (0 para no consumir)
+            **kwargs: Argumentos adicionales para aiohttp
+        
+        Returns:
+            AsyncResponse: Última respuesta recibida (puede ser 429/5xx si se agotaron los reintentos)
+        """
+        endpoint = metrics.endpoint_label(url)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            waited = time.monotonic()
+            await self._acquire(tokens)
+            metrics.RATE_LIMIT_WAIT.observe(time.monotonic() - waited, api=self.name)
+            
+            self.requests_sent += 1
+            try:
+                response = await self._send(method, url, endpoint, **kwargs)
+            except self.http.retryable as e:
+                metrics.HTTP_REQUESTS.inc(api=self.name, endpoint=endpoint, status=e.__class__.__name__)
+                if last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("⚠️ Error de red en %s (%s), reintentando en %.1fs", self.name, e.__class__.__name__, delay,
+                               extra={'api': self.name, 'delay': delay})
+                await asyncio.sleep(delay)
+                continue
+            
+            metrics.HTTP_REQUESTS.inc(api=self.name, endpoint=endpoint, status=response.status_code)
+            if self.rate_limit_parser:
+                limits = self.rate_limit_parser(response)
+                if limits:
+                    self.bucket.sync(*limits)
+            metrics.RATE_LIMIT_HEADROOM.set(round(self.bucket.headroom, 3), api=self.name, scope=self.scope)
+            
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if last_attempt:
+                return response
+            
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = self._backoff(attempt)
+            logger.warning("⚠️ %s respondió %s, reintento %s/%s en %.1fs", self.name, response.status_code,
+                           attempt + 1, self.max_retries, delay,
+                           extra={'api': self.name, 'status': response.status_code, 'delay': delay})
+            if response.status_code == 429:
+                # Frenar a todas las tareas que comparten el balde, no solo a esta
+                self.bucket.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+        
+        return response
+
+class AsyncTiendanubeAPI(TiendanubeAPI):
+    def __init__(self, http: AsyncHttp, api_url: str = None, token: str = None, user_agent: str = None):
+        """
+        Versión asíncrona de TiendanubeAPI: mismos parámetros, paginación y preparación de productos
+        
+        Args:
+            http (AsyncHttp): Sesión compartida
+            api_url (str, optional): URL base de la API
+            token (str, optional): Token de acceso
+            user_agent (str, optional): User Agent para las peticiones
+        """
+        super().__init__(api_url, token, user_agent)
+        sync_client = self.client
+        sync_client.close()
+        self.client = AsyncApiClient(
+            'Tiendanube',
+            http,
+            capacity=sync_client.bucket.capacity,
+            refill_rate=sync_client.bucket.refill_rate,
+            rate_limit_parser=tiendanube_rate_limit,
+            scope=sync_client.scope
+        )
+
+    async def _make_request(self, method: str, endpoint: str, expected_status=(200, 201), **kwargs) -> AsyncResponse:
+        if endpoint.startswith('http'):
+            url = endpoint
+        else:
+            url = f"{self.api_url}/{endpoint}"
+        response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        
+        if response.status_code not in expected_status:
+            logger.error("❌ Error en petición a Tiendanube: %s", response.status_code,
+                         extra={'status': response.status_code, 'response': response.text[:500]})
+            raise Exception(f"Error en petición a Tiendanube: {response.status_code}")
+        
+        return response
+
+    async def get_products(self, updated_at_min: Optional[datetime] = None) -> List[Product]:
+        return [product async for product in self.iter_products(updated_at_min)]
+
+    async def iter_products(self, updated_at_min: Optional[datetime] = None,
+                            full_catalog: bool = False) -> AsyncIterator[Product]:
+        """
+        Recorre página por página los productos modificados desde una fecha (ver TiendanubeAPI.iter_products)
+        
+        Yields:
+            Product: Producto actualizado con su stock
+        """
+        self.last_fetch_complete = False
+        hora_actual = datetime.now(pytz.UTC)
+        params = self._products_params(updated_at_min, full_catalog, hora_actual)
+        
+        endpoint = 'products'
+        pagina = 1
+        total = 0
+        sin_stock = 0
+        while endpoint:
+            try:
+                response = await self._make_request('GET', endpoint, expected_status=(200, 404), params=params)
+            except Exception as e:
+                logger.error("❌ Error obteniendo productos (página %s): %s", pagina, e, extra={'page': pagina})
+                break
+            
+            # Tiendanube responde 404 cuando no hay resultados
+            if response.status_code == 404:
+                self.last_fetch_complete = True
+                break
+            
+            products = parse_products(io.BytesIO(response.content))
+            if products is None:
+                logger.error("❌ Respuesta inesperada de la API en la página %s: no es una lista de productos", pagina)
+                break
+            
+            logger.debug("📦 Página %s: %s productos", pagina, len(products))
+            total += len(products)
+            
+            for product in products:
+                if not full_catalog:
+                    self._log_product(product, hora_actual)
+                sin_stock += product.out_of_stock
+                yield product
+            
+            endpoint = response.links.get('next', {}).get('url')
+            params = None
+            pagina += 1
+            if not endpoint:
+                self.last_fetch_complete = True
+        
+        self._log_fetch_summary(total, sin_stock, pagina - 1)
+
+    async def get_product(self, product_id: str) -> Optional[Product]:
+        try:
+            response = await self._make_request('GET', f'products/{product_id}')
+            return Product.from_json(response.json())
+        except Exception as e:
+            logger.error("❌ Error obteniendo producto %s: %s", product_id, e)
+            return None
+
+    async def get_order(self, order_id: str) -> Optional[Dict]:
+        try:
+            response = await self._make_request('GET', f'orders/{order_id}')
+            return response.json()
+        except Exception as e:
+            logger.error("❌ Error obteniendo orden %s: %s", order_id, e)
+            return None
+
+class AsyncShopifyAPI(ShopifyAPI):
+    def __init__(self, http: AsyncHttp, sku_cache=None):
+        """
+        Versión asíncrona de ShopifyAPI: mismo índice de SKUs, caché y escrituras en lote
+        
+        Args:
+            http (AsyncHttp): Sesión compartida
+            sku_cache (SkuCache, optional): Caché persistente de SKUs
+        """
+        super().__init__(sku_cache)
+        sync_client = self.client
+        sync_client.close()
+        self.client = AsyncApiClient(
+            'Shopify',
+            http,
+            capacity=sync_client.bucket.capacity,
+            refill_rate=sync_client.bucket.refill_rate,
+            rate_limit_parser=shopify_rate_limit
+        )
+        self._index_lock = asyncio.Lock()
+        self._locations_lock = asyncio.Lock()
+
+    async def _make_request(self, method: str, endpoint: str, tokens: float = 1, **kwargs) -> AsyncResponse:
+        response = await self.client.request(method, self._url(endpoint), tokens=tokens, headers=self.headers, **kwargs)
+        
+        if response.status_code not in [200, 201]:
+            logger.error("❌ Error en petición a Shopify: %s", response.status_code,
+                         extra={'status': response.status_code, 'response': response.text[:500]})
+            raise Exception(f"Error en petición a Shopify: {response.status_code}")
+        
+        return response
+
+    async def get_locations(self, force: bool = False) -> list:
+        async with self._locations_lock:
+            expired = time.monotonic() - self._locations_loaded_at > self.locations_ttl
+            if force or self._locations is None or expired:
+                response = await self._make_request('GET', 'locations.json')
+                self._locations = response.json()['locations']
+                self._locations_loaded_at = time.monotonic()
+            return self._locations
+
+    async def resolve_location(self, target: Optional[str] = None) -> Dict:
+        target = str(target or self.default_location)
+        for force in (False, True):
+            location = _match_location(await self.get_locations(force=force), target)
+            if location:
+                return location
+        raise Exception(f"No se encontró la ubicación '{target}'")
+
+    async def _iter_pages(self, endpoint: str, key: str, params: Dict) -> AsyncIterator[Dict]:
+        response = await self._make_request('GET', endpoint, params=params)
+        while True:
+            for item in response.json().get(key, []):
+                yield item
+            
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                break
+            response = await self._make_request('GET', next_url)
+
+    async def iter_inventory_levels(self, location_id) -> AsyncIterator[Tuple[int, Optional[int]]]:
+        params = {'location_ids': str(location_id), 'limit': 250}
+        async for level in self._iter_pages('inventory_levels.json', 'inventory_levels', params):
+            yield level['inventory_item_id'], level.get('available')
+
+    async def build_sku_index(self, updated_at_min: Optional[datetime] = None) -> int:
+        started_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        
+        if self.bulk_index and not updated_at_min:
+            try:
+                touched = {}
+                async for record in self.iter_bulk_query(BULK_VARIANTS_QUERY):
+                    _index_bulk_variant(record, touched)
+                return self._store_index(touched, updated_at_min, started_at)
+            except Exception as e:
+                logger.warning("⚠️ No se pudo exportar el catálogo con Bulk Operations (%s); se recorre por páginas", e)
+        
+        touched = {}
+        async for product in self._iter_pages('products.json', 'products', _index_params(updated_at_min)):
+            _index_variants(product, touched)
+        return self._store_index(touched, updated_at_min, started_at)
+
+    async def run_bulk_query(self, query: str) -> Optional[str]:
+        operation_id = _bulk_operation_id(await self.graphql(BULK_OPERATION_RUN_QUERY, {'query': query}))
+        logger.info("📦 Exportación Bulk Operations iniciada: %s", operation_id)
+        deadline = time.monotonic() + self.bulk_timeout
+        while True:
+            operation = (await self.graphql(BULK_OPERATION_STATUS, {'id': operation_id}))['node']
+            if _bulk_operation_done(operation):
+                return operation.get('url')
+            if time.monotonic() > deadline:
+                await self.graphql(BULK_OPERATION_CANCEL, {'id': operation_id})
+                raise Exception(f"La exportación {operation_id} no terminó en {self.bulk_timeout:g}s")
+            await asyncio.sleep(self.bulk_poll_seconds)
+
+    async def iter_bulk_query(self, query: str) -> AsyncIterator[Dict]:
+        url = await self.run_bulk_query(query)
+        if not url:
+            return
+        # Se lee línea por línea del socket, sin cargar el archivo completo
+        http = self.client.http
+        async with http.session.get(http.yarl.URL(url, encoded=True)) as response:
+            metrics.HTTP_REQUESTS.inc(api=self.client.name, endpoint=metrics.endpoint_label(url), status=response.status)
+            if response.status != 200:
+                raise Exception(f"Error al descargar la exportación Bulk Operations: {response.status}")
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def refresh_sku_index(self) -> int:
+        if self.sku_index_updated_at is None:
+            return await self.build_sku_index()
+        return await self.build_sku_index(updated_at_min=self.sku_index_updated_at)
+
+    async def find_variant_by_sku(self, sku: str) -> Optional[Dict]:
+        entry = self.sku_cache.get(sku) if self.sku_cache else None
+        
+        if not entry:
+            # Solo una tarea recorre el catálogo; el resto espera y usa el índice ya construido
+            async with self._index_lock:
+                if self.sku_index_updated_at is None:
+                    since = self.sku_cache.get_index_built_at() if self.sku_cache else None
+                    await self.build_sku_index(updated_at_min=since)
+                entry = self.sku_index.get(sku)
+                
+                if not entry and not self.sku_index_complete:
+                    await self.build_sku_index()
+                    entry = self.sku_index.get(sku)
+                
+                if not entry and self._sku_index_age() > self.sku_index_max_age:
+                    await self.refresh_sku_index()
+                    entry = self.sku_index.get(sku)
+        
+        return _variant_result(sku, entry)
+
+    async def graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        url = f"{self.api_url}/admin/api/{self.graphql_version}/graphql.json"
+        
+        for attempt in range(self.client.max_retries + 1):
+            response = await self._make_request('POST', url, tokens=0, json={'query': query, 'variables': variables or {}})
+            body = response.json()
+            
+            delay = _throttle_delay(body)
+            if delay is None or attempt == self.client.max_retries:
+                break
+            logger.warning("⚠️ GraphQL de Shopify limitado, reintentando en %.1fs", delay, extra={'delay': delay})
+            await asyncio.sleep(delay)
+        
+        if body.get('errors'):
+            raise Exception(f"Error en GraphQL de Shopify: {body['errors']}")
+        return body['data']
+
+    async def set_inventory_quantities(self, items: List[Tuple[str, str, int]]) -> List[bool]:
+        if not items:
+            return []
+        
+        try:
+            data = await self.graphql(INVENTORY_SET_QUANTITIES, _set_quantities_variables(items))
+        except Exception as e:
+            logger.error("❌ Error al actualizar stock en lote: %s", e, extra={'items': len(items)})
+            return [False] * len(items)
+        
+        failed = _failed_items(data['inventorySetQuantities']['userErrors'], items)
+        if failed is None:
+            return [False] * len(items)
+        if not failed:
+            return [True] * len(items)
+        
+        valid = [i for i in range(len(items)) if i not in failed]
+        return _merge_results(len(items), valid, await self.set_inventory_quantities([items[i] for i in valid]))
+
+    async def sync_products_from_tiendanube(self, product: Product, writer: 'AsyncInventoryWriter',
+                                            location: Optional[str] = None, failures: Optional[list] = None) -> bool:
+        """
+        Encola en el writer el stock de un producto de Tiendanube (siempre en lote)
+        
+        Args:
+            product (Product): Producto de Tiendanube
+            writer (AsyncInventoryWriter): Writer en lote de la tienda
+            location (str, optional): Nombre o ID de la ubicación de Shopify destino
+            failures (list, optional): Si se indica, se agregan pares (SKU, motivo) por cada fallo
+        
+        Returns:
+            bool: True si todas las variantes se encolaron
+        """
+        try:
+            shop_location = await self.resolve_location(location)
+            
+            success = True
+            for sku, stock in product.stock_items():
+                result = await self.find_variant_by_sku(sku)
+                if not result:
+                    logger.debug("❌ No se encontró SKU (ID Tiendanube): %s", sku, extra=log.SAMPLED)
+                    _report(failures, sku, FAILURE_SKU_NOT_FOUND)
+                    success = False
+                    continue
+                
+                inventory_item_id = result['variant'].get('inventory_item_id')
+                if not inventory_item_id:
+                    logger.debug("❌ No se encontró inventory_item_id para SKU: %s", sku, extra=log.SAMPLED)
+                    _report(failures, sku, FAILURE_NO_INVENTORY_ITEM)
+                    success = False
+                    continue
+                
+                writer.add(inventory_item_id, shop_location['id'], stock, sku=sku, ref=product.id)
+                if writer.full:
+                    await writer.flush()
+            
+            return success
+        
+        except Exception as e:
+            logger.error("❌ Error sincronizando producto %s: %s", product.id, e)
+            _report(failures, str(product.id), FAILURE_ERROR)
+            return False
+
+class AsyncInventoryWriter(InventoryWriter):
+    # add() nunca bloquea: el llamador espera flush() cuando el lote está lleno
+    auto_flush = False
+
+    async def flush(self) -> Dict[Tuple[str, str], bool]:
+        flushed = {}
+        skipped_before = self.skipped
+        for chunk, items in self._batches(flushed):
+            logger.debug("🚚 Enviando lote de %s actualizaciones de stock a Shopify", len(items))
+            self._apply(chunk, await self.shopify.set_inventory_quantities(items), flushed)
+        return self._summarize(flushed, self.skipped - skipped_before)
+
+async def sync_store_async(store_config: dict, shopify: AsyncShopifyAPI, http: AsyncHttp) -> int:
+    """
+    Versión asíncrona de sync_store: misma ventana, deduplicación, marca de agua y métricas
+    
+    Args:
+        store_config (dict): Configuración de la tienda
+        shopify (AsyncShopifyAPI): Instancia compartida
+        http (AsyncHttp): Sesión compartida
+    
+    Returns:
+        int: Número de productos sincronizados
+    """
+    try:
+        api_url = store_config['api_url']
+        logger.info("🏪 Procesando tienda %s", api_url)
+        inicio = time.monotonic()
+        
+        tiendanube = AsyncTiendanubeAPI(http, store_config['api_url'], store_config['token'], store_config['user_agent'])
+        
+        # SQLite sigue siendo bloqueante: son consultas locales y cortas
+        state = SyncState()
+        marca, desde = _fetch_window(state, api_url)
+        writer = AsyncInventoryWriter(shopify)
+        location = store_config.get('shopify_location')
+        
+        productos_encontrados = 0
+        productos_duplicados = 0
+        productos_ok = set()
+        productos_sin_mapeo = set()
+        fallos_registro = []
+        versiones = {}
+        
+        async for producto in tiendanube.iter_products(updated_at_min=desde):
+            productos_encontrados += 1
+            updated_at = producto.updated_at
+            versiones[producto.id] = (parse_updated_at(updated_at), updated_at)
+            
+            if state.is_synced(api_url, producto.id, updated_at):
+                productos_duplicados += 1
+                productos_ok.add(producto.id)
+                continue
+            
+            try:
+                fallos = []
+                if await shopify.sync_products_from_tiendanube(producto, writer, location, fallos):
+                    productos_ok.add(producto.id)
+                    continue
+                if fallos and all(motivo in PERMANENT_FAILURES for _, motivo in fallos):
+                    productos_sin_mapeo.add(producto.id)
+                fallos_registro.extend(product_failures(producto, fallos))
+            
+            except Exception as e:
+                logger.error("❌ Error sincronizando producto %s: %s", producto.id, e)
+                fallos_registro.extend(product_failures(producto, [(str(producto.id), FAILURE_ERROR)]))
+                continue
+        
+        with metrics.timer('shopify_flush'):
+            await writer.flush()
+        productos_ok -= writer.failed_refs
+        _update_dead_letters(api_url, fallos_registro, writer, productos_ok)
+        productos_sincronizados = len(productos_ok) - productos_duplicados
+        
+        productos_terminados = productos_ok | (productos_sin_mapeo - writer.failed_refs)
+        _advance_watermark(state, api_url, marca, desde, versiones, productos_terminados,
+                           tiendanube.last_fetch_complete)
+        
+        segundos = time.monotonic() - inicio
+        metrics.STAGE_DURATION.observe(segundos, stage='store')
+        metrics.ITEMS_PER_SECOND.set(round(productos_encontrados / segundos, 2) if segundos else 0, store=api_url)
+        metrics.ITEMS.inc(productos_sincronizados, stage='sync', result='ok')
+        metrics.ITEMS.inc(productos_duplicados, stage='sync', result='duplicado')
+        metrics.ITEMS.inc(len(productos_sin_mapeo), stage='sync', result='sin_mapeo')
+        metrics.ITEMS.inc(max(productos_encontrados - len(productos_ok) - len(productos_sin_mapeo), 0),
+                          stage='sync', result='fallido')
+        
+        logger.info(
+            "✅ Tienda sincronizada: %s/%s productos (%s ya sincronizados, %s sin mapeo en Shopify)",
+            productos_sincronizados, productos_encontrados, productos_duplicados, len(productos_sin_mapeo),
+            extra={
+                'products_found': productos_encontrados,
+                'products_synced': productos_sincronizados,
+                'products_duplicated': productos_duplicados,
+                'products_unmapped': len(productos_sin_mapeo),
+                'writes_skipped': writer.skipped,
+                'requests': tiendanube.client.requests_sent,
+            }
+        )
+        return productos_sincronizados
+    
+    except Exception as e:
+        logger.exception("❌ Error procesando tienda: %s", e)
+        return 0
+
+async def _timed_sync_store(store: dict, shopify: AsyncShopifyAPI, http: AsyncHttp,
+                            limit: asyncio.Semaphore, leases: Optional[StoreLeases] = None) -> Optional[dict]:
+    async with limit:
+        inicio = time.monotonic()
+        with log.store_context(store['api_url']):
+            if leases is None:
+                productos_sincronizados = await sync_store_async(store, shopify, http)
+            else:
+                # El préstamo se toma y se renueva en SQLite (consultas locales y cortas)
+                with leases.hold(store['api_url']) as acquired:
+                    if not acquired:
+                        logger.info("🔒 %s se está sincronizando en otro worker; se omite", store['api_url'])
+                        metrics.ITEMS.inc(1, stage='shard', result='en_curso')
+                        return None
+                    productos_sincronizados = await sync_store_async(store, shopify, http)
+        return {
+            'api_url': store['api_url'],
+            'productos': productos_sincronizados,
+            'segundos': time.monotonic() - inicio
+        }
+
+async def run_async(stores: List[dict], leases: Optional[StoreLeases] = None) -> List[dict]:
+    """
+    Sincroniza todas las tiendas en un solo hilo, con una tarea por tienda
+    
+    Args:
+        stores (List[dict]): Configuración de las tiendas
+        leases (StoreLeases, optional): Préstamos compartidos entre workers (ver src/sharding.py)
+    
+    Returns:
+        List[dict]: Resumen de cada tienda sincronizada, en el mismo orden (sin las que
+            otro worker estaba sincronizando)
+    """
+    http = AsyncHttp()
+    try:
+        shopify = AsyncShopifyAPI(http)
+        # Tiendas en curso a la vez (las peticiones ya se limitan por host y por balde)
+        limit = asyncio.Semaphore(max(1, int(os.getenv('ASYNC_MAX_STORES', 50))))
+        resumenes = await asyncio.gather(*(_timed_sync_store(store, shopify, http, limit, leases) for store in stores))
+        return [resumen for resumen in resumenes if resumen]
+    finally:
+        await http.close()
+
+def main():
+    """Sincroniza todas las tiendas con el motor asíncrono (SYNC_ENGINE=async o --engine async)"""
+    log.new_run()
+    metrics.start_from_env()
+    try:
+        stores = shard_from_env(StoreConfig().get_all_stores())
+        logger.info("🔄 Procesando %s tiendas con el motor asíncrono", len(stores))
+        
+        inicio = time.monotonic()
+        with metrics.profiled('sync_async'):
+            resumenes = asyncio.run(run_async(stores, leases_from_env()))
+        
+        total_productos_sincronizados = sum(resumen['productos'] for resumen in resumenes)
+        for i, resumen in enumerate(resumenes, 1):
+            logger.info("📦 Tienda %s/%s %s: %s productos en %.1fs", i, len(stores), resumen['api_url'],
+                        resumen['productos'], resumen['segundos'], extra=resumen)
+        logger.info("🎉 Proceso completado en %.1fs: %s productos sincronizados",
+                    time.monotonic() - inicio, total_productos_sincronizados,
+                    extra={'stores': len(stores), 'products_synced': total_productos_sincronizados})
+    
+    except Exception as e:
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('sync')
+
+if __name__ == "__main__":
+    main()
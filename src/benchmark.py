@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from typing import Callable, Dict, List, Optional, Tuple
+from src.fake_server import client_env
+
+# Los logs por producto distorsionan la medición: por defecto solo advertencias
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _get(port: int, path: str) -> Dict:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=5) as response:
+        return json.loads(response.read())
+
+def start_server(variants: int, stores: int, latency_ms: float, realistic_limits: bool) -> Tuple[subprocess.Popen, int]:
+    """
+    Levanta el servidor falso en otro proceso, para que su memoria y su CPU no se midan
+    
+    Returns:
+        Tuple[subprocess.Popen, int]: Proceso y puerto
+    """
+    port = _free_port()
+    command = [
+        sys.executable, '-m', 'src.fake_server',
+        '--port', str(port),
+        '--variants', str(variants),
+        '--stores', str(stores),
+        '--latency-ms', str(latency_ms)
+    ]
+    if realistic_limits:
+        command += ['--shopify-rate', '2', '--graphql-rate', '50', '--tiendanube-rate', '2']
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"El servidor falso terminó con código {process.returncode}")
+        try:
+            _get(port, '/_stats')
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise Exception("El servidor falso no respondió a tiempo")
+
+def _configure_env(port: int, stores: int, workdir: str, realistic_limits: bool, index: str = 'bulk') -> None:
+    os.environ.update(client_env(port, stores))
+    # Índice de SKUs por exportación Bulk Operations o paginando products.json
+    os.environ['SHOPIFY_BULK_INDEX'] = 'true' if index == 'bulk' else 'false'
+    os.environ['SHOPIFY_BULK_POLL_SECONDS'] = '0.1'
+    # Estado nuevo en cada corrida: marcas de agua, caché de SKUs, snapshot y cola
+    os.environ['SYNC_DB_PATH'] = os.path.join(workdir, 'sync_state.db')
+    os.environ['SYNC_INITIAL_LOOKBACK_MINUTES'] = '120'
+    if not realistic_limits:
+        # Sin límites del lado del cliente, para medir el costo propio del código
+        for key in ('SHOPIFY_MAX_REQUESTS_PER_SECOND', 'TIENDANUBE_MAX_REQUESTS_PER_SECOND'):
+            os.environ[key] = '100000'
+        for key in ('SHOPIFY_BUCKET_SIZE', 'TIENDANUBE_BUCKET_SIZE'):
+            os.environ[key] = '100000'
+
+def _load_command(command: str) -> Callable[[], None]:
+    """Importa el comando antes de medir, para que el costo de importar no cuente en la corrida"""
+    if command == 'sync':
+        from src.sync_products import main
+    elif command == 'async':
+        from src.async_engine import main
+    elif command == 'pipeline':
+        from src.pipeline import main
+    elif command == 'reconcile':
+        from src.reconcile import main
+    else:
+        raise ValueError(f"Comando desconocido: {command}")
+    return main
+
+def run_once(variants: int, command: str = 'sync', stores: int = 1, latency_ms: float = 0,
+             realistic_limits: bool = False, trace_memory: bool = True, index: str = 'bulk') -> Dict:
+    """
+    Ejecuta un comando contra el servidor falso y mide tiempo, llamadas y memoria
+    
+    Args:
+        variants (int): Variantes del catálogo
+        command (str): 'sync', 'async', 'pipeline' o 'reconcile'
+        stores (int): Tiendas de Tiendanube
+        latency_ms (float): Latencia agregada a cada respuesta del servidor
+        realistic_limits (bool): Si es True, aplica los límites de las APIs reales en ambos lados
+        trace_memory (bool): Si es True, mide el pico de memoria con tracemalloc (hace más lenta la corrida)
+        index (str): 'bulk' (exportación Bulk Operations) o 'pages' (products.json) para el índice de SKUs
+    
+    Returns:
+        Dict: Resultado de la corrida
+    """
+    process, port = start_server(variants, stores, latency_ms, realistic_limits)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            _configure_env(port, stores, workdir, realistic_limits, index)
+            run = _load_command(command)
+            if trace_memory:
+                tracemalloc.start()
+            inicio = time.perf_counter()
+            run()
+            wall = time.perf_counter() - inicio
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+            if trace_memory:
+                tracemalloc.stop()
+            stats = _get(port, '/_stats')
+    finally:
+        process.terminate()
+        process.wait()
+    
+    return {
+        'command': command,
+        'variants': variants,
+        'stores': stores,
+        'wall_seconds': round(wall, 3),
+        'variants_per_second': round(variants / wall, 1) if wall else None,
+        'api_calls': stats['total_calls'],
+        'calls': stats['calls'],
+        'writes': stats['writes'],
+        'levels_checksum': stats['levels_checksum'],
+        'peak_memory_mb': round(peak / 1024 / 1024, 2) if peak is not None else None
+    }
+
+def _print_report(results: List[Dict]) -> None:
+    print(f"\n{'Variantes':>10} {'Comando':>10} {'Segundos':>10} {'Var/s':>10} {'Llamadas':>10} {'Escrituras':>11} {'Pico MB':>9}")
+    for result in results:
+        peak = '-' if result['peak_memory_mb'] is None else f"{result['peak_memory_mb']:.1f}"
+        print(f"{result['variants']:>10} {result['command']:>10} {result['wall_seconds']:>10.2f} "
+              f"{result['variants_per_second']:>10.0f} {result['api_calls']:>10} {result['writes']:>11} {peak:>9}")
+    for result in results:
+        print(f"\n🔑 Huella del inventario final ({result['variants']} variantes): {result['levels_checksum']}")
+        print(f"📊 Llamadas por endpoint ({result['variants']} variantes):")
+        for key, count in sorted(result['calls'].items()):
+            print(f"   {key}: {count}")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark de la sincronización contra APIs simuladas')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='Tamaños de catálogo (variantes), separados por coma')
+    parser.add_argument('--command', choices=('sync', 'async', 'pipeline', 'reconcile'), default='sync')
+    parser.add_argument('--stores', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--realistic-limits', action='store_true',
+                        help='Aplica los límites de las APIs reales (2 peticiones/s); las corridas grandes tardan mucho')
+    parser.add_argument('--index', choices=('bulk', 'pages'), default='bulk',
+                        help='Cómo se construye el índice de SKUs de Shopify')
+    parser.add_argument('--no-memory', action='store_true', help='No mide memoria (tracemalloc agrega overhead)')
+    parser.add_argument('--json', help='Guarda los resultados en un archivo JSON')
+    args = parser.parse_args(argv)
+    
+    results = []
+    for size in (int(value) for value in args.sizes.split(',') if value.strip()):
+        print(f"⏱️ {args.command} con {size} variantes...", flush=True)
+        results.append(run_once(size, args.command, args.stores, args.latency_ms,
+                                args.realistic_limits, not args.no_memory, args.index))
+    
+    _print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
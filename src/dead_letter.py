@@ -0,0 +1,320 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from src.storage import connect
+from src.models import Product
+from src.shopify import FAILURE_SKU_NOT_FOUND, FAILURE_NO_INVENTORY_ITEM, FAILURE_WRITE, FAILURE_ERROR
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+# El producto no se pudo obtener de Tiendanube (borrado o error al consultarlo)
+FAILURE_PRODUCT_NOT_FOUND = 'producto_no_encontrado'
+
+REASONS = (FAILURE_SKU_NOT_FOUND, FAILURE_NO_INVENTORY_ITEM, FAILURE_WRITE, FAILURE_ERROR, FAILURE_PRODUCT_NOT_FOUND)
+
+# (product_id, sku, motivo, payload)
+Failure = Tuple[int, str, str, Dict]
+
+def product_failures(product: Product, failures: List[Tuple[str, str]]) -> List[Failure]:
+    """
+    Convierte los fallos que informa sync_products_from_tiendanube en entradas del registro
+    
+    Args:
+        product (Product): Producto de Tiendanube
+        failures (List[Tuple[str, str]]): Pares (SKU, motivo); con FAILURE_ERROR el SKU es el ID del producto
+    
+    Returns:
+        List[Failure]: Entradas con la cantidad que se quería escribir
+    """
+    stock = dict(product.stock_items())
+    return [
+        (product.id, sku, reason, {'quantity': stock.get(sku), 'updated_at': product.updated_at})
+        for sku, reason in failures
+    ]
+
+def writer_failures(writer) -> List[Failure]:
+    """
+    Entradas del registro para las escrituras en lote que Shopify rechazó
+    
+    Args:
+        writer (InventoryWriter): Writer ya enviado (ver InventoryWriter.failed_entries)
+    
+    Returns:
+        List[Failure]: Una entrada por SKU y producto de cada item fallido
+    """
+    rows = []
+    for key, entry in getattr(writer, 'failed_entries', []):
+        payload = {'quantity': entry['quantity'], 'inventory_item_id': key[0], 'location_id': key[1]}
+        for ref in entry['refs']:
+            for sku in entry['skus'] or ['']:
+                rows.append((ref, sku, FAILURE_WRITE, payload))
+    return rows
+
+class DeadLetterLog:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Registro persistente de los items que no se pudieron sincronizar
+        
+        Cada fallo queda con su motivo, la cantidad que se quería escribir y la cantidad de
+        intentos, hasta que el producto se sincroniza bien (en una ejecución normal, un webhook
+        o retry-failed).
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+        """
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    store TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    sku TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    payload TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 1,
+                    first_failed_at REAL NOT NULL,
+                    last_failed_at REAL NOT NULL,
+                    PRIMARY KEY (store, product_id, sku)
+                )
+            """)
+
+    def record(self, store: str, failures: Iterable[Failure]) -> int:
+        """
+        Registra fallos; un item que ya estaba suma un intento y toma el último motivo
+        
+        Args:
+            store (str): URL de API de la tienda
+            failures (Iterable[Failure]): Entradas (product_id, sku, motivo, payload)
+        
+        Returns:
+            int: Entradas registradas
+        """
+        now = time.time()
+        rows = [(store, product_id, sku, reason, json.dumps(payload), now, now)
+                for product_id, sku, reason, payload in failures]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO dead_letters (store, product_id, sku, reason, payload, first_failed_at, last_failed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (store, product_id, sku) DO UPDATE SET
+                    reason = excluded.reason,
+                    payload = excluded.payload,
+                    attempts = dead_letters.attempts + 1,
+                    last_failed_at = excluded.last_failed_at
+            """, rows)
+        for reason in {row[3] for row in rows}:
+            metrics.ITEMS.inc(sum(1 for row in rows if row[3] == reason), stage='dead_letter', result=reason)
+        logger.info("📮 %s fallos registrados para reintentar", len(rows), extra={'store': store, 'failures': len(rows)})
+        self.export_metrics()
+        return len(rows)
+
+    def resolve(self, store: str, product_ids: Iterable) -> int:
+        """
+        Quita del registro los productos que se sincronizaron bien
+        
+        Args:
+            store (str): URL de API de la tienda
+            product_ids (Iterable): IDs de productos sincronizados
+        
+        Returns:
+            int: Entradas quitadas
+        """
+        rows = [(store, product_id) for product_id in product_ids]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany('DELETE FROM dead_letters WHERE store = ? AND product_id = ?', rows)
+            resolved = self._conn.total_changes - before
+        if resolved:
+            metrics.ITEMS.inc(resolved, stage='dead_letter', result='resuelto')
+            self.export_metrics()
+        return resolved
+
+    def pending(self, store: Optional[str] = None, reasons: Optional[Sequence[str]] = None,
+                limit: Optional[int] = None) -> List[Dict]:
+        """
+        Entradas pendientes, las más viejas primero
+        
+        Args:
+            store (str, optional): Solo las de esta tienda (URL de API)
+            reasons (Sequence[str], optional): Solo estos motivos
+            limit (int, optional): Máximo de entradas
+        
+        Returns:
+            List[Dict]: Entradas con store, product_id, sku, reason, payload, attempts y fechas
+        """
+        query = 'SELECT * FROM dead_letters WHERE 1 = 1'
+        params: List = []
+        if store:
+            query += ' AND store = ?'
+            params.append(store)
+        if reasons:
+            query += f" AND reason IN ({', '.join('?' for _ in reasons)})"
+            params.extend(reasons)
+        query += ' ORDER BY first_failed_at'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row, payload=json.loads(row['payload']) if row['payload'] else None) for row in rows]
+
+    def counts(self) -> Dict[Tuple[str, str], int]:
+        """Entradas pendientes por (tienda, motivo)"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT store, reason, COUNT(*) AS n FROM dead_letters GROUP BY store, reason ORDER BY store, reason'
+            ).fetchall()
+        return {(row['store'], row['reason']): row['n'] for row in rows}
+
+    def clear(self, store: Optional[str] = None, reasons: Optional[Sequence[str]] = None) -> int:
+        """Descarta entradas (por ejemplo, SKUs que se sabe que no existen en Shopify)"""
+        query = 'DELETE FROM dead_letters WHERE 1 = 1'
+        params: List = []
+        if store:
+            query += ' AND store = ?'
+            params.append(store)
+        if reasons:
+            query += f" AND reason IN ({', '.join('?' for _ in reasons)})"
+            params.extend(reasons)
+        with self._lock, self._conn:
+            cleared = self._conn.execute(query, params).rowcount
+        self.export_metrics()
+        return cleared
+
+    def export_metrics(self) -> None:
+        """Actualiza el gauge de entradas pendientes por motivo"""
+        by_reason = dict.fromkeys(REASONS, 0)
+        for (_, reason), n in self.counts().items():
+            by_reason[reason] = by_reason.get(reason, 0) + n
+        for reason, n in by_reason.items():
+            metrics.DEAD_LETTERS.set(n, reason=reason)
+
+def from_env() -> Optional[DeadLetterLog]:
+    """
+    Crea el registro de fallos salvo que DEAD_LETTERS sea 'false'
+    
+    Returns:
+        Optional[DeadLetterLog]: Registro, o None si está desactivado
+    """
+    load_dotenv()
+    if os.getenv('DEAD_LETTERS', 'true').lower() == 'false':
+        return None
+    return DeadLetterLog()
+
+def retry_failed(store: Optional[str] = None, reasons: Optional[Sequence[str]] = None,
+                 limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Vuelve a sincronizar solo los productos del registro, consultándolos por ID (sin recorrer el catálogo)
+    
+    Args:
+        store (str, optional): Solo esta tienda (ID de Tiendanube o URL de API)
+        reasons (Sequence[str], optional): Solo estos motivos
+        limit (int, optional): Máximo de entradas a reintentar
+    
+    Returns:
+        Dict[str, int]: Productos reintentados, sincronizados, no encontrados en Tiendanube y entradas que siguen pendientes
+    """
+    from src.store_config import StoreConfig
+    from src.shopify import ShopifyAPI
+    from src.sync_products import sync_products_by_id
+    
+    store_config = StoreConfig()
+    store_url = None
+    if store:
+        try:
+            store_url = store_config.get_store_config(store)['api_url']
+        except ValueError:
+            store_url = store_config.get_store_by_id(store)['api_url']
+    
+    dead_letters = DeadLetterLog()
+    entries = dead_letters.pending(store_url, reasons, limit)
+    by_store: Dict[str, List[int]] = {}
+    for entry in entries:
+        ids = by_store.setdefault(entry['store'], [])
+        if entry['product_id'] not in ids:
+            ids.append(entry['product_id'])
+    
+    resumen = {'entries': len(entries), 'products': sum(len(ids) for ids in by_store.values()), 'synced': 0,
+               'not_found': 0}
+    if not entries:
+        logger.info("✅ No hay fallos pendientes para reintentar")
+        resumen['pending'] = 0
+        return resumen
+    
+    logger.info("🔁 Reintentando %s productos (%s fallos) de %s tiendas", resumen['products'], len(entries),
+                len(by_store), extra=resumen)
+    shopify = ShopifyAPI()
+    for api_url, product_ids in by_store.items():
+        try:
+            config = store_config.get_store_config(api_url)
+        except ValueError:
+            logger.warning("⚠️ %s ya no está configurada; se conservan sus fallos", api_url)
+            continue
+        no_encontrados = []
+        with log.store_context(api_url):
+            resumen['synced'] += sync_products_by_id(config, product_ids, shopify, no_encontrados)
+        if no_encontrados:
+            logger.warning("⚠️ %s productos no se pudieron obtener de Tiendanube; siguen en el registro como '%s'",
+                           len(no_encontrados), FAILURE_PRODUCT_NOT_FOUND,
+                           extra={'store': api_url, 'product_ids': no_encontrados[:50]})
+        resumen['not_found'] += len(no_encontrados)
+    
+    resumen['pending'] = sum(dead_letters.counts().values())
+    logger.info("🎉 Reintento completado: %s/%s productos sincronizados, %s no encontrados, %s fallos pendientes",
+                resumen['synced'], resumen['products'], resumen['not_found'], resumen['pending'], extra=resumen)
+    return resumen
+
+def status() -> None:
+    """Muestra los fallos pendientes por tienda y motivo"""
+    counts = DeadLetterLog().counts()
+    if not counts:
+        print("No hay fallos pendientes")
+        return
+    print(f"{'Tienda':<45} {'Motivo':<20} {'Items':>6}")
+    for (store, reason), n in counts.items():
+        print(f"{store:<45} {reason:<20} {n:>6}")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Registro de fallos de sincronización')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    retry_parser = subparsers.add_parser('retry-failed', help='Vuelve a sincronizar solo los productos con fallos')
+    retry_parser.add_argument('--store', help='Solo esta tienda (ID de Tiendanube o URL de API)')
+    retry_parser.add_argument('--reason', action='append', choices=REASONS, help='Solo este motivo (se puede repetir)')
+    retry_parser.add_argument('--limit', type=int, help='Máximo de fallos a reintentar (los más viejos primero)')
+    subparsers.add_parser('status', help='Muestra los fallos pendientes por tienda y motivo')
+    clear_parser = subparsers.add_parser('clear', help='Descarta fallos del registro')
+    clear_parser.add_argument('--store', help='Solo esta tienda (URL de API)')
+    clear_parser.add_argument('--reason', action='append', choices=REASONS, help='Solo este motivo (se puede repetir)')
+    
+    args = parser.parse_args()
+    if args.command == 'status':
+        status()
+        return
+    if args.command == 'clear':
+        print(f"{DeadLetterLog().clear(args.store, args.reason)} fallos descartados")
+        return
+    
+    log.new_run()
+    metrics.start_from_env()
+    try:
+        retry_failed(args.store, args.reason, args.limit)
+    finally:
+        metrics.export('retry_failed')
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.exception("❌ Error: %s", e)
+        sys.exit(1)
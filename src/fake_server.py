@@ -0,0 +1,615 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# Primeros IDs de cada tipo de objeto, para que no se mezclen entre sí
+TN_PRODUCT_BASE = 1_000_000
+TN_VARIANT_BASE = 10_000_000
+SHOPIFY_PRODUCT_BASE = 5_000_000
+SHOPIFY_VARIANT_BASE = 6_000_000
+INVENTORY_ITEM_BASE = 7_000_000
+LOCATION_ID = 1
+LOCATION_NAME = 'Shop location'
+STORE_ID_BASE = 1001
+
+def _parse_datetime(value: str) -> Optional[datetime]:
+    """Interpreta updated_at_min en los formatos que envían los clientes de Tiendanube y Shopify"""
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+class FakeCatalog:
+    def __init__(self, variants: int, stores: int = 1, variants_per_product: int = 4, unmapped: float = 0.01,
+                 window_minutes: float = 30, seed: int = 42, shared: bool = False):
+        """
+        Catálogo sintético compartido por los dos servidores falsos
+        
+        Cada variante de Tiendanube tiene su variante en Shopify con SKU = ID de la variante
+        de Tiendanube, salvo una fracción sin mapeo para ejercitar ese camino.
+        
+        Args:
+            variants (int): Cantidad total de variantes (repartidas entre las tiendas)
+            stores (int): Cantidad de tiendas de Tiendanube
+            variants_per_product (int): Variantes por producto
+            unmapped (float): Fracción de variantes que no existen en Shopify
+            window_minutes (float): Los productos se marcan modificados dentro de esta ventana
+            seed (int): Semilla para que el catálogo sea reproducible
+            shared (bool): Si es True, todas las tiendas venden los mismos productos (mismos IDs)
+                con stock propio, para ejercitar la agregación entre tiendas
+        """
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        self.lock = threading.Lock()
+        
+        # store_id -> lista de (updated_at, producto de Tiendanube)
+        self.tiendanube: Dict[str, List[Tuple[datetime, Dict]]] = {}
+        self.tiendanube_by_id: Dict[str, Dict[int, Dict]] = {}
+        # Productos de Shopify ordenados por ID: (updated_at, producto)
+        self.shopify: List[Tuple[datetime, Dict]] = []
+        # inventory_item_id -> cantidad disponible en la única ubicación
+        self.levels: Dict[int, int] = {}
+        
+        per_store = variants if shared else max(variants // max(stores, 1), 1)
+        variant_counter = 0
+        product_counter = 0
+        for s in range(1 if shared else stores):
+            store_id = str(STORE_ID_BASE + s)
+            products = []
+            remaining = per_store
+            while remaining > 0:
+                count = min(variants_per_product, remaining)
+                remaining -= count
+                updated_at = now - timedelta(seconds=rng.uniform(0, window_minutes * 60))
+                tn_variants = []
+                sh_variants = []
+                for _ in range(count):
+                    tn_id = TN_VARIANT_BASE + variant_counter
+                    stock = rng.choice([None, 0, 0]) if rng.random() < 0.05 else rng.randint(0, 50)
+                    tn_variants.append({'id': tn_id, 'product_id': TN_PRODUCT_BASE + product_counter, 'stock': stock})
+                    if rng.random() >= unmapped:
+                        item_id = INVENTORY_ITEM_BASE + variant_counter
+                        sh_variants.append({
+                            'id': SHOPIFY_VARIANT_BASE + variant_counter,
+                            'sku': str(tn_id),
+                            'inventory_item_id': item_id
+                        })
+                        self.levels[item_id] = rng.randint(0, 50)
+                    variant_counter += 1
+                product = {
+                    'id': TN_PRODUCT_BASE + product_counter,
+                    'name': {'es': f'Producto {product_counter}'},
+                    'published': True,
+                    'updated_at': updated_at.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+                    'variants': tn_variants
+                }
+                products.append((updated_at, product))
+                if sh_variants:
+                    self.shopify.append((updated_at, {'id': SHOPIFY_PRODUCT_BASE + product_counter, 'variants': sh_variants}))
+                product_counter += 1
+            self.tiendanube[store_id] = products
+            self.tiendanube_by_id[store_id] = {product['id']: product for _, product in products}
+        
+        if shared:
+            self._share_first_store(rng, stores)
+        
+        self.variants = variant_counter
+        self._filtered: Dict[Tuple, List] = {}
+
+    def _share_first_store(self, rng: random.Random, stores: int) -> None:
+        """Reemplaza el catálogo de cada tienda por una copia del de la primera, con otro stock"""
+        first = self.tiendanube[str(STORE_ID_BASE)]
+        for s in range(1, stores):
+            products = []
+            for updated_at, product in first:
+                variants = [dict(variant, stock=rng.randint(0, 50)) for variant in product['variants']]
+                products.append((updated_at, dict(product, variants=variants)))
+            store_id = str(STORE_ID_BASE + s)
+            self.tiendanube[store_id] = products
+            self.tiendanube_by_id[store_id] = {product['id']: product for _, product in products}
+
+    def filtered(self, source: str, store_id: Optional[str], updated_at_min: Optional[datetime]) -> List[Dict]:
+        """Productos modificados desde una fecha (se memoriza por consulta: la paginación la repite)"""
+        key = (source, store_id, updated_at_min)
+        with self.lock:
+            result = self._filtered.get(key)
+            if result is None:
+                products = self.tiendanube.get(store_id, []) if source == 'tiendanube' else self.shopify
+                result = [product for updated_at, product in products
+                          if updated_at_min is None or updated_at >= updated_at_min]
+                self._filtered[key] = result
+            return result
+
+class LeakyBucket:
+    def __init__(self, capacity: float, leak_rate: float):
+        """Balde con pérdida como el de las APIs reales: se llena con cada petición y se vacía con el tiempo"""
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.level = 0.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float = 1) -> Tuple[bool, float]:
+        """
+        Intenta sumar una petición al balde
+        
+        Returns:
+            Tuple[bool, float]: (aceptada, nivel del balde)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.level = max(self.level - (now - self.updated_at) * self.leak_rate, 0.0)
+            self.updated_at = now
+            if self.level + amount > self.capacity:
+                return False, self.level
+            self.level += amount
+            return True, self.level
+
+class FakeApiState:
+    def __init__(self, catalog: FakeCatalog, latency: float = 0.0, shopify_rate: float = 0.0,
+                 tiendanube_rate: float = 0.0, graphql_restore_rate: float = 0.0, bulk_seconds: float = 0.5):
+        """
+        Estado del servidor: catálogo, límites simulados y contadores de peticiones
+        
+        Args:
+            catalog (FakeCatalog): Catálogo sintético
+            latency (float): Segundos de latencia agregados a cada respuesta
+            shopify_rate (float): Peticiones REST por segundo de Shopify (0 = sin límite; balde de 40)
+            tiendanube_rate (float): Peticiones por segundo por tienda de Tiendanube (0 = sin límite; balde de 40)
+            graphql_restore_rate (float): Puntos de costo GraphQL por segundo (0 = sin límite; balde de 1000)
+            bulk_seconds (float): Segundos que tarda en completarse una exportación Bulk Operations
+        """
+        self.catalog = catalog
+        self.latency = latency
+        self.shopify_bucket = LeakyBucket(40, shopify_rate) if shopify_rate else None
+        self.graphql_bucket = LeakyBucket(1000, graphql_restore_rate) if graphql_restore_rate else None
+        self.tiendanube_rate = tiendanube_rate
+        self.tiendanube_buckets: Dict[str, LeakyBucket] = {}
+        self.bulk_seconds = bulk_seconds
+        # ID de operación -> {'ready_at', 'status', 'data', 'count'}
+        self.bulk_operations: Dict[str, Dict] = {}
+        self.calls: Counter = Counter()
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def count(self, api: str, endpoint: str, status: int) -> None:
+        with self._lock:
+            self.calls[f'{api} {endpoint} {status}'] += 1
+
+    def count_writes(self, amount: int) -> None:
+        with self._lock:
+            self.writes += amount
+
+    def tiendanube_bucket(self, store_id: str) -> Optional[LeakyBucket]:
+        if not self.tiendanube_rate:
+            return None
+        with self._lock:
+            return self.tiendanube_buckets.setdefault(store_id, LeakyBucket(40, self.tiendanube_rate))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'total_calls': sum(self.calls.values()),
+                'writes': self.writes,
+                'variants': self.catalog.variants,
+                # Huella del inventario final, para comparar corridas (p. ej. motor sync vs async)
+                'levels_checksum': hashlib.sha256(
+                    json.dumps(sorted(self.catalog.levels.items())).encode('utf-8')).hexdigest()[:16]
+            }
+
+    def start_bulk(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Lanza una exportación de variantes como bulkOperationRunQuery (una sola en curso a la vez)
+        
+        Returns:
+            Tuple[Optional[str], Optional[str]]: (ID de la operación, mensaje de error)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if any(op['status'] == 'RUNNING' and op['ready_at'] > now for op in self.bulk_operations.values()):
+                return None, 'A bulk query operation for this app and shop is already in progress'
+            operation_id = f'gid://shopify/BulkOperation/{len(self.bulk_operations) + 1}'
+            self.bulk_operations[operation_id] = {'ready_at': now + self.bulk_seconds, 'status': 'RUNNING'}
+        
+        # El archivo refleja el catálogo al momento de lanzar la exportación
+        lines = []
+        with self.catalog.lock:
+            for _, product in self.catalog.shopify:
+                for variant in product['variants']:
+                    lines.append(json.dumps({
+                        'id': f"gid://shopify/ProductVariant/{variant['id']}",
+                        'sku': variant['sku'],
+                        'product': {'id': f"gid://shopify/Product/{product['id']}"},
+                        'inventoryItem': {'id': f"gid://shopify/InventoryItem/{variant['inventory_item_id']}"}
+                    }))
+        with self._lock:
+            self.bulk_operations[operation_id].update(
+                data=('\n'.join(lines) + '\n').encode('utf-8') if lines else b'', count=len(lines))
+        return operation_id, None
+
+    def bulk_operation(self, operation_id: str) -> Optional[Dict]:
+        """Estado de una exportación (RUNNING hasta que pasan bulk_seconds)"""
+        with self._lock:
+            operation = self.bulk_operations.get(operation_id)
+            if operation and operation['status'] == 'RUNNING' and time.monotonic() >= operation['ready_at']:
+                operation['status'] = 'COMPLETED'
+            return operation
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.writes = 0
+
+def _link(base: str, params: Dict) -> str:
+    return f'<{base}?{urlencode(params)}>; rel="next"'
+
+_SHOPIFY_PATH = re.compile(r'^/admin/api/[^/]+/(?P<endpoint>.+)$')
+_TIENDANUBE_PATH = re.compile(r'^/v1/(?P<store>\d+)/(?P<endpoint>[a-z_]+)(?:/(?P<id>\d+))?$')
+_GID = re.compile(r'/(\d+)$')
+
+def make_handler(state: FakeApiState):
+    """Crea el handler HTTP que emula los endpoints de Tiendanube y Shopify que usa el proyecto"""
+    class FakeApiHandler(BaseHTTPRequestHandler):
+        # Conexiones keep-alive, como las APIs reales
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body, headers: Optional[Dict] = None) -> None:
+            data = b'' if body is None else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> Dict:
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def _dispatch(self, method: str) -> None:
+            parts = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            if parts.path == '/_stats':
+                return self._send(200, state.stats())
+            if parts.path == '/_reset':
+                state.reset()
+                return self._send(200, {'ok': True})
+            if parts.path.startswith('/_bulk/'):
+                return self._bulk_file(parts.path[len('/_bulk/'):].removesuffix('.jsonl'))
+            
+            if state.latency:
+                time.sleep(state.latency)
+            
+            match = _SHOPIFY_PATH.match(parts.path)
+            if match:
+                return self._shopify(method, match.group('endpoint'), parts.path, params)
+            match = _TIENDANUBE_PATH.match(parts.path)
+            if match:
+                return self._tiendanube(match.group('store'), match.group('endpoint'), match.group('id'),
+                                        parts.path, params)
+            self._send(404, {'error': 'Not found'})
+        
+        # --- Tiendanube ---
+
+        def _tiendanube(self, store_id: str, endpoint: str, item_id: Optional[str], path: str, params: Dict) -> None:
+            label = f'{endpoint}/:id' if item_id else endpoint
+            headers = {}
+            bucket = state.tiendanube_bucket(store_id)
+            if bucket:
+                accepted, level = bucket.take()
+                headers = {
+                    'x-rate-limit-limit': str(int(bucket.capacity)),
+                    'x-rate-limit-remaining': str(int(bucket.capacity - level)),
+                    'x-rate-limit-reset': str(int(1000 / bucket.leak_rate))
+                }
+                if not accepted:
+                    state.count('tiendanube', label, 429)
+                    return self._send(429, {'description': 'Too Many Requests'}, headers)
+            
+            if store_id not in state.catalog.tiendanube:
+                state.count('tiendanube', label, 404)
+                return self._send(404, {'description': 'Store not found'}, headers)
+            
+            if endpoint == 'products' and item_id:
+                product = state.catalog.tiendanube_by_id[store_id].get(int(item_id))
+                status = 200 if product else 404
+                state.count('tiendanube', label, status)
+                return self._send(status, product or {'description': 'Not found'}, headers)
+            
+            if endpoint != 'products':
+                state.count('tiendanube', label, 404)
+                return self._send(404, {'description': 'Not found'}, headers)
+            
+            updated_at_min = _parse_datetime(params['updated_at_min']) if params.get('updated_at_min') else None
+            products = state.catalog.filtered('tiendanube', store_id, updated_at_min)
+            per_page = min(int(params.get('per_page', 30)), 200)
+            page = int(params.get('page', 1))
+            chunk = products[(page - 1) * per_page:page * per_page]
+            if not chunk:
+                # Como la API real: sin resultados responde 404
+                state.count('tiendanube', label, 404)
+                return self._send(404, {'code': 404, 'message': 'Not Found'}, headers)
+            
+            if page * per_page < len(products):
+                base = f'http://{self.headers.get("Host")}{path}'
+                headers['Link'] = _link(base, dict(params, page=page + 1))
+            state.count('tiendanube', label, 200)
+            self._send(200, chunk, headers)
+        
+        # --- Shopify ---
+
+        def _shopify(self, method: str, endpoint: str, path: str, params: Dict) -> None:
+            if endpoint == 'graphql.json':
+                return self._graphql()
+            
+            headers = {}
+            if state.shopify_bucket:
+                accepted, level = state.shopify_bucket.take()
+                headers['X-Shopify-Shop-Api-Call-Limit'] = f'{int(level)}/{int(state.shopify_bucket.capacity)}'
+                if not accepted:
+                    state.count('shopify', endpoint, 429)
+                    headers['Retry-After'] = '1.0'
+                    return self._send(429, {'errors': 'Exceeded 2 calls per second for api client.'}, headers)
+            
+            base = f'http://{self.headers.get("Host")}{path}'
+            if endpoint == 'locations.json':
+                body = {'locations': [{'id': LOCATION_ID, 'name': LOCATION_NAME, 'active': True}]}
+            elif endpoint == 'products.json':
+                body, link = self._shopify_products(base, params)
+                if link:
+                    headers['Link'] = link
+            elif endpoint == 'inventory_levels.json':
+                body, link = self._inventory_levels(base, params)
+                if link:
+                    headers['Link'] = link
+            elif endpoint == 'inventory_levels/set.json' and method == 'POST':
+                payload = self._body()
+                item_id = int(payload['inventory_item_id'])
+                with state.catalog.lock:
+                    known = item_id in state.catalog.levels
+                    if known:
+                        state.catalog.levels[item_id] = int(payload['available'])
+                if not known:
+                    state.count('shopify', endpoint, 422)
+                    return self._send(422, {'errors': {'inventory_item_id': ['not found']}}, headers)
+                state.count_writes(1)
+                body = {'inventory_level': {
+                    'inventory_item_id': item_id,
+                    'location_id': int(payload['location_id']),
+                    'available': int(payload['available'])
+                }}
+            else:
+                state.count('shopify', endpoint, 404)
+                return self._send(404, {'errors': 'Not Found'}, headers)
+            
+            state.count('shopify', endpoint, 200)
+            self._send(200, body, headers)
+
+        def _page(self, params: Dict) -> Tuple[int, int, Dict]:
+            """Lee page_info (offset|filtro) y devuelve (offset, límite, filtros de la consulta original)"""
+            limit = min(int(params.get('limit', 50)), 250)
+            if 'page_info' in params:
+                offset, _, raw = params['page_info'].partition('|')
+                return int(offset), limit, json.loads(raw or '{}')
+            filters = {key: value for key, value in params.items() if key != 'limit'}
+            return 0, limit, filters
+
+        def _next(self, base: str, offset: int, limit: int, total: int, filters: Dict) -> Optional[str]:
+            if offset + limit >= total:
+                return None
+            return _link(base, {'limit': limit, 'page_info': f'{offset + limit}|{json.dumps(filters)}'})
+
+        def _shopify_products(self, base: str, params: Dict) -> Tuple[Dict, Optional[str]]:
+            offset, limit, filters = self._page(params)
+            updated_at_min = _parse_datetime(filters['updated_at_min']) if filters.get('updated_at_min') else None
+            products = state.catalog.filtered('shopify', None, updated_at_min)
+            return {'products': products[offset:offset + limit]}, self._next(base, offset, limit, len(products), filters)
+
+        def _inventory_levels(self, base: str, params: Dict) -> Tuple[Dict, Optional[str]]:
+            offset, limit, filters = self._page(params)
+            with state.catalog.lock:
+                items = sorted(state.catalog.levels.items())
+            if filters.get('inventory_item_ids'):
+                wanted = {int(item_id) for item_id in filters['inventory_item_ids'].split(',')}
+                items = [(item_id, available) for item_id, available in items if item_id in wanted]
+            levels = [
+                {'inventory_item_id': item_id, 'location_id': LOCATION_ID, 'available': available}
+                for item_id, available in items[offset:offset + limit]
+            ]
+            return {'inventory_levels': levels}, self._next(base, offset, limit, len(items), filters)
+
+        def _bulk_file(self, number: str) -> None:
+            """Archivo JSONL de una exportación terminada (en Shopify es una URL firmada de almacenamiento)"""
+            operation = state.bulk_operation(f'gid://shopify/BulkOperation/{number}')
+            if not operation or operation['status'] != 'COMPLETED':
+                state.count('shopify', 'bulk_file', 404)
+                return self._send(404, {'error': 'Not found'})
+            state.count('shopify', 'bulk_file', 200)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(operation['data'])))
+            self.end_headers()
+            for i in range(0, len(operation['data']), 64 * 1024):
+                self.wfile.write(operation['data'][i:i + 64 * 1024])
+
+        def _bulk_graphql(self, query: str, variables: Dict) -> None:
+            """bulkOperationRunQuery, consulta de estado (node) y bulkOperationCancel"""
+            state.count('shopify', 'graphql.json', 200)
+            if 'bulkOperationRunQuery' in query:
+                operation_id, error = state.start_bulk()
+                errors = [{'field': None, 'message': error}] if error else []
+                operation = {'id': operation_id, 'status': 'CREATED'} if operation_id else None
+                return self._send(200, {'data': {'bulkOperationRunQuery': {'bulkOperation': operation,
+                                                                            'userErrors': errors}}})
+            
+            operation = state.bulk_operation(variables.get('id', ''))
+            if operation and 'bulkOperationCancel' in query and operation['status'] == 'RUNNING':
+                operation['status'] = 'CANCELED'
+            node = None
+            if operation:
+                completed = operation['status'] == 'COMPLETED'
+                number = variables['id'].rsplit('/', 1)[-1]
+                node = {
+                    'id': variables['id'],
+                    'status': operation['status'],
+                    'errorCode': None,
+                    'objectCount': str(operation.get('count', 0)) if completed else '0',
+                    # Como en Shopify, sin resultados no hay archivo
+                    'url': (f'http://{self.headers.get("Host")}/_bulk/{number}.jsonl'
+                            if completed and operation.get('count') else None)
+                }
+            if 'bulkOperationCancel' in query:
+                return self._send(200, {'data': {'bulkOperationCancel': {'bulkOperation': node, 'userErrors': []}}})
+            self._send(200, {'data': {'node': node}})
+
+        def _graphql(self) -> None:
+            payload = self._body()
+            query = payload.get('query', '')
+            variables = payload.get('variables') or {}
+            if 'bulkOperation' in query:
+                return self._bulk_graphql(query, variables)
+            if 'inventorySetQuantities' not in query:
+                state.count('shopify', 'graphql.json', 400)
+                return self._send(200, {'errors': [{'message': 'Operación no soportada por el servidor falso'}]})
+            
+            quantities = variables['input']['quantities']
+            cost = 10 + len(quantities)
+            bucket = state.graphql_bucket
+            if bucket:
+                accepted, level = bucket.take(cost)
+                throttle = {
+                    'maximumAvailable': bucket.capacity,
+                    'currentlyAvailable': int(bucket.capacity - level),
+                    'restoreRate': bucket.leak_rate
+                }
+                extensions = {'cost': {'requestedQueryCost': cost, 'throttleStatus': throttle}}
+                if not accepted:
+                    state.count('shopify', 'graphql.json', 'throttled')
+                    return self._send(200, {
+                        'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+                        'extensions': extensions
+                    })
+            else:
+                extensions = {'cost': {'requestedQueryCost': cost}}
+            
+            # Como la mutación real: si algún item falla no se aplica ninguno
+            errors = []
+            updates = []
+            with state.catalog.lock:
+                for i, quantity in enumerate(quantities):
+                    match = _GID.search(quantity['inventoryItemId'])
+                    item_id = int(match.group(1)) if match else None
+                    if item_id not in state.catalog.levels:
+                        errors.append({
+                            'field': ['input', 'quantities', str(i), 'inventoryItemId'],
+                            'message': 'The specified inventory item could not be found.',
+                            'code': 'INVALID_INVENTORY_ITEM'
+                        })
+                    else:
+                        updates.append((item_id, quantity['quantity']))
+                if not errors:
+                    for item_id, quantity in updates:
+                        state.catalog.levels[item_id] = quantity
+            if not errors:
+                state.count_writes(len(updates))
+            
+            state.count('shopify', 'graphql.json', 200)
+            self._send(200, {
+                'data': {'inventorySetQuantities': {'userErrors': errors}},
+                'extensions': extensions
+            })
+    
+    return FakeApiHandler
+
+def start(state: FakeApiState, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Levanta el servidor falso en un hilo aparte
+    
+    Args:
+        state (FakeApiState): Estado del servidor
+        port (int): Puerto (0 = uno libre cualquiera)
+    
+    Returns:
+        ThreadingHTTPServer: Servidor en ejecución (server.server_address tiene el puerto)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-api', daemon=True).start()
+    return server
+
+def client_env(port: int, stores: int = 1) -> Dict[str, str]:
+    """Variables de entorno para que los clientes del proyecto apunten al servidor falso"""
+    base = f'http://127.0.0.1:{port}'
+    return {
+        'SHOPIFY_STORE_URL': base,
+        'SHOPIFY_ACCESS_TOKEN': 'fake-token',
+        'SHOPIFY_LOCATION': LOCATION_NAME,
+        'TIENDANUBE_CREDENTIALS': json.dumps([
+            {
+                'base_url': f'{base}/v1/{STORE_ID_BASE + s}',
+                'headers': {'Authentication': 'bearer fake-token', 'User-Agent': 'Stock Sync Benchmark'}
+            }
+            for s in range(stores)
+        ])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que emula las APIs de Tiendanube y Shopify')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--variants', type=int, default=1000, help='Variantes totales del catálogo')
+    parser.add_argument('--stores', type=int, default=1, help='Tiendas de Tiendanube')
+    parser.add_argument('--variants-per-product', type=int, default=4)
+    parser.add_argument('--unmapped', type=float, default=0.01, help='Fracción de variantes sin SKU en Shopify')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latencia agregada a cada respuesta')
+    parser.add_argument('--shopify-rate', type=float, default=0, help='Peticiones REST/s de Shopify (0 = sin límite)')
+    parser.add_argument('--graphql-rate', type=float, default=0, help='Puntos GraphQL/s de Shopify (0 = sin límite)')
+    parser.add_argument('--tiendanube-rate', type=float, default=0, help='Peticiones/s por tienda (0 = sin límite)')
+    parser.add_argument('--bulk-seconds', type=float, default=0.5,
+                        help='Segundos que tarda una exportación Bulk Operations')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--shared-catalog', action='store_true',
+                        help='Todas las tiendas venden los mismos productos (para probar STOCK_AGGREGATION)')
+    args = parser.parse_args()
+    
+    catalog = FakeCatalog(args.variants, stores=args.stores, variants_per_product=args.variants_per_product,
+                          unmapped=args.unmapped, seed=args.seed, shared=args.shared_catalog)
+    state = FakeApiState(catalog, latency=args.latency_ms / 1000, shopify_rate=args.shopify_rate,
+                         tiendanube_rate=args.tiendanube_rate, graphql_restore_rate=args.graphql_rate,
+                         bulk_seconds=args.bulk_seconds)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"🧪 Servidor falso escuchando en http://127.0.0.1:{args.port} ({catalog.variants} variantes)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from src.log import get_logger
+from src import metrics
+
+logger = get_logger(__name__)
+
+# Errores de red que vale la pena reintentar
+RETRYABLE_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_rate: float):
+        """
+        Balde de tokens (leaky bucket) para espaciar peticiones
+        
+        Args:
+            capacity (float): Máximo de peticiones en ráfaga
+            refill_rate (float): Tokens que se recuperan por segundo
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now <= self._updated_at:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Bloquea hasta que haya tokens disponibles y los consume
+        
+        Las peticiones que no consumen tokens (tokens=0) igual esperan a que termine una pausa por 429.
+        """
+        if tokens <= 0:
+            wait = self.paused_for()
+            while wait:
+                time.sleep(wait)
+                wait = self.paused_for()
+            return
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def paused_for(self) -> float:
+        """Segundos que faltan para que termine la pausa por 429 (0 si no hay pausa)"""
+        with self._lock:
+            return max(self._paused_until - time.monotonic(), 0.0)
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Consume tokens si hay disponibles, sin bloquear
+        
+        Returns:
+            float: 0 si se consumieron; si no, segundos a esperar antes de reintentar
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self._paused_until - now, 0)
+            if wait:
+                return wait
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.refill_rate
+
+    def sync(self, remaining: float, capacity: float) -> None:
+        """
+        Ajusta el balde a lo que informa el servidor
+        
+        Args:
+            remaining (float): Peticiones disponibles según el servidor
+            capacity (float): Tamaño del balde según el servidor
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.capacity = capacity
+            self.tokens = min(self.tokens, remaining)
+
+    def pause(self, seconds: float) -> None:
+        """Bloquea nuevas peticiones durante unos segundos; al terminar queda un solo token"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.tokens = min(1.0, self.capacity)
+            self._updated_at = self._paused_until
+
+    @property
+    def headroom(self) -> float:
+        """Fracción del balde disponible (1 = vacío de peticiones, 0 = al límite)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens / self.capacity if self.capacity else 0.0
+
+def shopify_rate_limit(response: requests.Response) -> Optional[Tuple[float, float]]:
+    """
+    Lee el header X-Shopify-Shop-Api-Call-Limit ('32/40')
+    
+    Returns:
+        Optional[Tuple[float, float]]: (disponibles, capacidad) o None si no viene el header
+    """
+    value = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+    if not value or '/' not in value:
+        return None
+    used, capacity = (float(part) for part in value.split('/', 1))
+    return capacity - used, capacity
+
+def tiendanube_rate_limit(response: requests.Response) -> Optional[Tuple[float, float]]:
+    """
+    Lee los headers x-rate-limit-limit y x-rate-limit-remaining de Tiendanube
+    
+    Returns:
+        Optional[Tuple[float, float]]: (disponibles, capacidad) o None si no vienen los headers
+    """
+    limit = response.headers.get('x-rate-limit-limit')
+    remaining = response.headers.get('x-rate-limit-remaining')
+    if limit is None or remaining is None:
+        return None
+    return float(remaining), float(limit)
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """
+    Interpreta el header Retry-After (segundos o fecha HTTP)
+    
+    Returns:
+        Optional[float]: Segundos a esperar o None si no viene el header
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(parsed.timestamp() - time.time(), 0.0)
+
+class ApiClient:
+    def __init__(self, name: str, capacity: float, refill_rate: float, max_concurrency: int = 4,
+                 rate_limit_parser: Optional[Callable] = None, scope: str = ''):
+        """
+        Cliente HTTP con conexiones persistentes, control de ritmo, respeto de 429/Retry-After y reintentos
+        
+        Args:
+            name (str): Nombre de la API, para los mensajes
+            capacity (float): Tamaño del balde de peticiones
+            refill_rate (float): Peticiones por segundo sostenibles
+            max_concurrency (int): Máximo de peticiones simultáneas (y de conexiones en el pool)
+            rate_limit_parser (Callable, optional): Función que lee (disponibles, capacidad) de la respuesta
+            scope (str): Identifica el balde en las métricas cuando hay varios por API (p. ej. la tienda)
+        """
+        load_dotenv()
+        self.name = name
+        self.scope = scope
+        self.bucket = TokenBucket(capacity, refill_rate)
+        self.rate_limit_parser = rate_limit_parser
+        self.max_retries = int(os.getenv('HTTP_MAX_RETRIES', 5))
+        self.backoff_base = float(os.getenv('HTTP_BACKOFF_BASE', 1.0))
+        self.backoff_max = float(os.getenv('HTTP_BACKOFF_MAX', 60.0))
+        self.timeout = (
+            float(os.getenv('HTTP_CONNECT_TIMEOUT', 10)),
+            float(os.getenv('HTTP_READ_TIMEOUT', 60))
+        )
+        self._concurrency = threading.BoundedSemaphore(max_concurrency)
+        
+        # Sesión con pool de conexiones keep-alive; los reintentos los maneja request()
+        pool_size = int(os.getenv('HTTP_POOL_SIZE', max_concurrency))
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, max_concurrency), max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.requests_sent = 0
+        self._stats_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Cierra las conexiones del pool"""
+        self.session.close()
+
+    def connection_stats(self) -> dict:
+        """
+        Estadísticas de reutilización de conexiones del pool
+        
+        Returns:
+            dict: Peticiones enviadas, conexiones abiertas y peticiones que reutilizaron una conexión
+        """
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        return {
+            'requests': self.requests_sent,
+            'connections': connections,
+            'reused': max(self.requests_sent - connections, 0)
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        """Espera exponencial con jitter completo"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method: str, url: str, tokens: float = 1, **kwargs) -> requests.Response:
+        """
+        Realiza una petición respetando el límite de la API y reintentando errores transitorios
+        
+        Args:
+            method (str): Método HTTP
+            url (str): URL completa
+            tokens (float): Tokens del balde que consume la petición (0 para no consumir)
+            **kwargs: Argumentos adicionales para requests
+            
+        Returns:
+            requests.Response: Última respuesta recibida (puede ser 429/5xx si se agotaron los reintentos)
+        """
+        endpoint = metrics.endpoint_label(url)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            waited = time.monotonic()
+            self.bucket.acquire(tokens)
+            metrics.RATE_LIMIT_WAIT.observe(time.monotonic() - waited, api=self.name)
+            
+            try:
+                kwargs.setdefault('timeout', self.timeout)
+                with self._stats_lock:
+                    self.requests_sent += 1
+                with self._concurrency:
+                    started = time.monotonic()
+                    try:
+                        response = self.session.request(method, url, **kwargs)
+                    finally:
+                        metrics.HTTP_LATENCY.observe(time.monotonic() - started, api=self.name, endpoint=endpoint)
+            except RETRYABLE_EXCEPTIONS as e:
+                metrics.HTTP_REQUESTS.inc(api=self.name, endpoint=endpoint, status=e.__class__.__name__)
+                if last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("⚠️ Error de red en %s (%s), reintentando en %.1fs", self.name, e.__class__.__name__, delay,
+                               extra={'api': self.name, 'delay': delay})
+                time.sleep(delay)
+                continue
+            
+            metrics.HTTP_REQUESTS.inc(api=self.name, endpoint=endpoint, status=response.status_code)
+            if self.rate_limit_parser:
+                limits = self.rate_limit_parser(response)
+                if limits:
+                    self.bucket.sync(*limits)
+            metrics.RATE_LIMIT_HEADROOM.set(round(self.bucket.headroom, 3), api=self.name, scope=self.scope)
+            
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if last_attempt:
+                return response
+            
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = self._backoff(attempt)
+            logger.warning("⚠️ %s respondió %s, reintento %s/%s en %.1fs", self.name, response.status_code,
+                           attempt + 1, self.max_retries, delay,
+                           extra={'api': self.name, 'status': response.status_code, 'delay': delay})
+            # Devolver la conexión al pool antes de reintentar (con stream=True no se liberaría)
+            response.close()
+            if response.status_code == 429:
+                # Frenar a todos los hilos que comparten el balde, no solo a este
+                self.bucket.pause(delay)
+            else:
+                time.sleep(delay)
+        
+        return response
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+from src.storage import connect
+
+class InventorySnapshot:
+    def __init__(self, path: Optional[str] = None, ttl: Optional[int] = None):
+        """
+        Inicializa la foto local de las últimas cantidades escritas en Shopify
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+            ttl (int, optional): Segundos durante los que se confía en una cantidad escrita.
+                Si no se proporciona, se usa INVENTORY_SNAPSHOT_TTL
+        """
+        load_dotenv()
+        self.ttl = ttl if ttl is not None else int(os.getenv('INVENTORY_SNAPSHOT_TTL', 24 * 3600))
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS inventory_snapshot (
+                    inventory_item_id TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    written_at REAL NOT NULL,
+                    PRIMARY KEY (inventory_item_id, location_id)
+                )
+            """)
+
+    def get_many(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+        """
+        Obtiene las cantidades vigentes de varios items
+        
+        Args:
+            keys (Iterable[Tuple[str, str]]): Claves (inventory_item_id, location_id)
+            
+        Returns:
+            Dict[Tuple[str, str], int]: Cantidad conocida de cada clave encontrada
+        """
+        min_written_at = time.time() - self.ttl
+        found = {}
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    'SELECT quantity FROM inventory_snapshot '
+                    'WHERE inventory_item_id = ? AND location_id = ? AND written_at >= ?',
+                    (key[0], key[1], min_written_at)
+                ).fetchone()
+                if row:
+                    found[key] = row[0]
+        return found
+
+    def set_many(self, quantities: Dict[Tuple[str, str], int]) -> None:
+        """
+        Registra las cantidades escritas en Shopify
+        
+        Args:
+            quantities (Dict[Tuple[str, str], int]): (inventory_item_id, location_id) -> cantidad
+        """
+        now = time.time()
+        rows = [(key[0], key[1], quantity, now) for key, quantity in quantities.items()]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO inventory_snapshot '
+                '(inventory_item_id, location_id, quantity, written_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+
+    def invalidate(self, keys: Iterable[Tuple[str, str]]) -> None:
+        """Olvida la cantidad de varios items (por ejemplo, si la escritura falló)"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM inventory_snapshot WHERE inventory_item_id = ? AND location_id = ?',
+                list(keys)
+            )
+
+    def clear(self) -> None:
+        """Vacía la foto por completo"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM inventory_snapshot')
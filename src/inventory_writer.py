@@ -0,0 +1,154 @@
+import os
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from dotenv import load_dotenv
+from src.inventory_snapshot import InventorySnapshot
+from src.log import get_logger
+from src import metrics
+
+logger = get_logger(__name__)
+
+class InventoryWriter:
+    # Máximo de cantidades que acepta inventorySetQuantities por mutación
+    MAX_BATCH_SIZE = 250
+    # Si es True, add() envía el lote en cuanto se llena
+    auto_flush = True
+
+    def __init__(self, shopify, batch_size: Optional[int] = None,
+                 snapshot: Union[InventorySnapshot, bool, None] = None, skip_unchanged: bool = True):
+        """
+        Acumula escrituras de stock y las envía a Shopify en lotes por GraphQL
+        
+        Args:
+            shopify (ShopifyAPI): Cliente de Shopify
+            batch_size (int, optional): Items por mutación. Si no se proporciona, se usa SHOPIFY_WRITE_BATCH_SIZE
+            snapshot (InventorySnapshot, optional): Últimas cantidades escritas, para omitir las que
+                no cambiaron. Si no se proporciona, se crea una salvo que SHOPIFY_SKIP_UNCHANGED sea 'false';
+                con False no se usa foto
+            skip_unchanged (bool): Si es False, se escribe todo aunque la foto diga que no cambió
+                (la foto se sigue actualizando con lo escrito)
+        """
+        load_dotenv()
+        self.shopify = shopify
+        self.batch_size = min(
+            batch_size or int(os.getenv('SHOPIFY_WRITE_BATCH_SIZE', self.MAX_BATCH_SIZE)),
+            self.MAX_BATCH_SIZE
+        )
+        
+        # (inventory_item_id, location_id) -> {'quantity', 'skus', 'refs'}
+        self.pending: Dict[Tuple[str, str], Dict] = {}
+        self.results: Dict[Tuple[str, str], bool] = {}
+        self.failed_refs: Set = set()
+        # (clave, entrada) de cada item que Shopify rechazó, para el registro de fallos
+        self.failed_entries: List[Tuple[Tuple[str, str], Dict]] = []
+        self.skipped = 0
+        
+        if snapshot is None and os.getenv('SHOPIFY_SKIP_UNCHANGED', 'true').lower() != 'false':
+            snapshot = InventorySnapshot()
+        self.snapshot = None if snapshot is False else snapshot
+        self.skip_unchanged = skip_unchanged
+
+    def add(self, inventory_item_id, location_id, quantity: int, sku: Optional[str] = None, ref=None) -> Tuple[str, str]:
+        """
+        Encola una escritura de stock; si el item ya estaba pendiente gana la última cantidad
+        
+        Args:
+            inventory_item_id: ID del item de inventario
+            location_id: ID de la ubicación
+            quantity (int): Nueva cantidad de stock
+            sku (str, optional): SKU de Tiendanube, para invalidar la caché si la escritura falla
+            ref (optional): Referencia del llamador (por ejemplo, ID de producto) para reportar fallos
+            
+        Returns:
+            Tuple[str, str]: Clave (inventory_item_id, location_id) del item
+        """
+        key = (str(inventory_item_id), str(location_id))
+        entry = self.pending.setdefault(key, {'quantity': quantity, 'skus': set(), 'refs': set()})
+        entry['quantity'] = quantity
+        if sku is not None:
+            entry['skus'].add(sku)
+        if ref is not None:
+            entry['refs'].add(ref)
+        
+        if self.auto_flush and self.full:
+            self.flush()
+        return key
+
+    @property
+    def full(self) -> bool:
+        """True si hay un lote completo pendiente de envío"""
+        return len(self.pending) >= self.batch_size
+
+    def flush(self) -> Dict[Tuple[str, str], bool]:
+        """
+        Envía todas las escrituras pendientes
+        
+        Returns:
+            Dict[Tuple[str, str], bool]: Resultado de cada item enviado en esta llamada
+        """
+        flushed = {}
+        skipped_before = self.skipped
+        for chunk, items in self._batches(flushed):
+            logger.debug("🚚 Enviando lote de %s actualizaciones de stock a Shopify", len(items))
+            self._apply(chunk, self.shopify.set_inventory_quantities(items), flushed)
+        return self._summarize(flushed, self.skipped - skipped_before)
+
+    def _batches(self, flushed: Dict[Tuple[str, str], bool]) -> Iterator[Tuple[List[Tuple[str, str]], List[Tuple]]]:
+        """
+        Arma los lotes a enviar; los items sin cambios se registran en flushed y no se envían
+        
+        Yields:
+            Tuple[List, List]: Claves del lote y tuplas (inventory_item_id, location_id, cantidad)
+        """
+        keys = list(self.pending)
+        for i in range(0, len(keys), self.batch_size):
+            chunk = keys[i:i + self.batch_size]
+            
+            # Omitir los items cuya última cantidad escrita coincide con la nueva
+            if self.snapshot and self.skip_unchanged:
+                known = self.snapshot.get_many(chunk)
+                unchanged = [key for key in chunk if known.get(key) == self.pending[key]['quantity']]
+                for key in unchanged:
+                    flushed[key] = True
+                    self._record(key, self.pending.pop(key), True)
+                self.skipped += len(unchanged)
+                chunk = [key for key in chunk if key in self.pending]
+            if not chunk:
+                continue
+            
+            yield chunk, [(key[0], key[1], self.pending[key]['quantity']) for key in chunk]
+
+    def _apply(self, chunk: List[Tuple[str, str]], results: List[bool], flushed: Dict[Tuple[str, str], bool]) -> None:
+        """Registra el resultado de un lote enviado y actualiza la foto"""
+        written = {}
+        for key, ok in zip(chunk, results):
+            flushed[key] = ok
+            entry = self.pending.pop(key)
+            if ok:
+                written[key] = entry['quantity']
+            self._record(key, entry, ok)
+        
+        if self.snapshot:
+            self.snapshot.set_many(written)
+            self.snapshot.invalidate(key for key in chunk if key not in written)
+
+    def _summarize(self, flushed: Dict[Tuple[str, str], bool], skipped: int) -> Dict[Tuple[str, str], bool]:
+        ok_count = sum(1 for ok in flushed.values() if ok)
+        metrics.ITEMS.inc(ok_count - skipped, stage='shopify_write', result='ok')
+        metrics.ITEMS.inc(len(flushed) - ok_count, stage='shopify_write', result='fallido')
+        metrics.ITEMS.inc(skipped, stage='shopify_write', result='sin_cambios')
+        if flushed:
+            logger.info("✅ Lote aplicado: %s/%s items actualizados (%s sin cambios omitidos)", ok_count, len(flushed), skipped,
+                        extra={'written': ok_count, 'items': len(flushed), 'skipped': skipped})
+        return flushed
+
+    def _record(self, key: Tuple[str, str], entry: Dict, ok: bool) -> None:
+        """Registra el resultado de un item y sus referencias"""
+        self.results[key] = ok
+        if ok:
+            return
+        
+        self.failed_refs.update(entry['refs'])
+        self.failed_entries.append((key, entry))
+        if self.shopify.sku_cache:
+            for sku in entry['skus']:
+                self.shopify.sku_cache.invalidate(sku)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from src.storage import connect
+
+class StockJobQueue:
+    def __init__(self, path: Optional[str] = None, lease_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        """
+        Cola persistente de escrituras de stock pendientes, una por (SKU, ubicación)
+        
+        Encolar un SKU que ya está en la cola reemplaza su cantidad (gana la última).
+        Los trabajos se toman con un préstamo (lease) que vence si el proceso muere,
+        así que cada escritura se entrega al menos una vez y se retoma tras un reinicio.
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+            lease_seconds (float, optional): Duración del préstamo. Si no se proporciona, se usa QUEUE_LEASE_SECONDS
+            max_attempts (int, optional): Intentos antes de marcar el trabajo como fallido.
+                Si no se proporciona, se usa QUEUE_MAX_ATTEMPTS
+        """
+        load_dotenv()
+        self.lease_seconds = lease_seconds or float(os.getenv('QUEUE_LEASE_SECONDS', 300))
+        self.max_attempts = max_attempts or int(os.getenv('QUEUE_MAX_ATTEMPTS', 5))
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stock_jobs (
+                    sku TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    store TEXT NOT NULL,
+                    product_id INTEGER,
+                    quantity INTEGER NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    last_error TEXT,
+                    PRIMARY KEY (sku, location)
+                )
+            """)
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS stock_jobs_ready ON stock_jobs (status, available_at)'
+            )
+
+    def enqueue_many(self, jobs: Iterable[Dict]) -> int:
+        """
+        Encola (o actualiza) escrituras de stock
+        
+        Args:
+            jobs (Iterable[Dict]): Trabajos con 'sku', 'location', 'store', 'product_id' y 'quantity'
+        
+        Returns:
+            int: Número de trabajos encolados
+        """
+        now = time.time()
+        rows = [
+            (job['sku'], job.get('location') or '', job['store'], job.get('product_id'), job['quantity'], now)
+            for job in jobs
+        ]
+        with self._lock, self._conn:
+            # Un SKU ya encolado (o en proceso) toma la nueva cantidad y una nueva versión,
+            # así un ack de la versión anterior no lo borra
+            self._conn.executemany("""
+                INSERT INTO stock_jobs (sku, location, store, product_id, quantity, enqueued_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sku, location) DO UPDATE SET
+                    store = excluded.store,
+                    product_id = excluded.product_id,
+                    quantity = excluded.quantity,
+                    version = stock_jobs.version + 1,
+                    status = CASE WHEN stock_jobs.status = 'failed' THEN 'pending' ELSE stock_jobs.status END,
+                    attempts = 0,
+                    enqueued_at = excluded.enqueued_at
+            """, rows)
+        return len(rows)
+
+    def lease(self, limit: int) -> List[Dict]:
+        """
+        Toma trabajos listos para procesar
+        
+        Args:
+            limit (int): Máximo de trabajos a tomar
+        
+        Returns:
+            List[Dict]: Trabajos tomados (incluyen 'version' para el ack)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Tomar el lock de escritura antes de leer, para que dos procesos no tomen el mismo trabajo
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute("""
+                SELECT sku, location, store, product_id, quantity, version, attempts FROM stock_jobs
+                WHERE status IN ('pending', 'leased') AND available_at <= ?
+                ORDER BY enqueued_at
+                LIMIT ?
+            """, (now, limit)).fetchall()
+            self._conn.executemany(
+                "UPDATE stock_jobs SET status = 'leased', available_at = ? WHERE sku = ? AND location = ?",
+                [(now + self.lease_seconds, row['sku'], row['location']) for row in rows]
+            )
+        return [dict(row) for row in rows]
+
+    def ack(self, jobs: Iterable[Dict]) -> None:
+        """Confirma trabajos procesados; si llegó una cantidad más nueva, el trabajo sigue en la cola"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM stock_jobs WHERE sku = ? AND location = ? AND version = ?',
+                [(job['sku'], job['location'], job['version']) for job in jobs]
+            )
+            # Versiones nuevas encoladas mientras se procesaba la anterior
+            self._conn.executemany(
+                "UPDATE stock_jobs SET status = 'pending', available_at = 0 "
+                "WHERE sku = ? AND location = ? AND status = 'leased'",
+                [(job['sku'], job['location']) for job in jobs]
+            )
+
+    def nack(self, jobs: Iterable[Dict], error: str) -> None:
+        """
+        Devuelve trabajos fallidos a la cola con espera exponencial
+        
+        Los que superan max_attempts quedan con estado 'failed' y no se vuelven a tomar.
+        """
+        now = time.time()
+        rows = []
+        for job in jobs:
+            attempts = job['attempts'] + 1
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            delay = min(2 ** attempts, 300)
+            rows.append((status, attempts, now + delay, error, job['sku'], job['location'], job['version']))
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                UPDATE stock_jobs SET status = ?, attempts = ?, available_at = ?, last_error = ?
+                WHERE sku = ? AND location = ? AND version = ?
+            """, rows)
+            # Versiones nuevas encoladas mientras se procesaba la anterior: como en ack, no quedan
+            # tomadas hasta que venza el préstamo, sino que cuentan el intento y esperan su turno
+            self._conn.executemany("""
+                UPDATE stock_jobs SET
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    attempts = attempts + 1,
+                    available_at = ? + MIN(1 << (attempts + 1), 300),
+                    last_error = ?
+                WHERE sku = ? AND location = ? AND status = 'leased' AND version != ?
+            """, [(self.max_attempts, now, error, job['sku'], job['location'], job['version']) for job in jobs])
+
+    def depth(self) -> Dict[str, int]:
+        """
+        Cantidad de trabajos por estado
+        
+        Returns:
+            Dict[str, int]: Estado ('pending', 'leased', 'failed') -> cantidad
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) AS total FROM stock_jobs GROUP BY status'
+            ).fetchall()
+        return {row['status']: row['total'] for row in rows}
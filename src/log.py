@@ -0,0 +1,157 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+from dotenv import load_dotenv
+
+# Logger raíz de la aplicación; los módulos cuelgan de él (sync.shopify, sync.tiendanube, ...)
+ROOT_LOGGER = 'sync'
+
+# Se pasa como extra en los logs por item: solo se emite una fracción (LOG_SAMPLE_RATE)
+SAMPLED = {'sampled': True}
+
+# Atributos propios de LogRecord; el resto (los pasados en extra) se agregan como campos del JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'taskName', 'run_id', 'store', 'sampled'
+}
+
+_run_id = uuid.uuid4().hex[:12]
+_store: contextvars.ContextVar = contextvars.ContextVar('store', default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+def new_run(run_id: Optional[str] = None) -> str:
+    """
+    Inicia una nueva ejecución: todos los logs siguientes llevan su ID de correlación
+    
+    Args:
+        run_id (str, optional): ID a usar. Si no se proporciona, se genera uno
+    
+    Returns:
+        str: ID de la ejecución
+    """
+    global _run_id
+    _run_id = run_id or uuid.uuid4().hex[:12]
+    return _run_id
+
+def current_run() -> str:
+    """ID de correlación de la ejecución en curso"""
+    return _run_id
+
+@contextlib.contextmanager
+def store_context(store: str) -> Iterator[None]:
+    """Asocia los logs emitidos dentro del bloque (en este hilo) a una tienda"""
+    token = _store.set(store)
+    try:
+        yield
+    finally:
+        _store.reset(token)
+
+class _ContextFilter(logging.Filter):
+    """Agrega run_id y tienda a cada registro y descarta los logs muestreados que no tocan"""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'sampled', False) and random.random() >= self.sample_rate:
+            return False
+        record.run_id = _run_id
+        record.store = _store.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea, con los campos pasados en extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'run_id': getattr(record, 'run_id', None),
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'store', None):
+            entry['store'] = record.store
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para la consola"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s [%(run_id)s] %(message)s', '%H:%M:%S')
+
+def configure(force: bool = False) -> None:
+    """
+    Configura el logging de la aplicación (una sola vez por proceso)
+    
+    Los registros se encolan y un hilo aparte los escribe, así la escritura a la
+    salida nunca frena el procesamiento. Variables de entorno:
+    LOG_LEVEL (INFO), LOG_FORMAT (text o json), LOG_FILE (por defecto stdout)
+    y LOG_SAMPLE_RATE (fracción de logs por item que se emiten en DEBUG, 0.01).
+    
+    Args:
+        force (bool): Si es True, vuelve a configurar aunque ya esté configurado
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None and not force:
+            return
+        if _listener is not None:
+            _listener.stop()
+        
+        load_dotenv()
+        log_file = os.getenv('LOG_FILE')
+        output = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter())
+        
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(log_queue)
+        handler.addFilter(_ContextFilter(float(os.getenv('LOG_SAMPLE_RATE', 0.01))))
+        
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.handlers = [handler]
+        logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        logger.propagate = False
+        
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+
+def shutdown() -> None:
+    """Escribe los registros pendientes y detiene el hilo de logging"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+atexit.register(shutdown)
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Devuelve el logger de un módulo
+    
+    Args:
+        name (str): Nombre del módulo (normalmente __name__)
+    
+    Returns:
+        logging.Logger: Logger hijo de 'sync'
+    """
+    configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name.rsplit('.', 1)[-1]}")
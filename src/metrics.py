@@ -0,0 +1,337 @@
+import contextlib
+import functools
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from src.log import get_logger
+
+logger = get_logger(__name__)
+
+# Límites de los histogramas de latencia (segundos)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return '\n'.join(lines)
+
+    def _render_value(self, key: Tuple[str, ...], value) -> Sequence[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [conteos por balde (no acumulados)..., +Inf], suma
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def _render_value(self, key: Tuple[str, ...], value) -> Sequence[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        """Conjunto de métricas del proceso, exportables en formato de texto de Prometheus"""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'sync_http_requests_total', 'Peticiones HTTP por API, endpoint y estado', ('api', 'endpoint', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'sync_http_request_duration_seconds', 'Latencia de las peticiones HTTP', ('api', 'endpoint'))
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    'sync_rate_limit_wait_seconds', 'Espera en el balde de peticiones antes de enviar', ('api',))
+RATE_LIMIT_HEADROOM = REGISTRY.gauge(
+    'sync_rate_limit_headroom_ratio', 'Fracción disponible del balde de peticiones (1 = libre)', ('api', 'scope'))
+STAGE_DURATION = REGISTRY.histogram(
+    'sync_stage_duration_seconds', 'Duración de cada etapa de la sincronización', ('stage',), buckets=STAGE_BUCKETS)
+ITEMS = REGISTRY.counter(
+    'sync_items_total', 'Items procesados por etapa y resultado', ('stage', 'result'))
+ITEMS_PER_SECOND = REGISTRY.gauge(
+    'sync_items_per_second', 'Productos procesados por segundo en la última ejecución de cada tienda', ('store',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'sync_queue_depth', 'Trabajos en la cola persistente por estado', ('status',))
+SCHEDULE_INTERVAL = REGISTRY.gauge(
+    'sync_schedule_interval_seconds', 'Intervalo de consulta adaptativo de cada tienda', ('store',))
+DEAD_LETTERS = REGISTRY.gauge(
+    'sync_dead_letters', 'Items pendientes en el registro de fallos por motivo', ('reason',))
+LAST_RUN = REGISTRY.gauge(
+    'sync_last_run_timestamp_seconds', 'Momento en que terminó la última ejecución', ('command',))
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+_VERSION_PREFIX = re.compile(r'^/admin/api/[^/]+|^/v1/:id')
+
+def endpoint_label(url: str) -> str:
+    """
+    Normaliza una URL a un endpoint de baja cardinalidad
+    
+    '/admin/api/2024-01/products/123.json?x=1' -> '/products/:id.json'
+    """
+    path = url.split('://', 1)[-1]
+    path = path[path.find('/'):] if '/' in path else '/'
+    path = path.split('?', 1)[0]
+    path = re.sub(r'/\d+(?=\.json)', '/:id', path)
+    path = _ID_SEGMENT.sub('/:id', path)
+    return _VERSION_PREFIX.sub('', path) or '/'
+
+@contextlib.contextmanager
+def timer(stage: str) -> Iterator[None]:
+    """Mide la duración de un bloque como una etapa de la sincronización"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.monotonic() - start, stage=stage)
+
+def timed_iter(iterable: Iterable, stage: str) -> Iterator:
+    """Recorre un iterable midiendo solo el tiempo de espera de cada elemento (p. ej. páginas de una API)"""
+    iterator = iter(iterable)
+    waited = 0.0
+    try:
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                waited += time.monotonic() - start
+            yield item
+    finally:
+        STAGE_DURATION.observe(waited, stage=stage)
+
+def write_file(path: str) -> None:
+    """Escribe las métricas en un archivo (reemplazo atómico, para que el scrape nunca lea uno a medias)"""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+def export(command: str) -> None:
+    """
+    Registra el fin de una ejecución y escribe METRICS_FILE si está configurado
+    
+    Args:
+        command (str): Nombre de lo que se ejecutó (sync, pipeline, reconcile, ...)
+    """
+    LAST_RUN.set(time.time(), command=command)
+    path = os.getenv('METRICS_FILE')
+    if path:
+        try:
+            write_file(path)
+        except OSError as e:
+            logger.error("❌ No se pudieron escribir las métricas en %s: %s", path, e)
+
+_server: Optional[ThreadingHTTPServer] = None
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Expone las métricas en http://localhost:<port>/metrics desde un hilo aparte"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("📈 Métricas disponibles en el puerto %s", port)
+    return server
+
+def start_from_env() -> None:
+    """Levanta el servidor de métricas si METRICS_PORT está configurado (una sola vez por proceso)"""
+    global _server
+    load_dotenv()
+    port = os.getenv('METRICS_PORT')
+    if port and _server is None:
+        _server = serve(int(port))
+
+# Perfil en curso: modo y perfiles de los hilos de trabajo (ver profile_worker)
+_profile: Optional[Dict] = None
+_profile_local = threading.local()
+
+def _start_profiler(mode: str):
+    if mode == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler(async_mode='disabled')
+        profiler.start()
+        return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def _stop_profiler(mode: str, profiler):
+    if mode == 'pyinstrument':
+        profiler.stop()
+        return profiler.last_session
+    profiler.disable()
+    return profiler
+
+def profile_worker(fn: Callable) -> Callable:
+    """
+    Envuelve una función que corre en un hilo de trabajo para que entre en el perfil en curso
+    
+    cProfile y pyinstrument solo ven el hilo que los inicia: cada llamada envuelta se perfila
+    en su hilo y profiled() combina todos los perfiles al terminar. Sin perfil en curso, o si
+    el hilo ya se está perfilando, llama a fn directamente.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _profile
+        if profile is None or getattr(_profile_local, 'active', False):
+            return fn(*args, **kwargs)
+        _profile_local.active = True
+        profiler = _start_profiler(profile['mode'])
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            result = _stop_profiler(profile['mode'], profiler)
+            _profile_local.active = False
+            with profile['lock']:
+                profile['workers'].append(result)
+    return wrapper
+
+@contextlib.contextmanager
+def profiled(name: str) -> Iterator[None]:
+    """
+    Perfila un bloque si SYNC_PROFILE es 'cprofile' o 'pyinstrument'
+    
+    El resultado se guarda en SYNC_PROFILE_DIR (por defecto el directorio actual):
+    <name>.prof para cProfile (se abre con snakeviz o pstats) o <name>.html para pyinstrument.
+    Incluye lo que corre en los hilos de trabajo envueltos con profile_worker.
+    """
+    global _profile
+    load_dotenv()
+    mode = os.getenv('SYNC_PROFILE', '').lower()
+    if mode not in ('cprofile', 'pyinstrument') or _profile is not None:
+        yield
+        return
+    if mode == 'pyinstrument':
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ pyinstrument no está instalado (pip install pyinstrument); se ejecuta sin perfilar")
+            yield
+            return
+    
+    _profile = {'mode': mode, 'workers': [], 'lock': threading.Lock()}
+    _profile_local.active = True
+    profiler = _start_profiler(mode)
+    try:
+        yield
+    finally:
+        main = _stop_profiler(mode, profiler)
+        _profile_local.active = False
+        workers, _profile = _profile['workers'], None
+        directory = os.getenv('SYNC_PROFILE_DIR', '.')
+        if mode == 'pyinstrument':
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+            session = main
+            for worker in workers:
+                session = Session.combine(session, worker)
+            path = os.path.join(directory, f'{name}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            import pstats
+            stats = pstats.Stats(main)
+            for worker in workers:
+                stats.add(worker)
+            path = os.path.join(directory, f'{name}.prof')
+            stats.dump_stats(path)
+        logger.info("🔬 Perfil guardado en %s (%s hilos de trabajo)", path, len(workers))
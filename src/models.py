@@ -0,0 +1,143 @@
+import json
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Stock infinito de Tiendanube (null): se publica en Shopify con esta cantidad
+INFINITE_STOCK = 999
+
+def normalize_stock(value) -> int:
+    """Cantidad a publicar en Shopify: el stock infinito (None) es 999 y el negativo es 0"""
+    if value is None:
+        return INFINITE_STOCK
+    return max(int(value), 0)
+
+class Variant:
+    __slots__ = ('id', 'stock')
+
+    def __init__(self, id: int, stock: int):
+        """
+        Stock de una variante de Tiendanube (solo lo que usa la sincronización)
+        
+        Args:
+            id (int): ID de la variante (o del producto, si no tiene variantes)
+            stock (int): Cantidad ya normalizada (ver normalize_stock)
+        """
+        self.id = id
+        self.stock = stock
+
+    @property
+    def sku(self) -> str:
+        """SKU en Shopify: el ID de Tiendanube"""
+        return str(self.id)
+
+class Product:
+    __slots__ = ('id', 'updated_at', 'name', 'variants', 'has_variants')
+
+    def __init__(self, id: int, updated_at: str, name: Optional[str], variants: Tuple[Variant, ...],
+                 has_variants: bool = True):
+        """
+        Producto de Tiendanube reducido a IDs, fecha de modificación y stock
+        
+        Args:
+            id (int): ID del producto
+            updated_at (str): Fecha de modificación tal como la informa la API ('' si falta)
+            name (str, optional): Nombre en español (solo para los logs)
+            variants (Tuple[Variant, ...]): Variantes con su stock
+            has_variants (bool): False si el producto no tiene variantes y su único item es él mismo
+        """
+        self.id = id
+        self.updated_at = updated_at
+        self.name = name
+        self.variants = variants
+        self.has_variants = has_variants
+
+    @classmethod
+    def build(cls, id: int, updated_at: Optional[str], name: Optional[str], variants: List[Variant],
+              stock=0) -> 'Product':
+        """Arma el producto; sin variantes, el propio producto es el único item (SKU = ID del producto)"""
+        if variants:
+            return cls(id, updated_at or '', name, tuple(variants))
+        return cls(id, updated_at or '', name, (Variant(id, normalize_stock(stock)),), has_variants=False)
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Product':
+        """Convierte un producto de la API (diccionario) descartando todo lo que no se usa"""
+        name = data.get('name')
+        return cls.build(
+            data['id'],
+            data.get('updated_at'),
+            name.get('es') if isinstance(name, dict) else name,
+            [Variant(variant['id'], normalize_stock(variant.get('stock', 0))) for variant in data.get('variants') or []],
+            data.get('stock', 0)
+        )
+
+    def stock_items(self) -> Iterator[Tuple[str, int]]:
+        """
+        Recorre el stock del producto como pares (SKU, cantidad)
+        
+        Yields:
+            Tuple[str, int]: SKU (ID de la variante, o del producto si no tiene variantes) y cantidad
+        """
+        for variant in self.variants:
+            yield variant.sku, variant.stock
+
+    @property
+    def out_of_stock(self) -> bool:
+        """True si ninguna variante tiene stock"""
+        return not any(variant.stock > 0 for variant in self.variants)
+
+def _ijson():
+    """ijson si está instalado (es opcional: sin él se decodifica cada página completa)"""
+    try:
+        import ijson
+    except ImportError:
+        return None
+    return ijson
+
+# Campos que se conservan del flujo de eventos de ijson (prefijo -> campo)
+_PRODUCT_FIELDS = {'item.id': 'id', 'item.updated_at': 'updated_at', 'item.name.es': 'name', 'item.stock': 'stock'}
+_VARIANT_FIELDS = {'item.variants.item.id': 'id', 'item.variants.item.stock': 'stock'}
+
+def _stream_products(events: Iterable[Tuple[str, str, object]]) -> Iterator[Product]:
+    """Arma los productos a partir de los eventos de ijson; el resto de los campos se saltea"""
+    fields: Dict = {}
+    variant: Dict = {}
+    variants: List[Variant] = []
+    for prefix, event, value in events:
+        if prefix in _VARIANT_FIELDS:
+            variant[_VARIANT_FIELDS[prefix]] = value
+        elif prefix in _PRODUCT_FIELDS:
+            fields[_PRODUCT_FIELDS[prefix]] = value
+        elif prefix == 'item.variants.item' and event == 'end_map':
+            variants.append(Variant(variant['id'], normalize_stock(variant.get('stock', 0))))
+            variant = {}
+        elif prefix == 'item' and event == 'end_map':
+            yield Product.build(fields['id'], fields.get('updated_at'), fields.get('name'), variants,
+                                fields.get('stock', 0))
+            fields, variants = {}, []
+
+def parse_products(source: BinaryIO) -> Optional[List[Product]]:
+    """
+    Convierte una página de productos de la API en productos compactos
+    
+    Con ijson el JSON se recorre como flujo de eventos: descripciones, imágenes y nombres
+    en otros idiomas nunca llegan a armarse como diccionarios. Sin ijson se decodifica
+    la página completa y se convierte producto por producto.
+    
+    Args:
+        source (BinaryIO): Cuerpo de la respuesta (archivo o respuesta en streaming)
+    
+    Returns:
+        Optional[List[Product]]: Productos de la página, o None si la respuesta no es una lista
+    """
+    ijson = _ijson()
+    if ijson is None:
+        data = json.load(source)
+        if not isinstance(data, list):
+            return None
+        return [Product.from_json(item) for item in data]
+    
+    events = ijson.parse(source)
+    first = next(events, None)
+    if first is None or first[1] != 'start_array':
+        return None
+    return list(_stream_products(events))
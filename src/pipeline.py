@@ -0,0 +1,294 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+from dotenv import load_dotenv
+from src.store_config import StoreConfig
+from src.shopify import ShopifyAPI, FAILURE_SKU_NOT_FOUND, FAILURE_NO_INVENTORY_ITEM, FAILURE_WRITE, FAILURE_ERROR
+from src.tiendanube import parse_updated_at
+from src.inventory_writer import InventoryWriter
+from src.job_queue import StockJobQueue
+from src.sync_state import SyncState
+from src.dead_letter import DeadLetterLog, from_env as dead_letters_from_env
+from src.sharding import StoreLeases, leases_from_env, run_leased, shard_from_env
+from src import log, metrics
+from src.sync_products import (
+    _advance_watermark,
+    _create_tiendanube,
+    _fetch_window,
+)
+
+logger = log.get_logger(__name__)
+
+def enqueue_store_changes(store_config: Dict, queue: StockJobQueue) -> int:
+    """
+    Productor: pide a Tiendanube los cambios de una tienda y los deja en la cola persistente
+    
+    La marca de agua avanza en cuanto las escrituras quedan encoladas: a partir de ahí
+    la cola garantiza que se van a aplicar aunque el proceso se reinicie.
+    
+    Args:
+        store_config (Dict): Configuración de la tienda
+        queue (StockJobQueue): Cola de escrituras
+    
+    Returns:
+        int: Número de SKUs encolados
+    """
+    api_url = store_config['api_url']
+    location = store_config.get('shopify_location') or ''
+    tiendanube = _create_tiendanube(store_config)
+    state = SyncState()
+    marca, desde = _fetch_window(state, api_url)
+    
+    versiones = {}
+    encolados = 0
+    lote: List[Dict] = []
+    try:
+        for producto in tiendanube.iter_products(updated_at_min=desde):
+            updated_at = producto.updated_at
+            versiones[producto.id] = (parse_updated_at(updated_at), updated_at)
+            if state.is_synced(api_url, producto.id, updated_at):
+                continue
+            
+            for sku, quantity in producto.stock_items():
+                lote.append({
+                    'sku': sku,
+                    'location': location,
+                    'store': api_url,
+                    'product_id': producto.id,
+                    'quantity': quantity
+                })
+            if len(lote) >= 500:
+                encolados += queue.enqueue_many(lote)
+                lote = []
+        encolados += queue.enqueue_many(lote)
+    finally:
+        tiendanube.client.close()
+    
+    _advance_watermark(state, api_url, marca, desde, versiones, set(versiones), tiendanube.last_fetch_complete)
+    logger.info("📥 %s SKUs encolados", encolados, extra={'enqueued': encolados})
+    return encolados
+
+class WriterPool:
+    def __init__(self, shopify: ShopifyAPI, queue: StockJobQueue, workers: int, batch_size: int,
+                 dead_letters: Optional[DeadLetterLog] = None):
+        """
+        Consumidores: hilos que toman escrituras de la cola y las aplican en Shopify en lotes
+        
+        Args:
+            shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+            queue (StockJobQueue): Cola de escrituras
+            workers (int): Cantidad de hilos
+            batch_size (int): Trabajos que toma cada hilo por vez
+            dead_letters (DeadLetterLog, optional): Registro donde quedan los SKUs sin mapeo y las escrituras fallidas
+        """
+        self.shopify = shopify
+        self.queue = queue
+        self.batch_size = batch_size
+        self.dead_letters = dead_letters
+        self.producers_done = threading.Event()
+        self.stats = {'escritos': 0, 'fallidos': 0, 'sin_mapeo': 0}
+        self._stats_lock = threading.Lock()
+        # tienda -> producto -> SKUs que siguen fallando en esta ejecución
+        self._productos: Dict[str, Dict[int, Set[str]]] = {}
+        self._threads = [
+            threading.Thread(target=metrics.profile_worker(self._run), name=f'shopify-writer-{i}', daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def join(self) -> None:
+        """Espera a que los hilos vacíen lo que está listo en la cola"""
+        self.producers_done.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _count(self, **deltas) -> None:
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+    def _track(self, ok: List[Dict], failures: List[tuple]) -> None:
+        """
+        Registra los fallos de un lote y anota qué productos quedaron bien
+        
+        Args:
+            ok (List[Dict]): Trabajos aplicados en Shopify
+            failures (List[tuple]): Pares (trabajo, motivo) que no se pudieron aplicar
+        """
+        if not self.dead_letters:
+            return
+        por_tienda: Dict[str, List] = {}
+        with self._stats_lock:
+            for job in ok:
+                self._productos.setdefault(job['store'], {}).setdefault(job['product_id'], set()).discard(job['sku'])
+            for job, reason in failures:
+                self._productos.setdefault(job['store'], {}).setdefault(job['product_id'], set()).add(job['sku'])
+                por_tienda.setdefault(job['store'], []).append((
+                    job['product_id'], job['sku'], reason,
+                    {'quantity': job['quantity'], 'location': job['location']}
+                ))
+        for store, rows in por_tienda.items():
+            self.dead_letters.record(store, rows)
+
+    def resolve_dead_letters(self) -> int:
+        """
+        Quita del registro los productos cuyos trabajos se aplicaron todos en esta ejecución
+        
+        Returns:
+            int: Entradas quitadas
+        """
+        if not self.dead_letters:
+            return 0
+        return sum(
+            self.dead_letters.resolve(store, [pid for pid, skus in productos.items() if not skus])
+            for store, productos in self._productos.items()
+        )
+
+    def _run(self) -> None:
+        writer = InventoryWriter(self.shopify)
+        while True:
+            jobs = self.queue.lease(self.batch_size)
+            if not jobs:
+                # Los trabajos en espera por reintento quedan para la próxima ejecución
+                if self.producers_done.is_set():
+                    return
+                time.sleep(0.5)
+                continue
+            
+            try:
+                with metrics.timer('pipeline_batch'):
+                    self._process(writer, jobs)
+            except Exception as e:
+                logger.exception("❌ Error procesando lote de la cola: %s", e)
+                self.queue.nack(jobs, str(e))
+                self._count(fallidos=len(jobs))
+                self._track([], [(job, FAILURE_ERROR) for job in jobs])
+
+    def _process(self, writer: InventoryWriter, jobs: List[Dict]) -> None:
+        claves = {}
+        sin_mapeo = []
+        motivos = {}
+        for job in jobs:
+            location = self.shopify.resolve_location(job['location'] or None)
+            result = self.shopify.find_variant_by_sku(job['sku'])
+            inventory_item_id = result['variant'].get('inventory_item_id') if result else None
+            if not inventory_item_id:
+                sin_mapeo.append(job)
+                motivos[id(job)] = FAILURE_NO_INVENTORY_ITEM if result else FAILURE_SKU_NOT_FOUND
+                continue
+            claves[id(job)] = writer.add(inventory_item_id, location['id'], job['quantity'], sku=job['sku'])
+        writer.flush()
+        
+        # Un SKU sin variante en Shopify no se arregla reintentando: sale de la cola y queda en el registro de fallos
+        if sin_mapeo:
+            logger.warning("❌ SKUs sin variante en Shopify: %s", len(sin_mapeo),
+                           extra={'skus': [job['sku'] for job in sin_mapeo[:50]]})
+        ok = [job for job in jobs if id(job) in claves and writer.results.get(claves[id(job)])]
+        fallidos = [job for job in jobs if id(job) in claves and not writer.results.get(claves[id(job)])]
+        self.queue.ack(ok + sin_mapeo)
+        if fallidos:
+            self.queue.nack(fallidos, 'Error al actualizar stock en Shopify')
+        self._track(ok, [(job, motivos[id(job)]) for job in sin_mapeo] + [(job, FAILURE_WRITE) for job in fallidos])
+        self._count(escritos=len(ok), fallidos=len(fallidos), sin_mapeo=len(sin_mapeo))
+        metrics.ITEMS.inc(len(ok), stage='pipeline', result='ok')
+        metrics.ITEMS.inc(len(fallidos), stage='pipeline', result='fallido')
+        metrics.ITEMS.inc(len(sin_mapeo), stage='pipeline', result='sin_mapeo')
+
+def run_pipeline(stores: List[Dict], shopify: ShopifyAPI, fetch: bool = True,
+                 leases: Optional[StoreLeases] = None) -> Dict[str, int]:
+    """
+    Sincroniza las tiendas con productores y consumidores desacoplados por la cola persistente
+    
+    Al arrancar, los consumidores procesan primero lo que haya quedado en la cola
+    de una ejecución anterior interrumpida.
+    
+    Args:
+        stores (List[Dict]): Tiendas a sincronizar
+        shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+        fetch (bool): Si es False, solo se vacía la cola sin pedir cambios a Tiendanube
+        leases (StoreLeases, optional): Préstamos compartidos con los demás workers (ver src/sharding.py)
+    
+    Returns:
+        Dict[str, int]: Estadísticas de la ejecución
+    """
+    load_dotenv()
+    queue = StockJobQueue()
+    pendientes = _report_depth(queue)
+    if pendientes:
+        logger.info("📬 Trabajos en la cola al iniciar: %s", pendientes, extra={'queue': pendientes})
+    
+    pool = WriterPool(
+        shopify,
+        queue,
+        workers=max(1, int(os.getenv('PIPELINE_WORKERS', 4))),
+        batch_size=int(os.getenv('PIPELINE_BATCH_SIZE', InventoryWriter.MAX_BATCH_SIZE)),
+        dead_letters=dead_letters_from_env()
+    )
+    pool.start()
+    
+    encolados = 0
+    if fetch:
+        max_workers = max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY', 4)))
+        enqueue = metrics.profile_worker(lambda store: _safe_enqueue(store, queue, leases))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for resultado in executor.map(enqueue, stores):
+                encolados += resultado
+    pool.join()
+    pool.resolve_dead_letters()
+    
+    stats = dict(pool.stats, encolados=encolados)
+    pendientes = _report_depth(queue)
+    logger.info("📬 Trabajos en la cola al terminar: %s", pendientes, extra={'queue': pendientes})
+    return stats
+
+def _report_depth(queue: StockJobQueue) -> Dict[str, int]:
+    """Publica la profundidad de la cola por estado en las métricas"""
+    depth = queue.depth()
+    for status in ('pending', 'leased', 'failed'):
+        metrics.QUEUE_DEPTH.set(depth.get(status, 0), status=status)
+    return depth
+
+def _safe_enqueue(store: Dict, queue: StockJobQueue, leases: Optional[StoreLeases] = None) -> int:
+    with log.store_context(store['api_url']):
+        try:
+            # Con varios workers, la tienda se encola solo si ningún otro la tiene en curso
+            return run_leased(leases, store['api_url'], lambda: enqueue_store_changes(store, queue)) or 0
+        except Exception as e:
+            logger.exception("❌ Error obteniendo cambios: %s", e)
+            return 0
+
+def main(fetch: bool = True):
+    """Ejecuta una sincronización completa por la cola persistente"""
+    log.new_run()
+    metrics.start_from_env()
+    if os.getenv('STOCK_AGGREGATION'):
+        logger.warning("⚠️ La cola persistente no combina el stock entre tiendas (STOCK_AGGREGATION se ignora)")
+    try:
+        stores = shard_from_env(StoreConfig().get_all_stores())
+        shopify = ShopifyAPI()
+        
+        inicio = time.monotonic()
+        with metrics.profiled('pipeline'):
+            stats = run_pipeline(stores, shopify, fetch=fetch, leases=leases_from_env())
+        
+        logger.info(
+            "🎉 Proceso completado en %.1fs: %s SKUs encolados, %s escritos, %s fallidos, %s sin mapeo",
+            time.monotonic() - inicio, stats['encolados'], stats['escritos'], stats['fallidos'], stats['sin_mapeo'],
+            extra=stats
+        )
+    
+    except Exception as e:
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('pipeline')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sincronización por cola persistente')
+    parser.add_argument('--drain', action='store_true', help='Solo procesa lo que quedó en la cola')
+    main(fetch=not parser.parse_args().drain)
@@ -0,0 +1,324 @@
+import csv
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+from src.store_config import StoreConfig
+from src.shopify import ShopifyAPI, PERMANENT_FAILURES
+from src.inventory_writer import InventoryWriter
+from src.sync_state import SyncState
+from src.sync_products import sync_product, _create_tiendanube, _fetch_window
+from src.sharding import shard_from_env
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+# Columnas del plan (JSONL y CSV)
+FIELDS = ('store', 'product_id', 'sku', 'inventory_item_id', 'location_id', 'old', 'new')
+FORMATS = ('jsonl', 'csv')
+
+# Balde GraphQL de Shopify (plan estándar) y costo de una mutación inventorySetQuantities
+GRAPHQL_BUCKET_SIZE = 1000
+GRAPHQL_RESTORE_RATE = 50
+GRAPHQL_MUTATION_COST = 10
+
+def _format(path: str, fmt: Optional[str] = None) -> str:
+    """Formato del plan: el indicado o, si no, según la extensión del archivo (JSONL por defecto)"""
+    fmt = (fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de plan desconocido: {fmt} (opciones: {', '.join(FORMATS)})")
+    return fmt
+
+def _bucket_seconds(calls: float, capacity: float, refill_rate: float) -> float:
+    """Segundos mínimos para hacer calls peticiones con un balde lleno de capacity tokens"""
+    return max(calls - capacity, 0) / refill_rate if refill_rate > 0 else 0.0
+
+class Plan:
+    def __init__(self, path: str, fmt: Optional[str] = None):
+        """
+        Archivo de plan: las escrituras previstas se agregan a medida que se calculan
+        
+        Args:
+            path (str): Ruta del archivo de salida
+            fmt (str, optional): 'jsonl' o 'csv'. Si no se proporciona, se deduce de la extensión
+        """
+        self.path = path
+        self.format = _format(path, fmt)
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._csv = csv.DictWriter(self._file, fieldnames=FIELDS) if self.format == 'csv' else None
+        if self._csv:
+            self._csv.writeheader()
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.unchanged = 0
+        self.lookups = 0
+        # URL de API de la tienda -> {'tiendanube_calls', 'writes'}
+        self.stores: Dict[str, Dict] = {}
+
+    def write(self, rows: List[Dict], unchanged: int = 0, lookups: int = 0) -> None:
+        """Agrega escrituras previstas al archivo (varias tiendas escriben en paralelo)"""
+        with self._lock:
+            for row in rows:
+                if self._csv:
+                    self._csv.writerow({key: '' if value is None else value for key, value in row.items()})
+                else:
+                    self._file.write(json.dumps(row) + '\n')
+            self._file.flush()
+            self.writes += len(rows)
+            self.unchanged += unchanged
+            self.lookups += lookups
+
+    def record_store(self, store: str, tiendanube_calls: int, writes: int) -> None:
+        """Registra las peticiones a Tiendanube y las escrituras previstas de una tienda"""
+        with self._lock:
+            self.stores[store] = {'tiendanube_calls': tiendanube_calls, 'writes': writes}
+
+    def estimate(self, shopify_read_calls: int) -> Dict:
+        """
+        Estima las peticiones y la duración mínima de aplicar el plan con los límites de tasa actuales
+        
+        Las lecturas son las que hizo el plan para traer y resolver los productos (sin contar
+        las consultas de stock actual, que la sincronización no hace); las escrituras se envían
+        en lotes de SHOPIFY_WRITE_BATCH_SIZE por tienda.
+        
+        Args:
+            shopify_read_calls (int): Peticiones REST a Shopify para resolver los SKUs
+        
+        Returns:
+            Dict: Peticiones por API y segundos estimados
+        """
+        load_dotenv()
+        batch_size = min(int(os.getenv('SHOPIFY_WRITE_BATCH_SIZE', InventoryWriter.MAX_BATCH_SIZE)),
+                         InventoryWriter.MAX_BATCH_SIZE)
+        workers = max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY', 4)))
+        
+        # Cada tienda tiene su propio balde de Tiendanube; las tiendas corren de a `workers`
+        tn_seconds = [
+            _bucket_seconds(entry['tiendanube_calls'], float(os.getenv('TIENDANUBE_BUCKET_SIZE', 40)),
+                            float(os.getenv('TIENDANUBE_MAX_REQUESTS_PER_SECOND', 2)))
+            for entry in self.stores.values()
+        ]
+        tiendanube_seconds = max(max(tn_seconds, default=0), sum(tn_seconds) / workers)
+        
+        write_calls = sum(math.ceil(entry['writes'] / batch_size) for entry in self.stores.values())
+        shopify_seconds = _bucket_seconds(shopify_read_calls, float(os.getenv('SHOPIFY_BUCKET_SIZE', 40)),
+                                          float(os.getenv('SHOPIFY_MAX_REQUESTS_PER_SECOND', 2)))
+        graphql_seconds = _bucket_seconds(write_calls * GRAPHQL_MUTATION_COST, GRAPHQL_BUCKET_SIZE,
+                                          GRAPHQL_RESTORE_RATE)
+        tiendanube_calls = sum(entry['tiendanube_calls'] for entry in self.stores.values())
+        return {
+            'stores': len(self.stores),
+            'writes': self.writes,
+            'unchanged': self.unchanged,
+            'tiendanube_calls': tiendanube_calls,
+            'shopify_read_calls': shopify_read_calls,
+            'shopify_write_calls': write_calls,
+            'api_calls': tiendanube_calls + shopify_read_calls + write_calls,
+            # Cota conservadora: Tiendanube y Shopify se suman aunque en la práctica se solapan
+            'estimated_seconds': round(tiendanube_seconds + shopify_seconds + graphql_seconds, 1),
+        }
+
+    def close(self) -> None:
+        self._file.close()
+
+class PlanWriter(InventoryWriter):
+    # inventory_levels.json acepta hasta 50 inventory_item_ids por petición
+    LOOKUP_BATCH_SIZE = 50
+
+    def __init__(self, shopify, plan: Plan, store: str):
+        """
+        Reemplaza a InventoryWriter en modo plan: en lugar de escribir, consulta el stock actual
+        en Shopify y agrega al plan los items cuya cantidad cambiaría
+        
+        Args:
+            shopify (ShopifyAPI): Cliente de Shopify
+            plan (Plan): Archivo de plan compartido
+            store (str): URL de API de la tienda
+        """
+        # La foto local no se abre ni se toca: el plan no escribe nada
+        super().__init__(shopify, batch_size=self.LOOKUP_BATCH_SIZE, snapshot=False, skip_unchanged=False)
+        self.plan = plan
+        self.store = store
+        self.planned = 0
+
+    def flush(self) -> Dict[Tuple[str, str], bool]:
+        """Consulta el stock actual de los items pendientes y agrega al plan los que cambian"""
+        by_location: Dict[str, List[Tuple[str, str]]] = {}
+        for key in self.pending:
+            by_location.setdefault(key[1], []).append(key)
+        
+        flushed = {}
+        for location_id, keys in by_location.items():
+            for i in range(0, len(keys), self.batch_size):
+                chunk = keys[i:i + self.batch_size]
+                current = self.shopify.get_inventory_levels([key[0] for key in chunk], location_id)
+                rows = []
+                for key in chunk:
+                    entry = self.pending.pop(key)
+                    old = current.get(key[0])
+                    if old == entry['quantity']:
+                        self.skipped += 1
+                    else:
+                        rows.append({
+                            'store': self.store,
+                            'product_id': ','.join(str(ref) for ref in sorted(entry['refs'])) or None,
+                            'sku': ','.join(sorted(entry['skus'])) or None,
+                            'inventory_item_id': key[0],
+                            'location_id': key[1],
+                            'old': old,
+                            'new': entry['quantity'],
+                        })
+                    flushed[key] = True
+                    self._record(key, entry, True)
+                self.planned += len(rows)
+                self.plan.write(rows, unchanged=len(chunk) - len(rows), lookups=1)
+        return flushed
+
+def plan_store(store_config: dict, shopify: ShopifyAPI, plan: Plan) -> Dict:
+    """
+    Calcula las escrituras de una tienda igual que sync_store, pero sin escribir
+    en Shopify ni avanzar la marca de agua
+    
+    Args:
+        store_config (dict): Configuración de la tienda
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        plan (Plan): Archivo de plan
+    
+    Returns:
+        Dict: Resumen de la tienda
+    """
+    api_url = store_config['api_url']
+    tiendanube = _create_tiendanube(store_config)
+    state = SyncState()
+    _, desde = _fetch_window(state, api_url)
+    writer = PlanWriter(shopify, plan, api_url)
+    
+    productos = duplicados = sin_mapeo = 0
+    try:
+        for producto in tiendanube.iter_products(updated_at_min=desde):
+            productos += 1
+            # La sincronización omitiría la misma versión ya sincronizada
+            if state.is_synced(api_url, producto.id, producto.updated_at):
+                duplicados += 1
+                continue
+            fallos = []
+            if not sync_product(producto, shopify, writer, store_config.get('shopify_location'), fallos):
+                if fallos and all(motivo in PERMANENT_FAILURES for _, motivo in fallos):
+                    sin_mapeo += 1
+        writer.flush()
+        tiendanube_calls = tiendanube.client.connection_stats()['requests']
+    finally:
+        tiendanube.client.close()
+    
+    plan.record_store(api_url, tiendanube_calls, writer.planned)
+    logger.info("📝 %s: %s escrituras previstas (%s productos, %s sin cambios, %s ya sincronizados, %s sin mapeo)",
+                api_url, writer.planned, productos, writer.skipped, duplicados, sin_mapeo,
+                extra={'products_found': productos, 'writes': writer.planned, 'unchanged': writer.skipped,
+                       'products_duplicated': duplicados, 'products_unmapped': sin_mapeo})
+    return {'api_url': api_url, 'writes': writer.planned}
+
+def create_plan(stores: List[Dict], shopify: ShopifyAPI, path: str, fmt: Optional[str] = None) -> Dict:
+    """
+    Genera el plan de todas las tiendas
+    
+    Args:
+        stores (List[Dict]): Tiendas a planificar
+        shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+        path (str): Archivo de salida
+        fmt (str, optional): 'jsonl' o 'csv'
+    
+    Returns:
+        Dict: Estimación de peticiones y duración (ver Plan.estimate)
+    """
+    plan = Plan(path, fmt)
+    reads_before = shopify.client.connection_stats()['requests']
+    max_workers = max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY', 4)))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda store: plan_store(store, shopify, plan), stores))
+    finally:
+        plan.close()
+    shopify_reads = shopify.client.connection_stats()['requests'] - reads_before - plan.lookups
+    return plan.estimate(shopify_reads)
+
+def read_plan(path: str, fmt: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Lee un plan guardado fila por fila
+    
+    Args:
+        path (str): Archivo del plan
+        fmt (str, optional): 'jsonl' o 'csv'. Si no se proporciona, se deduce de la extensión
+    
+    Yields:
+        Dict: Cada escritura prevista
+    """
+    fmt = _format(path, fmt)
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield row
+
+def apply_plan(path: str, shopify: ShopifyAPI, fmt: Optional[str] = None) -> Dict[str, int]:
+    """
+    Aplica un plan guardado: escribe en lote las cantidades nuevas tal como quedaron en el plan
+    
+    Args:
+        path (str): Archivo del plan
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        fmt (str, optional): 'jsonl' o 'csv'
+    
+    Returns:
+        Dict[str, int]: Items escritos y fallidos
+    """
+    # El plan ya comparó contra Shopify: la foto local no decide qué se omite
+    writer = InventoryWriter(shopify, skip_unchanged=False)
+    for row in read_plan(path, fmt):
+        writer.add(row['inventory_item_id'], row['location_id'], int(row['new']), sku=row.get('sku') or None,
+                   ref=row.get('product_id') or None)
+    with metrics.timer('shopify_flush'):
+        writer.flush()
+    written = sum(1 for ok in writer.results.values() if ok)
+    return {'escritos': written, 'fallidos': len(writer.results) - written}
+
+def main(path: str, fmt: Optional[str] = None):
+    """Genera el plan de todas las tiendas configuradas sin escribir en Shopify"""
+    load_dotenv()
+    log.new_run()
+    metrics.start_from_env()
+    try:
+        if os.getenv('STOCK_AGGREGATION'):
+            logger.warning("⚠️ El plan calcula cada tienda por separado: STOCK_AGGREGATION se ignora")
+        # Con SHARD_COUNT, cada worker planifica solo sus tiendas (el plan no escribe: no toma préstamos)
+        stores = shard_from_env(StoreConfig().get_all_stores())
+        inicio = time.monotonic()
+        logger.info("📝 Calculando plan de %s tiendas en %s", len(stores), path)
+        estimate = create_plan(stores, ShopifyAPI(), path, fmt)
+        logger.info("🎉 Plan generado en %.1fs: %s escrituras previstas (%s sin cambios), %s peticiones, ~%.0fs al aplicarlo",
+                    time.monotonic() - inicio, estimate['writes'], estimate['unchanged'], estimate['api_calls'],
+                    estimate['estimated_seconds'], extra=estimate)
+        for key, value in estimate.items():
+            logger.info("📊 %s: %s", key.replace('_', ' ').capitalize(), value)
+    except Exception as e:
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('plan')
+
+def apply_main(path: str, fmt: Optional[str] = None):
+    """Aplica un plan guardado con --plan"""
+    load_dotenv()
+    log.new_run()
+    metrics.start_from_env()
+    try:
+        inicio = time.monotonic()
+        logger.info("🚚 Aplicando plan %s", path)
+        stats = apply_plan(path, ShopifyAPI(), fmt)
+        logger.info("🎉 Plan aplicado en %.1fs: %s items escritos, %s fallidos",
+                    time.monotonic() - inicio, stats['escritos'], stats['fallidos'], extra=stats)
+    except Exception as e:
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('plan')
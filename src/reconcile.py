@@ -0,0 +1,242 @@
+import argparse
+import os
+import time
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from src.store_config import StoreConfig
+from src.shopify import ShopifyAPI
+from src.inventory_writer import InventoryWriter
+from src.sync_products import _create_tiendanube
+from src.aggregation import StockAggregator, combine_values, from_env as aggregator_from_env
+from src.sharding import hold_stores, leases_from_env, shard_from_env, shard_settings
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+# Cantidad usada para los items cuyo inventario Shopify no controla (available null)
+UNTRACKED = -1
+
+class CompactStockMap:
+    def __init__(self):
+        """
+        Pares inventory_item_id -> cantidad guardados en arreglos de enteros
+        
+        Ocupa unos 24 bytes por variante (contra cientos de un dict), lo que permite
+        reconciliar catálogos de 100k+ variantes con memoria acotada.
+        """
+        self.keys = array('q')
+        self.values = array('q')
+        self.skus = array('q')
+        # Posición desde la que se cargó la tienda principal (agregación 'primary')
+        self.primary_from: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def append(self, key: int, value: int, sku: int = 0) -> None:
+        self.keys.append(key)
+        self.values.append(value)
+        self.skus.append(sku)
+
+    def sorted_items(self, merge: Optional[Callable] = None) -> Iterator[Tuple[int, int, int]]:
+        """
+        Recorre los pares ordenados por clave
+        
+        Args:
+            merge (Callable, optional): Combina las cantidades de una clave repetida; recibe
+                las cantidades y la de la tienda principal (o None). Si no se proporciona,
+                gana la última agregada
+        
+        Yields:
+            Tuple[int, int, int]: (clave, cantidad, sku)
+        """
+        # El orden es estable: las repeticiones de una clave quedan en orden de carga
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        group: List[int] = []
+        for i in order:
+            if group and self.keys[i] != self.keys[group[0]]:
+                yield self._merged(group, merge)
+                group = []
+            group.append(i)
+        if group:
+            yield self._merged(group, merge)
+
+    def _merged(self, group: List[int], merge: Optional[Callable]) -> Tuple[int, int, int]:
+        last = group[-1]
+        if merge is None or len(group) == 1:
+            return self.keys[last], self.values[last], self.skus[last]
+        primary = [i for i in group if self.primary_from is not None and i >= self.primary_from]
+        primary_value = self.values[primary[-1]] if primary else None
+        return self.keys[last], merge([self.values[i] for i in group], primary_value), self.skus[last]
+
+def _new_stats() -> Dict[str, int]:
+    return {
+        'variantes_tiendanube': 0,
+        'niveles_shopify': 0,
+        'coincidencias': 0,
+        'diferencias': 0,
+        'desvio_total': 0,
+        'sin_sku_en_shopify': 0,
+        'sin_nivel_en_ubicacion': 0,
+        'no_controlados': 0,
+        'solo_en_shopify': 0,
+        'corregidos': 0,
+        'fallidos': 0,
+    }
+
+def _load_tiendanube(stores: List[Dict], shopify: ShopifyAPI, stats: Dict,
+                     aggregator: Optional[StockAggregator] = None) -> Dict[int, CompactStockMap]:
+    """
+    Recorre el catálogo completo de cada tienda y lo agrupa por ubicación de Shopify
+    
+    Args:
+        stores (List[Dict]): Tiendas a recorrer
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        stats (Dict): Estadísticas a actualizar
+        aggregator (StockAggregator, optional): Si se indica, la tienda principal se carga al final
+    
+    Returns:
+        Dict[int, CompactStockMap]: location_id -> inventory_item_id -> cantidad en Tiendanube
+    """
+    by_location: Dict[int, CompactStockMap] = {}
+    if aggregator:
+        stores = sorted(stores, key=lambda store: aggregator.is_primary(store['api_url']))
+    for store in stores:
+        location = shopify.resolve_location(store.get('shopify_location'))
+        stock_map = by_location.setdefault(location['id'], CompactStockMap())
+        if aggregator and aggregator.is_primary(store['api_url']):
+            stock_map.primary_from = len(stock_map)
+        
+        tiendanube = _create_tiendanube(store)
+        try:
+            for product in tiendanube.iter_products(full_catalog=True):
+                for sku, quantity in product.stock_items():
+                    stats['variantes_tiendanube'] += 1
+                    result = shopify.find_variant_by_sku(sku)
+                    inventory_item_id = result['variant'].get('inventory_item_id') if result else None
+                    if not inventory_item_id:
+                        stats['sin_sku_en_shopify'] += 1
+                        continue
+                    stock_map.append(int(inventory_item_id), quantity, int(sku))
+        finally:
+            tiendanube.client.close()
+        
+        if not tiendanube.last_fetch_complete:
+            logger.warning("⚠️ El catálogo de %s no se pudo recorrer completo", store['api_url'])
+    return by_location
+
+def reconcile(stores: List[Dict], shopify: ShopifyAPI, apply: bool = True) -> Dict[str, int]:
+    """
+    Compara el catálogo completo de Tiendanube con los niveles de inventario de Shopify
+    y corrige solo las diferencias
+    
+    Ambos catálogos se cargan en arreglos compactos, se ordenan por inventory_item_id
+    y se comparan en una sola pasada (merge de listas ordenadas).
+    
+    Args:
+        stores (List[Dict]): Tiendas a reconciliar
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        apply (bool): Si es False, solo informa el desvío sin escribir
+    
+    Returns:
+        Dict[str, int]: Estadísticas de desvío
+    """
+    stats = _new_stats()
+    # Con STOCK_AGGREGATION, las tiendas que alimentan el mismo item se combinan igual que en la sincronización
+    aggregator = aggregator_from_env()
+    merge = (lambda values, primary: combine_values(values, aggregator.policy, primary)) if aggregator else None
+    with metrics.timer('reconcile_load'):
+        by_location = _load_tiendanube(stores, shopify, stats, aggregator)
+    writer = InventoryWriter(shopify, skip_unchanged=False) if apply else None
+    
+    for location_id, tn_map in by_location.items():
+        sh_map = CompactStockMap()
+        for inventory_item_id, available in shopify.iter_inventory_levels(location_id):
+            sh_map.append(inventory_item_id, UNTRACKED if available is None else available)
+        stats['niveles_shopify'] += len(sh_map)
+        
+        matched = {}
+        tn_items = tn_map.sorted_items(merge)
+        sh_items = sh_map.sorted_items()
+        tn_item = next(tn_items, None)
+        sh_item = next(sh_items, None)
+        while tn_item is not None or sh_item is not None:
+            if sh_item is None or (tn_item is not None and tn_item[0] < sh_item[0]):
+                # El item no está habilitado en esta ubicación
+                stats['sin_nivel_en_ubicacion'] += 1
+                tn_item = next(tn_items, None)
+                continue
+            if tn_item is None or sh_item[0] < tn_item[0]:
+                stats['solo_en_shopify'] += 1
+                sh_item = next(sh_items, None)
+                continue
+            
+            inventory_item_id, quantity, sku = tn_item
+            current = sh_item[1]
+            if current == UNTRACKED:
+                stats['no_controlados'] += 1
+            elif current == quantity:
+                stats['coincidencias'] += 1
+                matched[(str(inventory_item_id), str(location_id))] = quantity
+            else:
+                stats['diferencias'] += 1
+                stats['desvio_total'] += abs(current - quantity)
+                if writer:
+                    writer.add(inventory_item_id, location_id, quantity, sku=str(sku))
+            tn_item = next(tn_items, None)
+            sh_item = next(sh_items, None)
+        
+        # Lo que ya coincide queda registrado para que la sincronización incremental no lo reescriba
+        if writer and writer.snapshot:
+            writer.snapshot.set_many(matched)
+    
+    if writer:
+        with metrics.timer('shopify_flush'):
+            writer.flush()
+        stats['corregidos'] = sum(1 for ok in writer.results.values() if ok)
+        stats['fallidos'] = sum(1 for ok in writer.results.values() if not ok)
+    return stats
+
+def main(apply: bool = True):
+    """Reconciliación completa de todas las tiendas configuradas"""
+    log.new_run()
+    metrics.start_from_env()
+    try:
+        stores = StoreConfig().get_all_stores()
+        index, count = shard_settings()
+        if os.getenv('STOCK_AGGREGATION') and count > 1:
+            # El valor combinado necesita todas las tiendas que alimentan cada item
+            if index != 0:
+                logger.info("🧩 Con STOCK_AGGREGATION la reconciliación la hace solo el shard 0")
+                return
+            logger.info("🧩 Con STOCK_AGGREGATION el shard 0 reconcilia todas las tiendas")
+        else:
+            stores = shard_from_env(stores)
+        shopify = ShopifyAPI()
+        
+        inicio = time.monotonic()
+        with hold_stores(leases_from_env(), stores) as tomadas:
+            if os.getenv('STOCK_AGGREGATION') and len(tomadas) < len(stores):
+                logger.warning("⚠️ Hay tiendas en curso en otros workers: sin ellas el stock combinado sería incorrecto, "
+                               "se omite la reconciliación")
+                return
+            stores = tomadas
+            logger.info("🔄 Reconciliando %s tiendas con Shopify%s", len(stores), '' if apply else ' (solo informe)')
+            with metrics.profiled('reconcile'):
+                stats = reconcile(stores, shopify, apply=apply)
+        
+        porcentaje = 100 * stats['diferencias'] / stats['variantes_tiendanube'] if stats['variantes_tiendanube'] else 0
+        logger.info("🎉 Reconciliación completada en %.1fs: %s diferencias (%.2f%% de las variantes), %s corregidas",
+                    time.monotonic() - inicio, stats['diferencias'], porcentaje, stats['corregidos'], extra=stats)
+        for key, value in stats.items():
+            logger.info("📊 %s: %s", key.replace('_', ' ').capitalize(), value)
+    
+    except Exception as e:
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('reconcile')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reconciliación completa de stock Tiendanube -> Shopify')
+    parser.add_argument('--dry-run', action='store_true', help='Solo informa el desvío, sin escribir')
+    main(apply=not parser.parse_args().dry_run)
@@ -1,41 +1,198 @@
-import schedule
-import time
-from datetime import datetime
+import argparse
 import os
 import sys
-from src.sync_products import main as sync_products
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from src.store_config import StoreConfig
+from src.shopify import ShopifyAPI
+from src.store_schedule import StoreSchedule
+from src.aggregation import from_env as aggregator_from_env
+from src.sharding import StoreLeases, leases_from_env, run_leased, shard_from_env
+from src.sync_products import _timed_sync_store
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+class AdaptiveScheduler:
+    def __init__(self, stores: List[Dict], shopify: ShopifyAPI, schedule: Optional[StoreSchedule] = None,
+                 max_workers: Optional[int] = None, tick_seconds: Optional[float] = None,
+                 leases: Optional[StoreLeases] = None):
+        """
+        Programa cada tienda por separado, con un intervalo que se adapta a su ritmo de cambios
+        
+        Una tienda nunca se sincroniza dos veces a la vez; si vence (o se pide) mientras
+        está en curso, se vuelve a ejecutar al terminar.
+        
+        Args:
+            stores (List[Dict]): Configuración de las tiendas
+            shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+            schedule (StoreSchedule, optional): Estado persistente del programador
+            max_workers (int, optional): Tiendas en paralelo. Si no se proporciona, se usa TIENDANUBE_MAX_CONCURRENCY
+            tick_seconds (float, optional): Cada cuánto se revisan vencimientos y pedidos.
+                Si no se proporciona, se usa SCHEDULER_TICK_SECONDS
+            leases (StoreLeases, optional): Préstamos compartidos con los demás workers (ver src/sharding.py)
+        """
+        load_dotenv()
+        self.stores = {store['api_url']: store for store in stores}
+        self.shopify = shopify
+        self.schedule = schedule or StoreSchedule()
+        self.max_workers = max_workers or max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY', 4)))
+        self.tick_seconds = tick_seconds or float(os.getenv('SCHEDULER_TICK_SECONDS', 5))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='store')
+        self.next_runs = self.schedule.register(list(self.stores))
+        self.running = set()
+        self.requested = set()
+        # Con STOCK_AGGREGATION cada ejecución escribe el valor combinado con lo último de las demás tiendas
+        self.aggregator = aggregator_from_env()
+        self.leases = leases
+        self._lock = threading.Lock()
+
+    def tick(self, now: Optional[float] = None) -> List[str]:
+        """
+        Lanza las tiendas vencidas o pedidas que no estén en curso
+        
+        Args:
+            now (float, optional): Momento actual (epoch)
+        
+        Returns:
+            List[str]: Tiendas lanzadas en esta revisión
+        """
+        now = now or time.time()
+        for store in self.schedule.pop_triggers():
+            if store in self.stores:
+                logger.info("⚡ Sincronización inmediata pedida para %s", store)
+                with self._lock:
+                    self.requested.add(store)
+            else:
+                logger.warning("⚠️ Pedido de sincronización para una tienda no configurada: %s", store)
+        
+        launched = []
+        with self._lock:
+            due = [store for store, next_run in self.next_runs.items() if next_run <= now]
+            for store in dict.fromkeys(list(self.requested) + due):
+                if store in self.running:
+                    continue
+                self.running.add(store)
+                self.requested.discard(store)
+                self.executor.submit(self._run, store)
+                launched.append(store)
+        return launched
+
+    def _run(self, store: str) -> None:
+        """Sincroniza una tienda y la reprograma según los cambios que encontró"""
+        started_at = time.time()
+        try:
+            resumen = run_leased(self.leases, store,
+                                 lambda: _timed_sync_store(self.stores[store], self.shopify, self.aggregator))
+            if resumen is None:
+                # Otro worker la tiene en curso: se reintenta tras el intervalo mínimo
+                with self._lock:
+                    self.next_runs[store] = time.time() + self.schedule.min_interval
+                return
+            if self.aggregator:
+                self.aggregator.flush(self.shopify)
+            if resumen['error']:
+                # Una ejecución fallida no dice nada del ritmo de cambios: se reintenta tras el intervalo mínimo
+                logger.warning("⚠️ %s: la sincronización falló (%s), se reintenta en %.1f minutos", store,
+                               resumen['error'], self.schedule.min_interval / 60, extra={'error': resumen['error']})
+                with self._lock:
+                    self.next_runs[store] = time.time() + self.schedule.min_interval
+                return
+            state = self.schedule.record_run(store, resumen['productos'], started_at, time.time())
+            metrics.SCHEDULE_INTERVAL.set(round(state['interval']), store=store)
+            with self._lock:
+                self.next_runs[store] = state['next_run']
+            logger.info("🗓️ %s: %s cambios, próxima sincronización en %.1f minutos", store, resumen['productos'],
+                        (state['next_run'] - time.time()) / 60,
+                        extra={'changes': resumen['productos'], 'interval': round(state['interval']),
+                               'change_rate': state['change_rate']})
+        except Exception as e:
+            logger.exception("❌ Error en la sincronización programada de %s: %s", store, e)
+            with self._lock:
+                self.next_runs[store] = time.time() + self.schedule.min_interval
+        finally:
+            with self._lock:
+                self.running.discard(store)
+            metrics.export('scheduler')
+
+    def run_forever(self) -> None:
+        """Revisa vencimientos y pedidos cada tick_seconds hasta Ctrl+C"""
+        while True:
+            try:
+                self.tick()
+                time.sleep(self.tick_seconds)
+            except KeyboardInterrupt:
+                logger.info("👋 Deteniendo scheduler (esperando las tiendas en curso)...")
+                self.executor.shutdown(wait=True)
+                return
+            except Exception as e:
+                logger.exception("❌ Error en el scheduler: %s", e)
+                time.sleep(self.tick_seconds)
 
-def job():
-    """Ejecuta la sincronización de stock"""
-    print(f"\n🕒 Iniciando sincronización programada: {datetime.now()}")
+def _resolve_store(store_config: StoreConfig, target: str) -> Dict:
+    """Busca una tienda por URL de API o por ID de Tiendanube"""
     try:
-        sync_products()
-        print(f"✅ Sincronización completada: {datetime.now()}")
-    except Exception as e:
-        print(f"❌ Error en la sincronización: {e}")
+        return store_config.get_store_config(target)
+    except ValueError:
+        return store_config.get_store_by_id(target)
 
-def main():
-    # Configurar el trabajo para que se ejecute cada hora
-    schedule.every(1).hours.do(job)
+def run() -> None:
+    """Inicia el programador adaptativo con todas las tiendas configuradas"""
+    log.new_run()
+    metrics.start_from_env()
+    stores = shard_from_env(StoreConfig().get_all_stores())
+    scheduler = AdaptiveScheduler(stores, ShopifyAPI(), leases=leases_from_env())
     
-    print("🔄 Iniciando scheduler...")
-    print("ℹ️ La sincronización se ejecutará cada hora")
-    print("ℹ️ Presiona Ctrl+C para detener")
+    logger.info("🔄 Iniciando scheduler: %s tiendas, intervalo entre %.0f y %.0f minutos (Ctrl+C para detener)",
+                len(stores), scheduler.schedule.min_interval / 60, scheduler.schedule.max_interval / 60)
+    for store, next_run in sorted(scheduler.next_runs.items(), key=lambda item: item[1]):
+        logger.info("🗓️ %s: primera sincronización a las %s", store, datetime.fromtimestamp(next_run).strftime('%H:%M:%S'))
+    scheduler.run_forever()
+
+def trigger(target: str) -> None:
+    """Pide al programador en ejecución que sincronice una tienda ahora"""
+    store = _resolve_store(StoreConfig(), target)
+    StoreSchedule().trigger(store['api_url'])
+    logger.info("⚡ Sincronización inmediata pedida para %s", store['api_url'])
+
+def status() -> None:
+    """Muestra el intervalo, el ritmo de cambios y la próxima ejecución de cada tienda"""
+    rows = StoreSchedule().all()
+    if not rows:
+        print("No hay tiendas programadas todavía")
+        return
+    now = time.time()
+    print(f"{'Tienda':<45} {'Intervalo':>10} {'Cambios/h':>10} {'Últimos':>8} {'Próxima':>10}")
+    for row in rows:
+        print(f"{row['store']:<45} {row['interval'] / 60:>9.1f}m {row['change_rate'] * 3600:>10.1f} "
+              f"{row['last_changes'] if row['last_changes'] is not None else '-':>8} "
+              f"{max(row['next_run'] - now, 0) / 60:>9.1f}m")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Programador de sincronizaciones por tienda')
+    subparsers = parser.add_subparsers(dest='command')
     
-    # Ejecutar la primera sincronización inmediatamente
-    job()
+    subparsers.add_parser('run', help='Inicia el programador (por defecto)')
+    trigger_parser = subparsers.add_parser('trigger', help='Pide una sincronización inmediata de una tienda')
+    trigger_parser.add_argument('store', help='ID de Tiendanube o URL de API de la tienda')
+    subparsers.add_parser('status', help='Muestra el intervalo y la próxima ejecución de cada tienda')
     
-    # Mantener el scheduler corriendo
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(60)  # Esperar 1 minuto antes de la siguiente verificación
-        except KeyboardInterrupt:
-            print("\n👋 Deteniendo scheduler...")
-            sys.exit(0)
-        except Exception as e:
-            print(f"❌ Error en el scheduler: {e}")
-            time.sleep(60)  # Esperar antes de reintentar
+    args = parser.parse_args()
+    if args.command == 'trigger':
+        trigger(args.store)
+    elif args.command == 'status':
+        status()
+    else:
+        run()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    try:
+        main()
+    except Exception as e:
+        logger.exception("❌ Error: %s", e)
+        sys.exit(1)
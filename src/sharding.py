@@ -0,0 +1,406 @@
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from dotenv import load_dotenv
+from src.storage import connect
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+T = TypeVar('T')
+
+def _hash(key: str) -> int:
+    """Posición estable de una clave en el anillo (igual en todos los hosts y reinicios)"""
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    def __init__(self, nodes: Sequence[str], vnodes: Optional[int] = None):
+        """
+        Anillo de hash consistente: cada clave pertenece al primer nodo que le sigue en el anillo
+        
+        Cada nodo ocupa varias posiciones (nodos virtuales) para repartir parejo. Al agregar
+        o quitar un nodo solo cambian de dueño las claves de ese nodo (~1/N del total).
+        
+        Args:
+            nodes (Sequence[str]): Nombres de los nodos
+            vnodes (int, optional): Posiciones por nodo. Si no se proporciona, se usa SHARD_VNODES
+        """
+        if not nodes:
+            raise ValueError("El anillo necesita al menos un nodo")
+        vnodes = vnodes or int(os.getenv('SHARD_VNODES', 100))
+        self._ring = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        self._positions = [position for position, _ in self._ring]
+
+    def node_for(self, key: str) -> str:
+        """Nodo dueño de una clave"""
+        i = bisect.bisect(self._positions, _hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+def shard_name(index: int) -> str:
+    return f'shard-{index}'
+
+def shard_stores(stores: List[Dict], index: int, count: int, vnodes: Optional[int] = None) -> List[Dict]:
+    """
+    Tiendas que le tocan a un shard
+    
+    Args:
+        stores (List[Dict]): Configuración de todas las tiendas
+        index (int): Shard de este worker (de 0 a count - 1)
+        count (int): Cantidad total de shards
+        vnodes (int, optional): Posiciones por shard en el anillo
+    
+    Returns:
+        List[Dict]: Tiendas del shard, en el orden original
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"El shard debe estar entre 0 y {count - 1} (recibido: {index})")
+    if count == 1:
+        return list(stores)
+    ring = HashRing([shard_name(i) for i in range(count)], vnodes)
+    return [store for store in stores if ring.node_for(store['api_url']) == shard_name(index)]
+
+def shard_settings() -> Tuple[int, int]:
+    """Shard de este worker y cantidad de shards (SHARD_INDEX y SHARD_COUNT; sin configurar, (0, 1))"""
+    load_dotenv()
+    return int(os.getenv('SHARD_INDEX', 0)), max(int(os.getenv('SHARD_COUNT', 1)), 1)
+
+def shard_from_env(stores: List[Dict]) -> List[Dict]:
+    """
+    Filtra las tiendas según SHARD_INDEX y SHARD_COUNT (sin SHARD_COUNT, devuelve todas)
+    
+    Args:
+        stores (List[Dict]): Configuración de todas las tiendas
+    
+    Returns:
+        List[Dict]: Tiendas que sincroniza este worker
+    """
+    index, count = shard_settings()
+    if count <= 1:
+        return stores
+    mine = shard_stores(stores, index, count)
+    logger.info("🧩 Shard %s/%s: %s de %s tiendas", index, count, len(mine), len(stores),
+                extra={'shard': index, 'shards': count, 'stores': len(mine)})
+    return mine
+
+def worker_id() -> str:
+    """Identificador de este proceso (host:pid), dueño de los préstamos que toma"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class StoreLeases:
+    def __init__(self, path: Optional[str] = None, lease_seconds: Optional[float] = None,
+                 owner: Optional[str] = None):
+        """
+        Préstamos (leases) por tienda en SQLite, para que dos workers nunca sincronicen
+        la misma tienda a la vez
+        
+        Mientras una tienda está tomada, un hilo renueva el préstamo; si el worker muere,
+        el préstamo vence a los lease_seconds y otro worker puede tomarla.
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite de préstamos. Si no se proporciona,
+                se usa SHARD_LEASE_DB (por defecto shard_leases.db)
+            lease_seconds (float, optional): Duración del préstamo. Si no se proporciona, se usa SHARD_LEASE_SECONDS
+            owner (str, optional): Dueño de los préstamos. Si no se proporciona, host:pid
+        """
+        load_dotenv()
+        self.lease_seconds = lease_seconds or float(os.getenv('SHARD_LEASE_SECONDS', 300))
+        self.owner = owner or worker_id()
+        self._lock = threading.Lock()
+        # Archivo propio y sin WAL: WAL necesita memoria compartida y no se puede cambiar
+        # el modo de journal de la base de estado mientras otros procesos la usan
+        self._conn = connect(path or os.getenv('SHARD_LEASE_DB', 'shard_leases.db'), wal=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS store_leases (
+                    store TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    acquired_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def acquire(self, store: str) -> bool:
+        """
+        Toma el préstamo de una tienda si está libre, vencido o ya es de este worker
+        
+        Args:
+            store (str): URL de API de la tienda
+        
+        Returns:
+            bool: True si el préstamo quedó a nombre de este worker
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # Un solo INSERT ... ON CONFLICT: SQLite lo aplica de forma atómica entre procesos
+            cursor = self._conn.execute("""
+                INSERT INTO store_leases (store, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (store) DO UPDATE SET
+                    owner = excluded.owner,
+                    acquired_at = excluded.acquired_at,
+                    expires_at = excluded.expires_at
+                WHERE store_leases.expires_at <= ? OR store_leases.owner = excluded.owner
+            """, (store, self.owner, now, now + self.lease_seconds, now))
+        return cursor.rowcount == 1
+
+    def renew(self, store: str) -> bool:
+        """Extiende el préstamo; False si ya no es de este worker"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE store_leases SET expires_at = ? WHERE store = ? AND owner = ?',
+                (time.time() + self.lease_seconds, store, self.owner)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, store: str) -> None:
+        """Libera el préstamo (solo si sigue siendo de este worker)"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM store_leases WHERE store = ? AND owner = ?', (store, self.owner))
+
+    def all(self) -> List[Dict]:
+        """Préstamos vigentes, con su dueño y vencimiento"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT store, owner, acquired_at, expires_at FROM store_leases WHERE expires_at > ? ORDER BY store',
+                (time.time(),)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    @contextmanager
+    def hold(self, store: str) -> Iterator[bool]:
+        """
+        Toma el préstamo durante el bloque, renovándolo cada un tercio de su duración
+        
+        Args:
+            store (str): URL de API de la tienda
+        
+        Yields:
+            bool: True si se tomó el préstamo; False si otro worker tiene la tienda
+        """
+        if not self.acquire(store):
+            yield False
+            return
+        
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(store):
+                    logger.warning("⚠️ Se perdió el préstamo de %s", store, extra={'store': store})
+                    return
+        
+        thread = threading.Thread(target=heartbeat, name='lease-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield True
+        finally:
+            stop.set()
+            thread.join()
+            self.release(store)
+
+def leases_from_env() -> Optional[StoreLeases]:
+    """Préstamos compartidos si hay varios shards (SHARD_COUNT > 1) o SHARD_LEASES=true"""
+    load_dotenv()
+    if int(os.getenv('SHARD_COUNT', 1)) > 1 or os.getenv('SHARD_LEASES', 'false').lower() == 'true':
+        return StoreLeases()
+    return None
+
+def run_leased(leases: Optional[StoreLeases], store: str, sync: Callable[[], T]) -> Optional[T]:
+    """
+    Ejecuta la sincronización de una tienda con su préstamo tomado
+    
+    Args:
+        leases (StoreLeases, optional): Préstamos compartidos; sin préstamos se sincroniza directo
+        store (str): URL de API de la tienda
+        sync (Callable): Sincronización de la tienda
+    
+    Returns:
+        Optional[T]: Resultado de sync, o None si otro worker está sincronizando la tienda
+    """
+    if leases is None:
+        return sync()
+    with leases.hold(store) as acquired:
+        if not acquired:
+            logger.info("🔒 %s se está sincronizando en otro worker; se omite", store, extra={'store': store})
+            metrics.ITEMS.inc(1, stage='shard', result='en_curso')
+            return None
+        return sync()
+
+@contextmanager
+def hold_stores(leases: Optional[StoreLeases], stores: List[Dict]) -> Iterator[List[Dict]]:
+    """
+    Toma a la vez los préstamos de varias tiendas, para procesos que las recorren juntas
+    (por ejemplo, la reconciliación)
+    
+    Args:
+        leases (StoreLeases, optional): Préstamos compartidos; sin préstamos se devuelven todas
+        stores (List[Dict]): Configuración de las tiendas
+    
+    Yields:
+        List[Dict]: Tiendas cuyo préstamo se tomó (las que otro worker tiene en curso se omiten)
+    """
+    if leases is None:
+        yield stores
+        return
+    with ExitStack() as held:
+        acquired = []
+        for store in stores:
+            if held.enter_context(leases.hold(store['api_url'])):
+                acquired.append(store)
+            else:
+                logger.info("🔒 %s se está sincronizando en otro worker; se omite", store['api_url'],
+                            extra={'store': store['api_url']})
+                metrics.ITEMS.inc(1, stage='shard', result='en_curso')
+        yield acquired
+
+def _check_worker(path: str, leases_path: str, index: int, count: int, stores: List[str], phase: str) -> None:
+    """Worker de la verificación: 'sincroniza' (espera unos ms) cada tienda que toma y lo registra"""
+    conn = sqlite3.connect(path, timeout=30)
+    leases = StoreLeases(leases_path, lease_seconds=5)
+    owner = shard_name(index)
+    if phase == 'partition':
+        mine = [store['api_url'] for store in shard_stores([{'api_url': store} for store in stores], index, count)]
+    else:
+        # Todos los workers compiten por todas las tiendas, cada uno en otro orden
+        mine = random.Random(index).sample(stores, len(stores))
+    
+    for store in mine:
+        with leases.hold(store) as acquired:
+            if not acquired:
+                continue
+            # Si otro worker tiene la misma tienda en curso, la clave primaria lo detecta
+            try:
+                with conn:
+                    conn.execute('INSERT INTO active (store, owner) VALUES (?, ?)', (store, owner))
+            except sqlite3.IntegrityError:
+                with conn:
+                    conn.execute('INSERT INTO overlaps (phase, store, owner) VALUES (?, ?, ?)', (phase, store, owner))
+                continue
+            time.sleep(random.uniform(0.001, 0.01))
+            with conn:
+                conn.execute('DELETE FROM active WHERE store = ?', (store,))
+                conn.execute('INSERT INTO runs (phase, store, owner) VALUES (?, ?, ?)', (phase, store, owner))
+    conn.close()
+
+def _run_check_phase(path: str, stores: List[str], workers: int, phase: str) -> None:
+    context = multiprocessing.get_context('spawn')
+    leases_path = os.path.join(os.path.dirname(path), 'leases.db')
+    processes = [context.Process(target=_check_worker, args=(path, leases_path, i, workers, stores, phase))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            raise Exception(f"Un worker de la verificación terminó con código {process.exitcode}")
+
+def check(workers: int = 4, store_count: int = 200) -> bool:
+    """
+    Verifica con varios procesos reales que ninguna tienda se pierda ni se sincronice dos veces
+    
+    1. Reparto: cada worker toma su shard; cada tienda debe sincronizarse exactamente una vez.
+    2. Competencia: todos los workers intentan todas las tiendas (como durante un cambio de
+       SHARD_COUNT); ninguna tienda puede estar en curso en dos workers a la vez ni quedar sin sincronizar.
+    3. Rebalanceo: al pasar de N a N + 1 shards solo debería moverse ~1/(N + 1) de las tiendas.
+    
+    Args:
+        workers (int): Procesos (shards)
+        store_count (int): Tiendas ficticias
+    
+    Returns:
+        bool: True si todas las comprobaciones pasan
+    """
+    stores = [f'https://api.tiendanube.com/v1/{1000 + i}' for i in range(store_count)]
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'check.db')
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE active (store TEXT PRIMARY KEY, owner TEXT)')
+        conn.execute('CREATE TABLE runs (phase TEXT, store TEXT, owner TEXT)')
+        conn.execute('CREATE TABLE overlaps (phase TEXT, store TEXT, owner TEXT)')
+        conn.commit()
+        
+        for phase in ('partition', 'contention'):
+            inicio = time.monotonic()
+            _run_check_phase(path, stores, workers, phase)
+            runs = conn.execute(
+                'SELECT store, COUNT(*) AS n FROM runs WHERE phase = ? GROUP BY store', (phase,)
+            ).fetchall()
+            counts = dict(runs)
+            overlaps = conn.execute('SELECT COUNT(*) FROM overlaps WHERE phase = ?', (phase,)).fetchone()[0]
+            dropped = [store for store in stores if store not in counts]
+            duplicated = [store for store, n in counts.items() if n > 1]
+            by_owner = dict(conn.execute(
+                'SELECT owner, COUNT(*) FROM runs WHERE phase = ? GROUP BY owner ORDER BY owner', (phase,)
+            ).fetchall())
+            print(f"{'Reparto' if phase == 'partition' else 'Competencia'} ({time.monotonic() - inicio:.1f}s): "
+                  f"{sum(counts.values())} sincronizaciones de {len(stores)} tiendas, "
+                  f"perdidas={len(dropped)}, repetidas={len(duplicated)}, simultáneas={overlaps}")
+            print(f"   por worker: {by_owner}")
+            # En la competencia una tienda puede repetirse (una después de otra), nunca a la vez
+            if dropped or overlaps or (phase == 'partition' and duplicated):
+                ok = False
+        conn.close()
+    
+    before = {store: HashRing([shard_name(i) for i in range(workers)]).node_for(store) for store in stores}
+    after_ring = HashRing([shard_name(i) for i in range(workers + 1)])
+    moved = sum(before[store] != after_ring.node_for(store) for store in stores)
+    print(f"Rebalanceo {workers} -> {workers + 1} shards: se mueven {moved} de {len(stores)} tiendas "
+          f"(ideal ~{len(stores) / (workers + 1):.0f})")
+    
+    print("✅ Ninguna tienda se perdió ni se sincronizó dos veces a la vez" if ok else "❌ La verificación falló")
+    return ok
+
+def assign(count: int) -> None:
+    """Muestra el shard de cada tienda configurada"""
+    from src.store_config import StoreConfig
+    stores = StoreConfig().get_all_stores()
+    for index in range(count):
+        for store in shard_stores(stores, index, count):
+            print(f"{index:>5}  {store['api_url']}")
+
+def status() -> None:
+    """Muestra los préstamos vigentes (qué worker sincroniza cada tienda ahora)"""
+    rows = StoreLeases().all()
+    if not rows:
+        print("No hay tiendas en curso")
+        return
+    now = time.time()
+    for row in rows:
+        print(f"{row['store']:<45} {row['owner']:<30} hace {now - row['acquired_at']:>6.0f}s, "
+              f"vence en {row['expires_at'] - now:>5.0f}s")
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Reparto de tiendas entre workers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    assign_parser = subparsers.add_parser('assign', help='Muestra el shard de cada tienda configurada')
+    assign_parser.add_argument('--count', type=int, default=int(os.getenv('SHARD_COUNT', 1)),
+                               help='Cantidad de shards (por defecto SHARD_COUNT)')
+    subparsers.add_parser('status', help='Muestra qué worker sincroniza cada tienda ahora')
+    check_parser = subparsers.add_parser('check', help='Verifica el reparto y los préstamos con varios procesos')
+    check_parser.add_argument('--workers', type=int, default=4, help='Procesos (por defecto 4)')
+    check_parser.add_argument('--stores', type=int, default=200, help='Tiendas ficticias (por defecto 200)')
+    
+    args = parser.parse_args()
+    if args.command == 'assign':
+        assign(args.count)
+    elif args.command == 'status':
+        status()
+    else:
+        sys.exit(0 if check(args.workers, args.stores) else 1)
+
+if __name__ == "__main__":
+    main()
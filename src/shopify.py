@@ -1,11 +1,36 @@
+import json
 import os
+import threading
+import time
 import requests
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from src.http_client import ApiClient, shopify_rate_limit
+from src.sku_cache import SkuCache
+from src.log import get_logger, SAMPLED
+from src.models import Product
+
+# Motivos de fallo por SKU que informa sync_products_from_tiendanube
+FAILURE_SKU_NOT_FOUND = 'sku_no_encontrado'
+FAILURE_NO_INVENTORY_ITEM = 'sin_inventory_item'
+FAILURE_WRITE = 'escritura'
+FAILURE_ERROR = 'error'
+
+# Fallos que no se resuelven reintentando: el producto no existe (o no se controla) en Shopify
+PERMANENT_FAILURES = {FAILURE_SKU_NOT_FOUND, FAILURE_NO_INVENTORY_ITEM}
+
+logger = get_logger(__name__)
 
 class ShopifyAPI:
-    def __init__(self):
-        """Inicializa la API de Shopify con las credenciales del .env"""
+    def __init__(self, sku_cache: Optional[SkuCache] = None):
+        """
+        Inicializa la API de Shopify con las credenciales del .env
+        
+        Args:
+            sku_cache (SkuCache, optional): Caché persistente de SKUs. Si no se proporciona,
+                se crea una salvo que SKU_CACHE_ENABLED sea 'false'
+        """
         load_dotenv()
         
         self.api_url = os.getenv('SHOPIFY_STORE_URL')
@@ -16,68 +41,319 @@ class ShopifyAPI:
         if not self.access_token:
             raise ValueError("SHOPIFY_ACCESS_TOKEN no está configurado en .env")
             
+        # Versión de la API GraphQL (inventorySetQuantities no existe en 2023-01)
+        self.graphql_version = os.getenv('SHOPIFY_GRAPHQL_API_VERSION', '2024-01')
+            
         self.headers = {
             'X-Shopify-Access-Token': self.access_token,
             'Content-Type': 'application/json'
         }
         
-        print("✅ API de Shopify inicializada")
-        print(f"🔹 URL: {self.api_url}")
+        # Índice SKU -> variante de Shopify (se construye una vez por ejecución)
+        self.sku_index: Dict[str, Dict] = {}
+        self.sku_index_updated_at: Optional[datetime] = None
+        self.sku_index_complete = False
+        self.sku_index_max_age = int(os.getenv('SKU_INDEX_MAX_AGE', 600))
+        
+        # Los recorridos completos del catálogo usan una exportación Bulk Operations (una consulta
+        # y un archivo JSONL) en lugar de paginar products.json, salvo SHOPIFY_BULK_INDEX=false
+        self.bulk_index = os.getenv('SHOPIFY_BULK_INDEX', 'true').lower() != 'false'
+        self.bulk_poll_seconds = float(os.getenv('SHOPIFY_BULK_POLL_SECONDS', 2))
+        self.bulk_timeout = float(os.getenv('SHOPIFY_BULK_TIMEOUT', 900))
+        
+        if sku_cache is None and os.getenv('SKU_CACHE_ENABLED', 'true').lower() != 'false':
+            sku_cache = SkuCache()
+        self.sku_cache = sku_cache
+        
+        # Ubicaciones: se cargan una vez y se reutilizan durante SHOPIFY_LOCATIONS_TTL segundos
+        self.default_location = os.getenv('SHOPIFY_LOCATION', 'Shop location')
+        self.locations_ttl = int(os.getenv('SHOPIFY_LOCATIONS_TTL', 3600))
+        self._locations: Optional[list] = None
+        self._locations_loaded_at = 0.0
+        
+        # La instancia se comparte entre las tiendas que se sincronizan en paralelo:
+        # el cliente sigue el balde REST de Shopify (X-Shopify-Shop-Api-Call-Limit),
+        # limita las peticiones simultáneas y reintenta 429/5xx
+        self.client = ApiClient(
+            'Shopify',
+            capacity=float(os.getenv('SHOPIFY_BUCKET_SIZE', 40)),
+            refill_rate=float(os.getenv('SHOPIFY_MAX_REQUESTS_PER_SECOND', 2)),
+            max_concurrency=int(os.getenv('SHOPIFY_MAX_CONCURRENCY', 4)),
+            rate_limit_parser=shopify_rate_limit
+        )
+        self._index_lock = threading.RLock()
+        self._locations_lock = threading.Lock()
+        
+        logger.debug("✅ API de Shopify inicializada: %s", self.api_url)
 
-    def _make_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+    def _make_request(self, method: str, endpoint: str, tokens: float = 1, **kwargs) -> requests.Response:
         """
         Realiza una petición a la API de Shopify
         
         Args:
             method (str): Método HTTP
             endpoint (str): Endpoint de la API
+            tokens (float): Tokens del balde REST que consume (las peticiones GraphQL no consumen)
             **kwargs: Argumentos adicionales para la petición
             
         Returns:
             requests.Response: Respuesta de la API
         """
-        url = f"{self.api_url}/admin/api/2023-01/{endpoint}"
-        response = requests.request(method, url, headers=self.headers, **kwargs)
+        response = self.client.request(method, self._url(endpoint), tokens=tokens, headers=self.headers, **kwargs)
         
         if response.status_code not in [200, 201]:
-            print(f"❌ Error en petición a Shopify: {response.status_code}")
-            print(f"   Respuesta: {response.text}")
+            logger.error("❌ Error en petición a Shopify: %s", response.status_code,
+                         extra={'status': response.status_code, 'response': response.text[:500]})
             raise Exception(f"Error en petición a Shopify: {response.status_code}")
             
         return response
 
-    def get_locations(self) -> list:
+    def _url(self, endpoint: str) -> str:
+        """URL de un endpoint REST; las URLs de paginación (header Link) ya vienen completas"""
+        if endpoint.startswith('http'):
+            return endpoint
+        return f"{self.api_url}/admin/api/2023-01/{endpoint}"
+
+    def get_locations(self, force: bool = False) -> list:
         """
-        Obtiene las ubicaciones de Shopify
+        Obtiene las ubicaciones de Shopify, usando la copia en memoria mientras siga vigente
         
+        Args:
+            force (bool): Si es True, ignora la copia en memoria y consulta la API
+            
         Returns:
             list: Lista de ubicaciones
         """
-        response = self._make_request('GET', 'locations.json')
-        return response.json()['locations']
+        with self._locations_lock:
+            expired = time.monotonic() - self._locations_loaded_at > self.locations_ttl
+            if force or self._locations is None or expired:
+                response = self._make_request('GET', 'locations.json')
+                self._locations = response.json()['locations']
+                self._locations_loaded_at = time.monotonic()
+            return self._locations
+
+    def resolve_location(self, target: Optional[str] = None) -> Dict:
+        """
+        Busca una ubicación de Shopify por nombre o por ID
+        
+        Args:
+            target (str, optional): Nombre o ID de la ubicación. Si no se proporciona,
+                se usa SHOPIFY_LOCATION (por defecto 'Shop location')
+            
+        Returns:
+            Dict: Ubicación encontrada
+        """
+        target = str(target or self.default_location)
+        for force in (False, True):
+            location = _match_location(self.get_locations(force=force), target)
+            if location:
+                return location
+        raise Exception(f"No se encontró la ubicación '{target}'")
+
+    def _iter_pages(self, endpoint: str, key: str, params: Dict) -> Iterator[Dict]:
+        """
+        Recorre todas las páginas de un endpoint REST siguiendo el header Link
+        
+        Args:
+            endpoint (str): Endpoint de la API
+            key (str): Clave de la respuesta que contiene la lista de elementos
+            params (Dict): Parámetros de la primera página
+            
+        Yields:
+            Dict: Cada elemento de cada página
+        """
+        response = self._make_request('GET', endpoint, params=params)
+        while True:
+            for item in response.json().get(key, []):
+                yield item
+            
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                break
+            response = self._make_request('GET', next_url)
+
+    def iter_inventory_levels(self, location_id) -> Iterator[Tuple[int, Optional[int]]]:
+        """
+        Recorre todos los niveles de inventario de una ubicación
+        
+        Args:
+            location_id: ID de la ubicación
+            
+        Yields:
+            Tuple[int, Optional[int]]: (inventory_item_id, cantidad disponible)
+        """
+        params = {'location_ids': str(location_id), 'limit': 250}
+        for level in self._iter_pages('inventory_levels.json', 'inventory_levels', params):
+            yield level['inventory_item_id'], level.get('available')
+
+    def get_inventory_levels(self, inventory_item_ids: List, location_id) -> Dict[str, Optional[int]]:
+        """
+        Consulta el stock actual de varios items en una ubicación
+        
+        Args:
+            inventory_item_ids (List): IDs de items de inventario (Shopify acepta hasta 50 por petición)
+            location_id: ID de la ubicación
+            
+        Returns:
+            Dict[str, Optional[int]]: inventory_item_id -> cantidad disponible (None si no se controla);
+                los items sin nivel en la ubicación no aparecen
+        """
+        params = {
+            'inventory_item_ids': ','.join(str(item_id) for item_id in inventory_item_ids),
+            'location_ids': str(location_id),
+            'limit': 250
+        }
+        return {
+            str(level['inventory_item_id']): level.get('available')
+            for level in self._iter_pages('inventory_levels.json', 'inventory_levels', params)
+        }
+
+    def build_sku_index(self, updated_at_min: Optional[datetime] = None) -> int:
+        """
+        Construye el índice SKU -> variante recorriendo todo el catálogo de Shopify
+        
+        Args:
+            updated_at_min (datetime, optional): Si se indica, solo se recorren los
+                productos modificados desde esa fecha y se actualiza el índice existente
+            
+        Returns:
+            int: Número de variantes indexadas en esta pasada
+        """
+        # Margen para no perder productos modificados mientras se recorre el catálogo
+        started_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        
+        if self.bulk_index and not updated_at_min:
+            try:
+                touched = {}
+                for record in self.iter_bulk_query(BULK_VARIANTS_QUERY):
+                    _index_bulk_variant(record, touched)
+                return self._store_index(touched, updated_at_min, started_at)
+            except Exception as e:
+                logger.warning("⚠️ No se pudo exportar el catálogo con Bulk Operations (%s); se recorre por páginas", e)
+        
+        touched = {}
+        for product in self._iter_pages('products.json', 'products', _index_params(updated_at_min)):
+            _index_variants(product, touched)
+        return self._store_index(touched, updated_at_min, started_at)
+
+    def run_bulk_query(self, query: str) -> Optional[str]:
+        """
+        Lanza una exportación Bulk Operations y espera a que termine
+        
+        Args:
+            query (str): Consulta GraphQL a exportar
+            
+        Returns:
+            Optional[str]: URL del archivo JSONL con el resultado, o None si no hubo resultados
+        """
+        operation_id = _bulk_operation_id(self.graphql(BULK_OPERATION_RUN_QUERY, {'query': query}))
+        logger.info("📦 Exportación Bulk Operations iniciada: %s", operation_id)
+        deadline = time.monotonic() + self.bulk_timeout
+        while True:
+            operation = self.graphql(BULK_OPERATION_STATUS, {'id': operation_id})['node']
+            if _bulk_operation_done(operation):
+                return operation.get('url')
+            if time.monotonic() > deadline:
+                self.graphql(BULK_OPERATION_CANCEL, {'id': operation_id})
+                raise Exception(f"La exportación {operation_id} no terminó en {self.bulk_timeout:g}s")
+            time.sleep(self.bulk_poll_seconds)
+
+    def iter_bulk_query(self, query: str) -> Iterator[Dict]:
+        """
+        Ejecuta una exportación Bulk Operations y recorre el resultado línea por línea
+        
+        El archivo se descarga en streaming: la memoria no depende del tamaño del catálogo.
+        
+        Args:
+            query (str): Consulta GraphQL a exportar
+            
+        Yields:
+            Dict: Cada objeto del archivo JSONL
+        """
+        url = self.run_bulk_query(query)
+        if not url:
+            return
+        # La URL ya viene firmada: no lleva el token de Shopify ni consume el balde REST
+        response = self.client.request('GET', url, tokens=0, stream=True)
+        try:
+            if response.status_code != 200:
+                raise Exception(f"Error al descargar la exportación Bulk Operations: {response.status_code}")
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def _store_index(self, touched: Dict[str, Dict], updated_at_min: Optional[datetime], started_at: datetime) -> int:
+        """Incorpora al índice (y a la caché) las variantes de un recorrido del catálogo"""
+        index = self.sku_index if updated_at_min else {}
+        index.update(touched)
+        indexed = len(touched)
+        
+        self.sku_index = index
+        self.sku_index_updated_at = started_at
+        if not updated_at_min:
+            self.sku_index_complete = True
+        
+        if self.sku_cache:
+            self.sku_cache.set_many(touched)
+            self.sku_cache.set_index_built_at(started_at)
+        
+        modo = "incremental" if updated_at_min else "completo"
+        logger.info("🗂️ Índice de SKUs de Shopify (%s): %s variantes indexadas, %s en total", modo, indexed, len(index),
+                    extra={'mode': modo, 'indexed': indexed, 'total': len(index)})
+        return indexed
+
+    def refresh_sku_index(self) -> int:
+        """
+        Refresca el índice de SKUs: completo la primera vez, incremental las siguientes
+        
+        Returns:
+            int: Número de variantes indexadas en esta pasada
+        """
+        if self.sku_index_updated_at is None:
+            return self.build_sku_index()
+        return self.build_sku_index(updated_at_min=self.sku_index_updated_at)
+
+    def _sku_index_age(self) -> float:
+        """Segundos desde el último recorrido del catálogo de Shopify"""
+        if self.sku_index_updated_at is None:
+            return float('inf')
+        return (datetime.now(timezone.utc) - self.sku_index_updated_at).total_seconds()
 
     def find_variant_by_sku(self, sku: str) -> Optional[Dict]:
         """
-        Busca una variante por SKU y retorna el producto y la variante
+        Busca una variante por SKU: primero en la caché persistente y luego en el índice de Shopify
         
         Args:
             sku (str): SKU a buscar (ID de variante o producto en Tiendanube)
             
         Returns:
-            Optional[Dict]: Tupla (producto, variante) o None si no se encuentra
+            Optional[Dict]: Diccionario {'product', 'variant'} o None si no se encuentra
         """
-        response = self._make_request(
-            'GET',
-            'products.json',
-            params={'limit': 250}
-        )
+        entry = self.sku_cache.get(sku) if self.sku_cache else None
         
-        products = response.json()['products']
-        for product in products:
-            for variant in product.get('variants', []):
-                if variant.get('sku') == sku:
-                    return {'product': product, 'variant': variant}
-        return None
+        if not entry:
+            # Solo un hilo recorre el catálogo; el resto espera y usa el índice ya construido
+            with self._index_lock:
+                if self.sku_index_updated_at is None:
+                    # Arranque en frío: si la caché tiene un recorrido vigente, alcanza con
+                    # traer lo modificado desde entonces
+                    since = self.sku_cache.get_index_built_at() if self.sku_cache else None
+                    self.build_sku_index(updated_at_min=since)
+                entry = self.sku_index.get(sku)
+                
+                if not entry and not self.sku_index_complete:
+                    # El SKU puede haber vencido en la caché: recorrer el catálogo completo una vez
+                    self.build_sku_index()
+                    entry = self.sku_index.get(sku)
+                
+                if not entry and self._sku_index_age() > self.sku_index_max_age:
+                    # En procesos de larga duración (webhooks) el SKU puede ser de un producto nuevo
+                    self.refresh_sku_index()
+                    entry = self.sku_index.get(sku)
+        
+        return _variant_result(sku, entry)
 
     def update_variant_stock(self, inventory_item_id: str, location_id: str, new_quantity: int) -> bool:
         """
@@ -103,99 +379,351 @@ class ShopifyAPI:
             )
             return True
         except Exception as e:
-            print(f"❌ Error al actualizar stock: {e}")
+            logger.error("❌ Error al actualizar stock de %s: %s", inventory_item_id, e)
             return False
 
-    def sync_products_from_tiendanube(self, product: Dict) -> bool:
+    def graphql(self, query: str, variables: Optional[Dict] = None) -> Dict:
+        """
+        Ejecuta una consulta o mutación en la API GraphQL de Shopify
+        
+        Args:
+            query (str): Documento GraphQL
+            variables (Dict, optional): Variables de la consulta
+            
+        Returns:
+            Dict: Contenido de 'data' de la respuesta
+        """
+        url = f"{self.api_url}/admin/api/{self.graphql_version}/graphql.json"
+        
+        for attempt in range(self.client.max_retries + 1):
+            # GraphQL tiene su propio balde por costo de consulta: no consume tokens REST
+            response = self._make_request('POST', url, tokens=0, json={'query': query, 'variables': variables or {}})
+            body = response.json()
+            
+            delay = _throttle_delay(body)
+            if delay is None or attempt == self.client.max_retries:
+                break
+            logger.warning("⚠️ GraphQL de Shopify limitado, reintentando en %.1fs", delay, extra={'delay': delay})
+            time.sleep(delay)
+        
+        if body.get('errors'):
+            raise Exception(f"Error en GraphQL de Shopify: {body['errors']}")
+        return body['data']
+
+    def set_inventory_quantities(self, items: List[Tuple[str, str, int]]) -> List[bool]:
+        """
+        Actualiza el stock de varios items en una sola mutación inventorySetQuantities
+        
+        Args:
+            items (List[Tuple[str, str, int]]): Tuplas (inventory_item_id, location_id, cantidad)
+            
+        Returns:
+            List[bool]: Resultado de cada item, en el mismo orden
+        """
+        if not items:
+            return []
+        
+        try:
+            data = self.graphql(INVENTORY_SET_QUANTITIES, _set_quantities_variables(items))
+        except Exception as e:
+            logger.error("❌ Error al actualizar stock en lote: %s", e, extra={'items': len(items)})
+            return [False] * len(items)
+        
+        failed = _failed_items(data['inventorySetQuantities']['userErrors'], items)
+        if failed is None:
+            return [False] * len(items)
+        if not failed:
+            return [True] * len(items)
+        
+        # La mutación es atómica: reenviar los items válidos sin los que fallaron
+        valid = [i for i in range(len(items)) if i not in failed]
+        return _merge_results(len(items), valid, self.set_inventory_quantities([items[i] for i in valid]))
+
+    def sync_products_from_tiendanube(self, product: Product, writer=None, location: Optional[str] = None,
+                                      failures: Optional[list] = None) -> bool:
         """
         Sincroniza el stock de un producto de Tiendanube a Shopify
         
+        Los productos y variantes sin stock también se envían (con cantidad 0),
+        para que Shopify refleje cuando algo se agota.
+        
         Args:
-            product (Dict): Producto de Tiendanube
+            product (Product): Producto de Tiendanube
+            writer (InventoryWriter, optional): Si se indica, las escrituras se encolan en el
+                writer para enviarse en lote en lugar de hacer una petición por variante
+            location (str, optional): Nombre o ID de la ubicación de Shopify destino
+            failures (list, optional): Si se indica, se agregan pares (SKU, motivo) por cada fallo
             
         Returns:
-            bool: True si se actualizó correctamente
+            bool: True si se actualizó (o encoló) correctamente
         """
         try:
-            # Obtener ubicación principal
-            locations = self.get_locations()
-            shop_location = next((loc for loc in locations if loc['name'] == 'Shop location'), None)
-            if not shop_location:
-                raise Exception("No se encontró la ubicación 'Shop location'")
-            
-            # Verificar si el producto tiene variantes
-            variants = product.get('variants', [])
-            if not variants:
-                # Producto sin variantes - usar ID de producto como SKU
-                sku = str(product['id'])
-                stock = product.get('stock', 0)
-                if stock is None:  # Stock infinito
-                    stock = 999
-                    print(f"🔄 Convirtiendo stock infinito a 999 para producto {sku}")
-                    
-                # Buscar producto en Shopify por SKU
-                print(f"🔍 Buscando producto en Shopify con SKU: {sku}")
-                result = self.find_variant_by_sku(sku)
-                if not result:
-                    print(f"❌ No se encontró el producto con SKU (ID Tiendanube): {sku}")
-                    return False
-                
-                # Obtener inventory_item_id
-                inventory_item_id = result['variant'].get('inventory_item_id')
-                if not inventory_item_id:
-                    print(f"❌ No se encontró inventory_item_id para SKU: {sku}")
-                    return False
-                
-                # Actualizar stock
-                print(f"🔄 Actualizando stock para producto {sku} a {stock}")
-                success = self.update_variant_stock(
-                    inventory_item_id,
-                    shop_location['id'],
-                    stock
-                )
-                
-                if success:
-                    print(f"✅ Stock actualizado para producto {sku}: {stock}")
-                return success
+            # Obtener ubicación destino (en memoria tras la primera consulta)
+            shop_location = self.resolve_location(location)
+            
+            # Producto sin variantes: el SKU es el ID de producto; con variantes, el ID de cada variante
+            tipo = 'variante' if product.has_variants else 'producto'
             
-            # Producto con variantes - procesar cada variante
             success = True
-            for variant in variants:
-                # Usar ID de variante como SKU
-                sku = str(variant['id'])
-                stock = variant.get('stock', 0)
-                if stock is None:  # Stock infinito
-                    stock = 999
-                    print(f"🔄 Convirtiendo stock infinito a 999 para variante {sku}")
-                
+            for sku, stock in product.stock_items():
                 # Buscar variante en Shopify por SKU
-                print(f"🔍 Buscando variante en Shopify con SKU: {sku}")
                 result = self.find_variant_by_sku(sku)
                 if not result:
-                    print(f"❌ No se encontró la variante con SKU (ID Tiendanube): {sku}")
+                    logger.debug("❌ No se encontró %s con SKU (ID Tiendanube): %s", tipo, sku, extra=SAMPLED)
+                    _report(failures, sku, FAILURE_SKU_NOT_FOUND)
                     success = False
                     continue
                 
                 # Obtener inventory_item_id
                 inventory_item_id = result['variant'].get('inventory_item_id')
                 if not inventory_item_id:
-                    print(f"❌ No se encontró inventory_item_id para SKU: {sku}")
+                    logger.debug("❌ No se encontró inventory_item_id para SKU: %s", sku, extra=SAMPLED)
+                    _report(failures, sku, FAILURE_NO_INVENTORY_ITEM)
                     success = False
                     continue
                 
+                if writer is not None:
+                    writer.add(inventory_item_id, shop_location['id'], stock, sku=sku, ref=product.id)
+                    continue
+                
                 # Actualizar stock
-                print(f"🔄 Actualizando stock para variante {sku} a {stock}")
                 if self.update_variant_stock(
                     inventory_item_id,
                     shop_location['id'],
                     stock
                 ):
-                    print(f"✅ Stock actualizado para variante {sku}: {stock}")
+                    logger.debug("✅ Stock actualizado para %s %s: %s", tipo, sku, stock, extra=SAMPLED)
                 else:
+                    if self.sku_cache:
+                        self.sku_cache.invalidate(sku)
+                    _report(failures, sku, FAILURE_WRITE)
                     success = False
             
             return success
             
         except Exception as e:
-            print(f"❌ Error sincronizando producto {product.get('id')}: {e}")
-            return False 
\ No newline at end of file
+            logger.error("❌ Error sincronizando producto %s: %s", product.id, e)
+            _report(failures, str(product.id), FAILURE_ERROR)
+            return False
+
+def _match_location(locations: list, target: str) -> Optional[Dict]:
+    """Busca una ubicación por ID o por nombre"""
+    for location in locations:
+        if str(location['id']) == target or location['name'] == target:
+            return location
+    return None
+
+def _index_params(updated_at_min: Optional[datetime]) -> Dict:
+    """Parámetros de products.json para recorrer el catálogo (solo lo modificado si se indica fecha)"""
+    params = {'limit': 250, 'fields': 'id,variants'}
+    if updated_at_min:
+        params['updated_at_min'] = updated_at_min.isoformat()
+    return params
+
+def _gid_id(gid: str) -> int:
+    """ID numérico de un ID global de GraphQL (gid://shopify/ProductVariant/123 -> 123)"""
+    return int(gid.rsplit('/', 1)[-1])
+
+def _index_bulk_variant(record: Dict, touched: Dict[str, Dict]) -> None:
+    """Agrega al índice una variante de la exportación Bulk Operations (BULK_VARIANTS_QUERY)"""
+    sku = record.get('sku')
+    if not sku:
+        return
+    inventory_item = record.get('inventoryItem') or {}
+    touched[sku] = {
+        'product_id': _gid_id(record['product']['id']),
+        'variant_id': _gid_id(record['id']),
+        'inventory_item_id': _gid_id(inventory_item['id']) if inventory_item.get('id') else None
+    }
+
+def _bulk_operation_id(data: Dict) -> str:
+    """ID de la operación lanzada por bulkOperationRunQuery (error si Shopify la rechazó)"""
+    result = data['bulkOperationRunQuery']
+    if result.get('userErrors'):
+        # Por ejemplo, si ya hay otra exportación en curso para la app
+        raise Exception('; '.join(error.get('message', '') for error in result['userErrors']))
+    return result['bulkOperation']['id']
+
+def _bulk_operation_done(operation: Dict) -> bool:
+    """
+    True si la exportación terminó bien, False si sigue en curso
+    
+    Raises:
+        Exception: Si la exportación falló, se canceló o venció
+    """
+    status = operation['status']
+    if status == 'COMPLETED':
+        logger.info("📦 Exportación Bulk Operations completada: %s objetos", operation.get('objectCount'),
+                    extra={'objects': operation.get('objectCount')})
+        return True
+    if status in ('CREATED', 'RUNNING'):
+        return False
+    raise Exception(f"La exportación Bulk Operations terminó con estado {status} ({operation.get('errorCode')})")
+
+def _index_variants(product: Dict, touched: Dict[str, Dict]) -> None:
+    """Agrega al índice las variantes con SKU de un producto de Shopify"""
+    for variant in product.get('variants', []):
+        sku = variant.get('sku')
+        if not sku:
+            continue
+        touched[sku] = {
+            'product_id': product['id'],
+            'variant_id': variant['id'],
+            'inventory_item_id': variant.get('inventory_item_id')
+        }
+
+def _variant_result(sku: str, entry: Optional[Dict]) -> Optional[Dict]:
+    """Arma el resultado de find_variant_by_sku a partir de una entrada del índice"""
+    if not entry:
+        return None
+    return {
+        'product': {'id': entry['product_id']},
+        'variant': {
+            'id': entry['variant_id'],
+            'sku': sku,
+            'inventory_item_id': entry['inventory_item_id']
+        }
+    }
+
+def _throttle_delay(body: Dict) -> Optional[float]:
+    """
+    Segundos a esperar si Shopify limitó la consulta GraphQL (error THROTTLED)
+    
+    Returns:
+        Optional[float]: Espera justa para recuperar el costo pedido, o None si no hubo límite
+    """
+    throttled = any(
+        isinstance(error, dict) and error.get('extensions', {}).get('code') == 'THROTTLED'
+        for error in body.get('errors') or []
+    )
+    if not throttled:
+        return None
+    cost = body.get('extensions', {}).get('cost', {})
+    status = cost.get('throttleStatus', {})
+    missing = cost.get('requestedQueryCost', 0) - status.get('currentlyAvailable', 0)
+    return max(missing, 1) / max(status.get('restoreRate', 50), 1)
+
+def _set_quantities_variables(items: List[Tuple[str, str, int]]) -> Dict:
+    """Variables de inventorySetQuantities para tuplas (inventory_item_id, location_id, cantidad)"""
+    return {
+        'input': {
+            'name': 'available',
+            'reason': 'correction',
+            'ignoreCompareQuantity': True,
+            'quantities': [
+                {
+                    'inventoryItemId': f"gid://shopify/InventoryItem/{inventory_item_id}",
+                    'locationId': f"gid://shopify/Location/{location_id}",
+                    'quantity': quantity
+                }
+                for inventory_item_id, location_id, quantity in items
+            ]
+        }
+    }
+
+def _failed_items(user_errors: List[Dict], items: List[Tuple[str, str, int]]) -> Optional[set]:
+    """
+    Índices de los items rechazados por inventorySetQuantities
+    
+    Returns:
+        Optional[set]: Índices fallidos, o None si hubo un error que afecta a todo el lote
+    """
+    # Los errores por item vienen con el índice en 'field': ["input", "quantities", "3", ...]
+    failed = set()
+    for error in user_errors:
+        field = error.get('field') or []
+        if len(field) >= 3 and field[1] == 'quantities' and str(field[2]).isdigit():
+            failed.add(int(field[2]))
+            logger.warning("❌ Error al actualizar stock de %s: %s", items[int(field[2])][0], error.get('message'))
+        else:
+            logger.error("❌ Error al actualizar stock en lote: %s", error.get('message'))
+            return None
+    return failed
+
+def _merge_results(total: int, valid: List[int], retried: List[bool]) -> List[bool]:
+    """Resultados finales: False para los rechazados, el del reenvío para los válidos"""
+    results = [False] * total
+    for i, ok in zip(valid, retried):
+        results[i] = ok
+    return results
+
+def _report(failures: Optional[list], sku: str, reason: str) -> None:
+    """Agrega un fallo a la lista del llamador, si la hay"""
+    if failures is not None:
+        failures.append((sku, reason))
+
+INVENTORY_SET_QUANTITIES = """
+mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
+  inventorySetQuantities(input: $input) {
+    userErrors {
+      field
+      message
+      code
+    }
+  }
+}
+"""
+
+# Exportación de todas las variantes para el índice de SKUs (una línea JSON por variante)
+BULK_VARIANTS_QUERY = """
+{
+  productVariants {
+    edges {
+      node {
+        id
+        sku
+        product {
+          id
+        }
+        inventoryItem {
+          id
+        }
+      }
+    }
+  }
+}
+"""
+
+BULK_OPERATION_RUN_QUERY = """
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
+
+BULK_OPERATION_STATUS = """
+query bulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation {
+      id
+      status
+      errorCode
+      objectCount
+      url
+    }
+  }
+}
+"""
+
+BULK_OPERATION_CANCEL = """
+mutation bulkOperationCancel($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    bulkOperation {
+      id
+      status
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+"""
@@ -0,0 +1,164 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from src.storage import connect
+
+class SkuCache:
+    def __init__(self, path: Optional[str] = None, ttl: Optional[int] = None):
+        """
+        Inicializa la caché persistente de mapeos SKU Tiendanube -> Shopify
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+            ttl (int, optional): Segundos de validez de cada mapeo. Si no se proporciona, se usa SKU_CACHE_TTL
+        """
+        load_dotenv()
+        self.ttl = ttl if ttl is not None else int(os.getenv('SKU_CACHE_TTL', 7 * 24 * 3600))
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sku_mappings (
+                    sku TEXT PRIMARY KEY,
+                    product_id INTEGER,
+                    variant_id INTEGER,
+                    inventory_item_id INTEGER,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sku_cache_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+    def get(self, sku: str) -> Optional[Dict]:
+        """
+        Obtiene el mapeo de un SKU si existe y no expiró
+        
+        Args:
+            sku (str): SKU (ID de variante o producto en Tiendanube)
+            
+        Returns:
+            Optional[Dict]: Mapeo {'product_id', 'variant_id', 'inventory_item_id'} o None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT product_id, variant_id, inventory_item_id FROM sku_mappings '
+                'WHERE sku = ? AND updated_at >= ?',
+                (sku, time.time() - self.ttl)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def set_many(self, mappings: Dict[str, Dict]) -> None:
+        """
+        Guarda (o reemplaza) varios mapeos en una sola transacción
+        
+        Args:
+            mappings (Dict[str, Dict]): SKU -> {'product_id', 'variant_id', 'inventory_item_id'}
+        """
+        now = time.time()
+        rows = [
+            (sku, m['product_id'], m['variant_id'], m['inventory_item_id'], now)
+            for sku, m in mappings.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO sku_mappings '
+                '(sku, product_id, variant_id, inventory_item_id, updated_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def invalidate(self, sku: str) -> None:
+        """Elimina el mapeo de un SKU (por ejemplo, si Shopify rechazó la escritura)"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM sku_mappings WHERE sku = ?', (sku,))
+
+    def purge_expired(self) -> int:
+        """
+        Elimina los mapeos vencidos según el TTL
+        
+        Returns:
+            int: Número de mapeos eliminados
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM sku_mappings WHERE updated_at < ?',
+                (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        """Vacía la caché por completo"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM sku_mappings')
+            self._conn.execute('DELETE FROM sku_cache_meta')
+
+    def count(self) -> int:
+        """Retorna la cantidad de mapeos vigentes"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) FROM sku_mappings WHERE updated_at >= ?',
+                (time.time() - self.ttl,)
+            ).fetchone()
+        return row[0]
+
+    def get_index_built_at(self) -> Optional[datetime]:
+        """
+        Retorna el momento del último recorrido del catálogo de Shopify, si sigue vigente
+        
+        Returns:
+            Optional[datetime]: Fecha UTC del último recorrido o None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sku_cache_meta WHERE key = 'index_built_at'"
+            ).fetchone()
+        if not row:
+            return None
+        
+        built_at = datetime.fromisoformat(row['value'])
+        if (datetime.now(timezone.utc) - built_at).total_seconds() > self.ttl:
+            return None
+        return built_at
+
+    def set_index_built_at(self, built_at: datetime) -> None:
+        """Registra el momento del último recorrido del catálogo de Shopify"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sku_cache_meta (key, value) VALUES ('index_built_at', ?)",
+                (built_at.isoformat(),)
+            )
+
+def main():
+    """Comandos de mantenimiento de la caché: rebuild, purge, clear, stats"""
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = SkuCache()
+    
+    if command == 'rebuild':
+        from src.shopify import ShopifyAPI
+        
+        print("🔄 Reconstruyendo caché de SKUs desde Shopify...")
+        cache.clear()
+        shopify = ShopifyAPI(sku_cache=cache)
+        shopify.build_sku_index()
+        print(f"✅ Caché reconstruida: {cache.count()} SKUs")
+    elif command == 'purge':
+        print(f"🧹 Mapeos vencidos eliminados: {cache.purge_expired()}")
+    elif command == 'clear':
+        cache.clear()
+        print("🧹 Caché de SKUs vaciada")
+    elif command == 'stats':
+        print(f"📊 SKUs en caché: {cache.count()}")
+        print(f"🔹 Último recorrido de Shopify: {cache.get_index_built_at() or 'nunca'}")
+    else:
+        print(f"❌ Comando desconocido: {command} (usar rebuild, purge, clear o stats)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
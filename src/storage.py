@@ -0,0 +1,25 @@
+import os
+import sqlite3
+from typing import Optional
+from dotenv import load_dotenv
+
+def connect(path: Optional[str] = None, wal: bool = True) -> sqlite3.Connection:
+    """
+    Abre la base SQLite local donde se guarda el estado de la sincronización
+    
+    Args:
+        path (str, optional): Ruta del archivo. Si no se proporciona, se usa SYNC_DB_PATH
+        wal (bool): Si es False se usa el journal clásico (DELETE) en lugar de WAL
+        
+    Returns:
+        sqlite3.Connection: Conexión compartible entre hilos (el llamador debe serializar el acceso)
+    """
+    load_dotenv()
+    path = path or os.getenv('SYNC_DB_PATH', 'sync_state.db')
+    
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL permite lecturas mientras otro proceso escribe (requiere memoria compartida en un solo host)
+    conn.execute('PRAGMA journal_mode=WAL' if wal else 'PRAGMA journal_mode=DELETE')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
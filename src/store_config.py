@@ -34,7 +34,8 @@ class StoreConfig:
                     'api_url': store['base_url'],
                     'token': store['headers']['Authentication'],
                     'user_agent': store['headers']['User-Agent'] or 'Conexion a Tienda Nube (devs.tiendaonline@gmail.com)',
-                    'category': 'todo'  # Categoría por defecto
+                    'category': 'todo',  # Categoría por defecto
+                    'shopify_location': store.get('shopify_location')  # Nombre o ID; None usa SHOPIFY_LOCATION
                 }
                 formatted_stores.append(formatted_store)
             
@@ -58,6 +59,21 @@ class StoreConfig:
                 return store
         raise ValueError(f"No se encontró la tienda con URL: {api_url}")
     
+    def get_store_by_id(self, store_id) -> Dict[str, any]:
+        """
+        Obtiene la configuración de una tienda por su ID de Tiendanube (último segmento de la URL)
+        
+        Args:
+            store_id: ID de la tienda en Tiendanube
+            
+        Returns:
+            Dict[str, any]: Diccionario con la configuración de la tienda
+        """
+        for store in self.stores:
+            if store['api_url'].rstrip('/').split('/')[-1] == str(store_id):
+                return store
+        raise ValueError(f"No se encontró la tienda con ID: {store_id}")
+    
     def get_all_stores(self) -> List[Dict]:
         """
         Retorna la lista de todas las tiendas configuradas
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from src.storage import connect
+
+def next_interval(previous: float, rate: float, min_interval: float, max_interval: float,
+                  target_changes: float) -> float:
+    """
+    Calcula el intervalo de consulta de una tienda a partir de su ritmo de cambios
+    
+    El intervalo apunta a encontrar unos target_changes cambios por ejecución y no
+    crece más del doble de una vez, para que una sola ejecución tranquila no mande
+    a una tienda activa al intervalo máximo.
+    
+    Args:
+        previous (float): Intervalo actual (segundos)
+        rate (float): Cambios por segundo (promedio suavizado)
+        min_interval (float): Intervalo mínimo (segundos)
+        max_interval (float): Intervalo máximo (segundos)
+        target_changes (float): Cambios que se busca encontrar en cada ejecución
+    
+    Returns:
+        float: Nuevo intervalo (segundos)
+    """
+    interval = target_changes / rate if rate > 0 else max_interval
+    interval = min(interval, previous * 2)
+    return max(min_interval, min(interval, max_interval))
+
+def spread_offset(store: str, window: float) -> float:
+    """
+    Desfase estable de una tienda dentro de una ventana, para que no arranquen todas juntas
+    
+    Args:
+        store (str): URL de API de la tienda
+        window (float): Ventana a repartir (segundos)
+    
+    Returns:
+        float: Segundos entre 0 y window (el mismo para la misma tienda en cada reinicio)
+    """
+    return (zlib.crc32(store.encode('utf-8')) % 10_000) / 10_000 * window
+
+class StoreSchedule:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Inicializa el estado persistente del programador por tienda
+        
+        Guarda para cada tienda el ritmo de cambios observado, el intervalo de consulta
+        y la próxima ejecución, y los pedidos de sincronización inmediata.
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+        """
+        load_dotenv()
+        self.min_interval = float(os.getenv('SCHEDULER_MIN_INTERVAL_MINUTES', 5)) * 60
+        self.max_interval = max(float(os.getenv('SCHEDULER_MAX_INTERVAL_MINUTES', 120)) * 60, self.min_interval)
+        self.target_changes = float(os.getenv('SCHEDULER_TARGET_CHANGES', 50))
+        self.smoothing = float(os.getenv('SCHEDULER_SMOOTHING', 0.3))
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS store_schedule (
+                    store TEXT PRIMARY KEY,
+                    interval REAL NOT NULL,
+                    change_rate REAL NOT NULL DEFAULT 0,
+                    next_run REAL NOT NULL,
+                    last_run REAL,
+                    last_changes INTEGER,
+                    last_duration REAL
+                )
+            """)
+            # Pedidos de sincronización inmediata (los consume el programador en ejecución)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_triggers (
+                    store TEXT PRIMARY KEY,
+                    requested_at REAL NOT NULL
+                )
+            """)
+
+    def get(self, store: str) -> Optional[Dict]:
+        """
+        Obtiene el estado de una tienda
+        
+        Args:
+            store (str): URL de API de la tienda
+        
+        Returns:
+            Optional[Dict]: Fila de store_schedule o None si nunca se programó
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM store_schedule WHERE store = ?', (store,)).fetchone()
+        return dict(row) if row else None
+
+    def all(self) -> List[Dict]:
+        """Estado de todas las tiendas programadas, ordenado por próxima ejecución"""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM store_schedule ORDER BY next_run').fetchall()
+        return [dict(row) for row in rows]
+
+    def register(self, stores: List[str], now: Optional[float] = None) -> Dict[str, float]:
+        """
+        Da de alta las tiendas y reparte sus próximas ejecuciones
+        
+        Las tiendas nuevas y las que quedaron atrasadas (por ejemplo tras un reinicio)
+        se reparten dentro del intervalo mínimo en lugar de ejecutarse todas a la vez.
+        
+        Args:
+            stores (List[str]): URLs de API de las tiendas configuradas
+            now (float, optional): Momento actual (epoch)
+        
+        Returns:
+            Dict[str, float]: Próxima ejecución (epoch) de cada tienda
+        """
+        now = now or time.time()
+        next_runs = {}
+        with self._lock, self._conn:
+            for store in stores:
+                row = self._conn.execute('SELECT next_run FROM store_schedule WHERE store = ?', (store,)).fetchone()
+                offset = now + spread_offset(store, self.min_interval)
+                if row is None:
+                    self._conn.execute(
+                        'INSERT INTO store_schedule (store, interval, next_run) VALUES (?, ?, ?)',
+                        (store, self.min_interval, offset)
+                    )
+                    next_runs[store] = offset
+                elif row['next_run'] < now:
+                    self._conn.execute('UPDATE store_schedule SET next_run = ? WHERE store = ?', (offset, store))
+                    next_runs[store] = offset
+                else:
+                    next_runs[store] = row['next_run']
+        return next_runs
+
+    def record_run(self, store: str, changes: int, started_at: float, finished_at: float) -> Dict:
+        """
+        Registra una ejecución y recalcula el intervalo de la tienda
+        
+        El ritmo de cambios se estima como cambios encontrados / tiempo desde la ejecución
+        anterior, suavizado con un promedio exponencial (SCHEDULER_SMOOTHING).
+        
+        Args:
+            store (str): URL de API de la tienda
+            changes (int): Productos sincronizados (cambios nuevos) en la ejecución
+            started_at (float): Inicio de la ejecución (epoch)
+            finished_at (float): Fin de la ejecución (epoch)
+        
+        Returns:
+            Dict: Nuevo estado de la tienda
+        """
+        state = self.get(store) or {'interval': self.min_interval, 'change_rate': 0.0, 'last_run': None}
+        if state['last_run'] is None:
+            # La primera ejecución trae el atraso acumulado (SYNC_INITIAL_LOOKBACK_MINUTES
+            # o la marca de agua): no dice nada del ritmo de la tienda
+            rate = 0.0
+            interval = self.min_interval
+        else:
+            observed = changes / max(started_at - state['last_run'], 1.0)
+            rate = self.smoothing * observed + (1 - self.smoothing) * state['change_rate']
+            interval = next_interval(state['interval'], rate, self.min_interval, self.max_interval,
+                                     self.target_changes)
+        # Jitter de ±10% para que tiendas con el mismo ritmo no se sincronicen en fila
+        jitter = (spread_offset(f'{store}:{started_at}', 0.2) - 0.1) * interval
+        next_run = finished_at + interval + jitter
+        
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO store_schedule
+                    (store, interval, change_rate, next_run, last_run, last_changes, last_duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (store, interval, rate, next_run, started_at, changes, finished_at - started_at))
+        return {'store': store, 'interval': interval, 'change_rate': rate, 'next_run': next_run}
+
+    def trigger(self, store: str) -> None:
+        """Pide una sincronización inmediata de una tienda al programador en ejecución"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_triggers (store, requested_at) VALUES (?, ?)', (store, time.time())
+            )
+
+    def pop_triggers(self) -> List[str]:
+        """
+        Toma los pedidos de sincronización inmediata pendientes
+        
+        Returns:
+            List[str]: URLs de API de las tiendas pedidas, en orden de pedido
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute('SELECT store, requested_at FROM sync_triggers ORDER BY requested_at').fetchall()
+            # Un pedido que llegó después de leer (requested_at distinto) se conserva
+            self._conn.executemany('DELETE FROM sync_triggers WHERE store = ? AND requested_at = ?',
+                                   [(row['store'], row['requested_at']) for row in rows])
+        return [row['store'] for row in rows]
@@ -1,128 +1,465 @@
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from src.store_config import StoreConfig
-from src.shopify import ShopifyAPI
-from src.tiendanube import TiendanubeAPI
+from src.shopify import ShopifyAPI, PERMANENT_FAILURES, FAILURE_ERROR
+from src.tiendanube import TiendanubeAPI, parse_updated_at
+from src.models import Product
+from src.inventory_writer import InventoryWriter
+from src.sync_state import SyncState
+from src.aggregation import StockAggregator, from_env as aggregator_from_env
+from src.sharding import leases_from_env, run_leased, shard_from_env, shard_settings
+from src.dead_letter import (
+    FAILURE_PRODUCT_NOT_FOUND,
+    from_env as dead_letters_from_env,
+    product_failures,
+    writer_failures,
+)
+from src import log, metrics
 
-def process_product_stock(product):
+logger = log.get_logger(__name__)
+
+# Fecha mínima de modificación que equivale a pedir todo el catálogo
+FULL_FETCH_SINCE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+def sync_product(producto: Product, shopify: ShopifyAPI, writer: InventoryWriter = None, location: str = None,
+                 failures: list = None) -> bool:
     """
-    Procesa el stock de un producto y sus variantes
+    Procesa el stock de un producto de Tiendanube y lo sincroniza con Shopify
     
     Args:
-        product (dict): Producto de Tiendanube
+        producto (Product): Producto de Tiendanube (con el stock ya normalizado)
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        writer (InventoryWriter, optional): Writer en lote; si no se indica se escribe variante por variante
+        location (str, optional): Nombre o ID de la ubicación de Shopify de la tienda
+        failures (list, optional): Si se indica, se agregan pares (SKU, motivo) por cada fallo
         
     Returns:
-        dict: Producto con stock procesado
+        bool: True si todas las variantes se actualizaron (o encolaron) correctamente
     """
-    variants = product.get('variants', [])
+    logger.debug("📦 Procesando producto %s (actualizado %s)", producto.id, producto.updated_at,
+                 extra=log.SAMPLED)
     
-    if variants:
-        # Producto con variantes
-        for variant in variants:
-            if variant.get('stock') is None:
-                print(f"🔄 Convirtiendo stock infinito a 999 para variante {variant['id']}")
-                variant['stock'] = 999
-                variant['sku'] = str(variant['id'])  # Asegurar que el SKU sea el ID de la variante
-    else:
-        # Producto sin variantes
-        if product.get('stock') is None:
-            print(f"🔄 Convirtiendo stock infinito a 999 para producto {product['id']}")
-            product['stock'] = 999
-        product['sku'] = str(product['id'])  # Asegurar que el SKU sea el ID del producto
+    # Sincronizar con Shopify
+    return shopify.sync_products_from_tiendanube(producto, writer=writer, location=location, failures=failures)
+
+def _create_tiendanube(store_config: dict) -> TiendanubeAPI:
+    """Inicializa la API de Tiendanube para una tienda configurada"""
+    return TiendanubeAPI(
+        api_url=store_config['api_url'],
+        token=store_config['token'],
+        user_agent=store_config['user_agent']
+    )
+
+def _create_writer(shopify: ShopifyAPI, aggregator: StockAggregator = None, store: str = None) -> InventoryWriter:
+    """
+    Crea el writer de una tienda: el del agregador si hay agregación entre tiendas,
+    o el writer en lote, salvo que SHOPIFY_BULK_WRITES sea 'false'
+    """
+    if aggregator is not None:
+        return aggregator.store_writer(store)
+    if os.getenv('SHOPIFY_BULK_WRITES', 'true').lower() == 'false':
+        return None
+    return InventoryWriter(shopify)
+
+def sync_products_by_id(store_config: dict, product_ids, shopify: ShopifyAPI, not_found: list = None) -> int:
+    """
+    Sincroniza productos puntuales de una tienda, consultándolos por ID
+    
+    Los productos se consultan en paralelo (hasta TIENDANUBE_MAX_CONCURRENCY_PER_STORE)
+    y se sincronizan en orden con un solo writer en lote.
+    
+    Args:
+        store_config (dict): Configuración de la tienda
+        product_ids (Iterable): IDs de productos de Tiendanube
+        shopify (ShopifyAPI): Instancia de ShopifyAPI
+        not_found (list, optional): Si se indica, se le agregan los IDs que Tiendanube no devolvió
+        
+    Returns:
+        int: Número de productos sincronizados
+    """
+    tiendanube = _create_tiendanube(store_config)
+    aggregator = aggregator_from_env()
+    writer = _create_writer(shopify, aggregator, store_config['api_url'])
+    productos_ok = set()
+    fallos_registro = []
+    product_ids = list(product_ids)
+    
+    try:
+        max_workers = max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY_PER_STORE', 4)))
+        get_product = metrics.profile_worker(tiendanube.get_product)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for product_id, producto in zip(product_ids, executor.map(get_product, product_ids)):
+                if not producto:
+                    # Queda en el registro (sumando un intento) hasta que aparezca o se descarte con clear
+                    fallos_registro.append((product_id, '', FAILURE_PRODUCT_NOT_FOUND, {}))
+                    if not_found is not None:
+                        not_found.append(product_id)
+                    continue
+                try:
+                    fallos = []
+                    if sync_product(producto, shopify, writer, store_config.get('shopify_location'), fallos):
+                        productos_ok.add(producto.id)
+                    else:
+                        fallos_registro.extend(product_failures(producto, fallos))
+                except Exception as e:
+                    logger.error("❌ Error sincronizando producto %s: %s", product_id, e)
+                    fallos_registro.extend(product_failures(producto, [(str(producto.id), FAILURE_ERROR)]))
         
-    return product
+        if writer:
+            writer.flush()
+            productos_ok -= writer.failed_refs
+        if aggregator:
+            aggregator.flush(shopify)
+        _update_dead_letters(store_config['api_url'], fallos_registro, writer, productos_ok)
+    finally:
+        tiendanube.client.close()
+    
+    return len(productos_ok)
+
+def _update_dead_letters(api_url: str, fallos: list, writer, productos_ok: set) -> None:
+    """
+    Registra los fallos de una tienda y quita del registro los productos que se sincronizaron bien
+    
+    Args:
+        api_url (str): URL de API de la tienda
+        fallos (list): Entradas de product_failures
+        writer (InventoryWriter, optional): Writer ya enviado (sus escrituras rechazadas también se registran)
+        productos_ok (set): IDs de productos sincronizados
+    """
+    dead_letters = dead_letters_from_env()
+    if dead_letters is None:
+        return
+    dead_letters.record(api_url, fallos + writer_failures(writer))
+    dead_letters.resolve(api_url, productos_ok)
+
+def _next_watermark(versiones: dict, productos_ok: set):
+    """
+    Calcula hasta dónde avanza la marca de agua sin dejar huecos
+    
+    La marca avanza hasta el mayor (updated_at, id) sincronizado que sea anterior
+    a todos los productos que fallaron, para que se vuelvan a pedir en la próxima ejecución.
+    
+    Args:
+        versiones (dict): product_id -> (updated_at como datetime, updated_at original)
+        productos_ok (set): IDs de los productos sincronizados
+        
+    Returns:
+        Optional[Tuple[datetime, int]]: Nueva marca de agua o None si no puede avanzar
+    """
+    fallidos = [(fecha, product_id) for product_id, (fecha, _) in versiones.items() if product_id not in productos_ok]
+    if any(fecha is None for fecha, _ in fallidos):
+        return None
+    
+    candidatos = [
+        (fecha, product_id) for product_id, (fecha, _) in versiones.items()
+        if product_id in productos_ok and fecha is not None
+    ]
+    if fallidos:
+        limite = min(fallidos)
+        candidatos = [candidato for candidato in candidatos if candidato < limite]
+    return max(candidatos) if candidatos else None
 
-def sync_store(store_config: dict, shopify: ShopifyAPI) -> int:
+def _overlap() -> timedelta:
+    """Ventana de solapamiento para cambios que llegan tarde (SYNC_OVERLAP_MINUTES)"""
+    return timedelta(minutes=float(os.getenv('SYNC_OVERLAP_MINUTES', 5)))
+
+def _fetch_window(state: SyncState, api_url: str):
     """
-    Sincroniza los productos de una tienda específica
+    Calcula desde cuándo pedir cambios a una tienda
+    
+    Args:
+        state (SyncState): Estado persistente de la sincronización
+        api_url (str): URL de API de la tienda
+        
+    Returns:
+        Tuple: (marca de agua actual o None, fecha desde la que se consulta)
+    """
+    # Desde la marca de agua (menos un solapamiento para cambios que llegan tarde)
+    # o, la primera vez, desde SYNC_INITIAL_LOOKBACK_MINUTES
+    marca = state.get_watermark(api_url)
+    if marca:
+        logger.info("🔖 Marca de agua: %s (producto %s)", marca[0].isoformat(), marca[1])
+        return marca, marca[0] - _overlap()
+    
+    # Con shards, una tienda sin marca puede venir de un worker de otro host (la marca queda en
+    # su SYNC_DB_PATH): pedir solo la ventana inicial perdería los cambios anteriores
+    _, count = shard_settings()
+    if os.getenv('SYNC_INITIAL_FULL_FETCH', 'true' if count > 1 else 'false').lower() == 'true':
+        logger.info("📚 Sin marca de agua: se piden todos los productos de la tienda")
+        return None, FULL_FETCH_SINCE
+    
+    lookback = float(os.getenv('SYNC_INITIAL_LOOKBACK_MINUTES', 60))
+    return None, datetime.now(timezone.utc) - timedelta(minutes=lookback)
+
+def _advance_watermark(state: SyncState, api_url: str, marca, desde: datetime, versiones: dict,
+                       productos_terminados: set, fetch_completo: bool) -> None:
+    """
+    Registra los productos terminados y avanza la marca de agua si corresponde
+    
+    Args:
+        state (SyncState): Estado persistente de la sincronización
+        api_url (str): URL de API de la tienda
+        marca: Marca de agua con la que empezó la ejecución (o None)
+        desde (datetime): Fecha desde la que se consultó
+        versiones (dict): product_id -> (updated_at como datetime, updated_at original)
+        productos_terminados (set): IDs de productos que no hace falta volver a pedir
+        fetch_completo (bool): Si se recorrieron todas las páginas
+    """
+    state.mark_synced(api_url, [
+        (product_id, versiones[product_id][1]) for product_id in productos_terminados
+    ])
+    
+    # Avanzar la marca de agua solo si se recorrieron todas las páginas
+    nueva_marca = _next_watermark(versiones, productos_terminados) if fetch_completo else None
+    if nueva_marca and (marca is None or nueva_marca > marca):
+        state.set_watermark(api_url, *nueva_marca)
+        state.prune_synced(api_url, nueva_marca[0] - _overlap())
+        logger.info("🔖 Nueva marca de agua: %s (producto %s)", nueva_marca[0].isoformat(), nueva_marca[1],
+                    extra={'watermark': nueva_marca[0].isoformat()})
+    elif marca is None and fetch_completo and not versiones:
+        # Sin cambios en la primera ejecución: arrancar desde el inicio de la ventana consultada
+        state.set_watermark(api_url, desde, 0)
+
+def sync_store(store_config: dict, shopify: ShopifyAPI, aggregator: StockAggregator = None,
+               errors: list = None) -> int:
+    """
+    Sincroniza los productos de una tienda modificados desde la última sincronización exitosa
     
     Args:
         store_config (dict): Configuración de la tienda
         shopify (ShopifyAPI): Instancia de ShopifyAPI
+        aggregator (StockAggregator, optional): Si se indica, las cantidades se registran en el
+            agregador y el llamador escribe el valor combinado de todas las tiendas
+        errors (list, optional): Si se indica, se agrega un mensaje si la tienda falló entera, si no se
+            sincronizó ninguno de los productos con cambios o si el catálogo quedó incompleto
         
     Returns:
         int: Número de productos sincronizados
     """
     try:
-        print(f"\n Procesando tienda")
-        print(f" URL: {store_config['api_url']}")
+        api_url = store_config['api_url']
+        logger.info("🏪 Procesando tienda %s", api_url)
+        inicio = time.monotonic()
         
         # Inicializar API de Tiendanube para esta tienda
-        tiendanube = TiendanubeAPI(
-            api_url=store_config['api_url'],
-            token=store_config['token'],
-            user_agent=store_config['user_agent']
-        )
+        tiendanube = _create_tiendanube(store_config)
         
-        # Obtener productos modificados recientemente
-        print(f"\n🔍 Buscando productos modificados recientemente...")
-        productos = tiendanube.get_products()
+        state = SyncState()
+        marca, desde = _fetch_window(state, api_url)
         
-        if not productos:
-            print(f"ℹ️ No se encontraron productos modificados recientemente")
-            return 0
-            
-        print(f"✅ Se encontraron {len(productos)} productos modificados")
+        # Obtener productos modificados (se procesan a medida que llegan las páginas)
+        productos = tiendanube.iter_products(updated_at_min=desde)
         
-        productos_sincronizados = 0
+        # Las escrituras se acumulan y se envían en lotes por GraphQL
+        writer = _create_writer(shopify, aggregator, api_url)
         
-        # Procesar cada producto
-        for producto in productos:
+        productos_encontrados = 0
+        productos_duplicados = 0
+        productos_ok = set()
+        # Productos con SKUs que no existen en Shopify: reintentarlos no cambia el resultado
+        productos_sin_mapeo = set()
+        # Fallos a registrar para retry-failed (ver src/dead_letter.py)
+        fallos_registro = []
+        versiones = {}
+        
+        # Procesar cada producto (el tiempo de espera de las páginas se mide aparte)
+        for producto in metrics.timed_iter(productos, 'tiendanube_fetch'):
+            productos_encontrados += 1
+            updated_at = producto.updated_at
+            versiones[producto.id] = (parse_updated_at(updated_at), updated_at)
+            
+            # Misma versión ya sincronizada en la ventana de solapamiento
+            if state.is_synced(api_url, producto.id, updated_at):
+                productos_duplicados += 1
+                productos_ok.add(producto.id)
+                continue
+            
             try:
-                print(f"\n📦 Procesando producto:")
-                print(f"   ID: {producto.get('id')}")
-                print(f"   Nombre: {producto.get('name')}")
-                print(f"   Última actualización: {producto.get('updated_at')}")
-                
-                # Procesar stock y SKUs
-                producto = process_product_stock(producto)
-                
-                # Sincronizar con Shopify
-                print(f"🔄 Sincronizando producto {producto['id']}...")
-                if shopify.sync_products_from_tiendanube(producto):
-                    productos_sincronizados += 1
-                    print(f"✅ Producto sincronizado correctamente")
+                fallos = []
+                if sync_product(producto, shopify, writer, store_config.get('shopify_location'), fallos):
+                    productos_ok.add(producto.id)
+                    continue
+                if fallos and all(motivo in PERMANENT_FAILURES for _, motivo in fallos):
+                    productos_sin_mapeo.add(producto.id)
+                fallos_registro.extend(product_failures(producto, fallos))
                 
             except Exception as e:
-                print(f"❌ Error sincronizando producto {producto.get('id')}: {str(e)}")
+                logger.error("❌ Error sincronizando producto %s: %s", producto.id, e)
+                fallos_registro.extend(product_failures(producto, [(str(producto.id), FAILURE_ERROR)]))
                 continue
-                
-        print(f"\n✅ Sincronización completada para esta tienda")
-        print(f"📊 Productos sincronizados: {productos_sincronizados}")
         
+        # Un producto cuenta como sincronizado si ninguna de sus escrituras en lote falló
+        if writer:
+            with metrics.timer('shopify_flush'):
+                writer.flush()
+            productos_ok -= writer.failed_refs
+        _update_dead_letters(api_url, fallos_registro, writer, productos_ok)
+        productos_sincronizados = len(productos_ok) - productos_duplicados
+        
+        stats = tiendanube.client.connection_stats()
+        tiendanube.client.close()
+        
+        # Los productos sin mapeo en Shopify no frenan la marca de agua porque
+        # fallarían igual en la próxima ejecución
+        productos_terminados = productos_ok | (productos_sin_mapeo - (writer.failed_refs if writer else set()))
+        _advance_watermark(state, api_url, marca, desde, versiones, productos_terminados,
+                           tiendanube.last_fetch_complete)
+        
+        segundos = time.monotonic() - inicio
+        metrics.STAGE_DURATION.observe(segundos, stage='store')
+        metrics.ITEMS_PER_SECOND.set(round(productos_encontrados / segundos, 2) if segundos else 0, store=api_url)
+        metrics.ITEMS.inc(productos_sincronizados, stage='sync', result='ok')
+        metrics.ITEMS.inc(productos_duplicados, stage='sync', result='duplicado')
+        metrics.ITEMS.inc(len(productos_sin_mapeo), stage='sync', result='sin_mapeo')
+        productos_fallidos = max(productos_encontrados - len(productos_ok) - len(productos_sin_mapeo), 0)
+        metrics.ITEMS.inc(productos_fallidos, stage='sync', result='fallido')
+        if errors is not None:
+            if productos_fallidos and not productos_sincronizados:
+                errors.append(f"fallaron los {productos_fallidos} productos con cambios")
+            if not tiendanube.last_fetch_complete:
+                errors.append("el catálogo no se pudo recorrer completo")
+        
+        # Resumen de la tienda (en lugar de un log por producto)
+        logger.info(
+            "✅ Tienda sincronizada: %s/%s productos (%s ya sincronizados, %s sin mapeo en Shopify)",
+            productos_sincronizados, productos_encontrados, productos_duplicados, len(productos_sin_mapeo),
+            extra={
+                'products_found': productos_encontrados,
+                'products_synced': productos_sincronizados,
+                'products_duplicated': productos_duplicados,
+                'products_unmapped': len(productos_sin_mapeo),
+                'writes_skipped': writer.skipped if writer else 0,
+                'requests': stats['requests'],
+                'connections': stats['connections'],
+            }
+        )
         return productos_sincronizados
         
     except Exception as e:
-        print(f"❌ Error procesando tienda: {str(e)}")
+        logger.exception("❌ Error procesando tienda: %s", e)
+        if errors is not None:
+            errors.append(str(e) or type(e).__name__)
         return 0
 
-def main():
-    """Función principal que sincroniza productos de múltiples tiendas a Shopify"""
+def _timed_sync_store(store: dict, shopify: ShopifyAPI, aggregator: StockAggregator = None) -> dict:
+    """
+    Sincroniza una tienda y mide su duración
+    
+    Args:
+        store (dict): Configuración de la tienda
+        shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+        aggregator (StockAggregator, optional): Agregador de stock entre tiendas
+        
+    Returns:
+        dict: Resumen de la tienda con URL, productos sincronizados, segundos y error (None si no falló)
+    """
+    inicio = time.monotonic()
+    errores = []
+    with log.store_context(store['api_url']):
+        productos_sincronizados = sync_store(store, shopify, aggregator, errores)
+    return {
+        'api_url': store['api_url'],
+        'productos': productos_sincronizados,
+        'segundos': time.monotonic() - inicio,
+        'error': '; '.join(errores) or None
+    }
+
+def main(engine: str = None):
+    """
+    Función principal que sincroniza productos de múltiples tiendas a Shopify
+    
+    Args:
+        engine (str, optional): 'sync' (hilos) o 'async' (asyncio + aiohttp). Si no se
+            proporciona, se usa SYNC_ENGINE (por defecto 'sync')
+    """
+    load_dotenv()
+    # Con SYNC_PIPELINE=true la lectura y la escritura se desacoplan por una cola persistente
+    if os.getenv('SYNC_PIPELINE', 'false').lower() == 'true':
+        from src.pipeline import main as pipeline_main
+        pipeline_main()
+        return
+    
+    engine = (engine or os.getenv('SYNC_ENGINE', 'sync')).lower()
+    if engine == 'async' and os.getenv('STOCK_AGGREGATION'):
+        logger.warning("⚠️ La agregación de stock entre tiendas usa el motor sincrónico")
+    elif engine == 'async':
+        from src import async_engine
+        if async_engine.available():
+            async_engine.main()
+            return
+        logger.warning("⚠️ aiohttp no está instalado (pip install aiohttp); se usa el motor sincrónico")
+    
+    log.new_run()
+    metrics.start_from_env()
     try:
-        # Cargar configuración de tiendas
+        # Cargar configuración de tiendas (con SHARD_COUNT, solo las del shard de este worker)
         store_config = StoreConfig()
-        stores = store_config.get_all_stores()
+        stores = shard_from_env(store_config.get_all_stores())
+        leases = leases_from_env()
         
-        print(f"🔄 Procesando {len(stores)} tiendas...")
+        # Cantidad de tiendas de Tiendanube que se sincronizan en paralelo
+        max_workers = max(1, int(os.getenv('TIENDANUBE_MAX_CONCURRENCY', 4)))
+        logger.info("🔄 Procesando %s tiendas (%s en paralelo)", len(stores), max_workers)
         
         # Inicializar Shopify API (una sola instancia para todas las tiendas)
         shopify = ShopifyAPI()
         
-        # Estadísticas globales
-        total_productos_sincronizados = 0
+        # Con STOCK_AGGREGATION las tiendas solo registran sus cantidades y al final
+        # se escribe una vez el valor combinado de cada item
+        aggregator = aggregator_from_env()
         
-        # Procesar cada tienda
-        for i, store in enumerate(stores, 1):
-            print(f"\n📦 Tienda {i}/{len(stores)}")
-            productos_sincronizados = sync_store(store, shopify)
-            total_productos_sincronizados += productos_sincronizados
+        inicio = time.monotonic()
+        with metrics.profiled('sync'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Cada tienda corre en un hilo del pool: profile_worker la suma al perfil
+            sync_one = metrics.profile_worker(
+                lambda store: run_leased(leases, store['api_url'], lambda: _timed_sync_store(store, shopify, aggregator))
+            )
+            resumenes = list(executor.map(sync_one, stores))
+        # Las tiendas que otro worker estaba sincronizando no tienen resumen
+        resumenes = [resumen for resumen in resumenes if resumen]
+        if aggregator:
+            with metrics.timer('aggregation_flush'):
+                aggregator.flush(shopify)
         
         # Resumen final
-        print(f"\n🎉 Proceso completado!")
-        print(f"📊 Total de productos sincronizados: {total_productos_sincronizados}")
+        total_productos_sincronizados = sum(resumen['productos'] for resumen in resumenes)
+        for i, resumen in enumerate(resumenes, 1):
+            logger.info("📦 Tienda %s/%s %s: %s productos en %.1fs", i, len(stores), resumen['api_url'],
+                        resumen['productos'], resumen['segundos'], extra=resumen)
+        stats = shopify.client.connection_stats()
+        logger.info(
+            "🎉 Proceso completado en %.1fs: %s productos sincronizados",
+            time.monotonic() - inicio, total_productos_sincronizados,
+            extra={
+                'stores': len(stores),
+                'products_synced': total_productos_sincronizados,
+                'shopify_requests': stats['requests'],
+                'shopify_connections': stats['connections'],
+            }
+        )
         
     except Exception as e:
-        print(f"❌ Error general: {str(e)}")
+        logger.exception("❌ Error general: %s", e)
+    finally:
+        metrics.export('sync')
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Sincroniza el stock de Tiendanube a Shopify')
+    parser.add_argument('--engine', choices=('sync', 'async'), help='Motor de ejecución (por defecto SYNC_ENGINE o sync)')
+    parser.add_argument('--plan', metavar='ARCHIVO',
+                        help='Calcula los cambios sin escribir en Shopify y los guarda en ARCHIVO (JSONL o CSV)')
+    parser.add_argument('--apply-plan', metavar='ARCHIVO', help='Aplica en lote un plan guardado con --plan')
+    parser.add_argument('--plan-format', choices=('jsonl', 'csv'), help='Formato del plan (por defecto según la extensión)')
+    args = parser.parse_args()
+    if args.plan:
+        from src.plan import main as plan_main
+        plan_main(args.plan, args.plan_format)
+    elif args.apply_plan:
+        from src.plan import apply_main
+        apply_main(args.apply_plan, args.plan_format)
+    else:
+        main(args.engine) 
\ No newline at end of file
@@ -0,0 +1,99 @@
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+from src.storage import connect
+from src.tiendanube import parse_updated_at
+
+class SyncState:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Inicializa el estado persistente de la sincronización incremental por tienda
+        
+        Args:
+            path (str, optional): Ruta de la base SQLite. Si no se proporciona, se usa SYNC_DB_PATH
+        """
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            # Marca de agua: último (updated_at, product_id) sincronizado sin huecos
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    store TEXT PRIMARY KEY,
+                    updated_at TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    saved_at REAL NOT NULL
+                )
+            """)
+            # Versiones de productos ya sincronizadas dentro de la ventana de solapamiento
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS synced_products (
+                    store TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (store, product_id, updated_at)
+                )
+            """)
+
+    def get_watermark(self, store: str) -> Optional[Tuple[datetime, int]]:
+        """
+        Obtiene la marca de agua de una tienda
+        
+        Args:
+            store (str): URL de API de la tienda
+            
+        Returns:
+            Optional[Tuple[datetime, int]]: (updated_at, product_id) o None si nunca se sincronizó
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT updated_at, product_id FROM watermarks WHERE store = ?', (store,)
+            ).fetchone()
+        if not row:
+            return None
+        return datetime.fromisoformat(row['updated_at']), row['product_id']
+
+    def set_watermark(self, store: str, updated_at: datetime, product_id: int) -> None:
+        """Guarda la marca de agua de una tienda"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO watermarks (store, updated_at, product_id, saved_at) VALUES (?, ?, ?, ?)',
+                (store, updated_at.isoformat(), product_id, time.time())
+            )
+
+    def is_synced(self, store: str, product_id: int, updated_at: str) -> bool:
+        """Indica si esa versión del producto ya se sincronizó en una ejecución anterior"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM synced_products WHERE store = ? AND product_id = ? AND updated_at = ?',
+                (store, product_id, updated_at)
+            ).fetchone()
+        return row is not None
+
+    def mark_synced(self, store: str, versions) -> None:
+        """
+        Registra versiones de productos sincronizadas
+        
+        Args:
+            store (str): URL de API de la tienda
+            versions (Iterable[Tuple[int, str]]): Pares (product_id, updated_at)
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO synced_products (store, product_id, updated_at) VALUES (?, ?, ?)',
+                [(store, product_id, updated_at) for product_id, updated_at in versions]
+            )
+
+    def prune_synced(self, store: str, before: datetime) -> None:
+        """Olvida las versiones anteriores a una fecha (ya fuera de la ventana de solapamiento)"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                'SELECT product_id, updated_at FROM synced_products WHERE store = ?', (store,)
+            ).fetchall()
+            old = [
+                (store, row['product_id'], row['updated_at']) for row in rows
+                if (parse_updated_at(row['updated_at']) or before) <= before
+            ]
+            self._conn.executemany(
+                'DELETE FROM synced_products WHERE store = ? AND product_id = ? AND updated_at = ?', old
+            )
@@ -1,13 +1,43 @@
 import os
 import json
+import logging
 import requests
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from dotenv import load_dotenv
 from .store_config import StoreConfig
+from .http_client import ApiClient, tiendanube_rate_limit
+from .log import get_logger, SAMPLED
+from .models import Product, parse_products
 import time
 from datetime import datetime, timedelta
 import pytz
 
+logger = get_logger(__name__)
+
+def parse_updated_at(value: str) -> Optional[datetime]:
+    """
+    Convierte una fecha de Tiendanube ('2024-01-15T10:20:30+0000') a datetime UTC
+    
+    Args:
+        value (str): Fecha en formato ISO 8601
+        
+    Returns:
+        Optional[datetime]: Fecha con zona horaria o None si no se puede interpretar
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.replace('+0000', 'Z'), '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+def format_updated_at(value: datetime) -> str:
+    """Formatea una fecha como la espera el parámetro updated_at_min de Tiendanube"""
+    return value.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
 class TiendanubeAPI:
     def __init__(self, api_url: str = None, token: str = None, user_agent: str = None):
         """
@@ -40,121 +70,183 @@ class TiendanubeAPI:
             token = f"bearer {token}"
             
         self.api_url = api_url
+        self.last_fetch_complete = False
         self.headers = {
             'Authentication': token,
             'Content-Type': 'application/json',
             'User-Agent': user_agent
         }
         
-        print("✅ API de Tiendanube inicializada")
-        print(f"🔹 URL: {self.api_url}")
+        # Cada tienda tiene su propio balde de peticiones en Tiendanube (x-rate-limit-*)
+        self.client = ApiClient(
+            'Tiendanube',
+            capacity=float(os.getenv('TIENDANUBE_BUCKET_SIZE', 40)),
+            refill_rate=float(os.getenv('TIENDANUBE_MAX_REQUESTS_PER_SECOND', 2)),
+            max_concurrency=int(os.getenv('TIENDANUBE_MAX_CONCURRENCY_PER_STORE', 4)),
+            rate_limit_parser=tiendanube_rate_limit,
+            scope=api_url.rstrip('/').rsplit('/', 1)[-1]
+        )
+        
+        logger.debug("✅ API de Tiendanube inicializada: %s", self.api_url)
 
 
-    def _make_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+    def _make_request(self, method: str, endpoint: str, expected_status=(200, 201), **kwargs) -> requests.Response:
         """
         Realiza una petición a la API de Tiendanube
         
         Args:
             method (str): Método HTTP
             endpoint (str): Endpoint de la API
+            expected_status (tuple): Códigos de respuesta que no se consideran error
             **kwargs: Argumentos adicionales para la petición
             
         Returns:
             requests.Response: Respuesta de la API
         """
-        url = f"{self.api_url}/{endpoint}"
-        response = requests.request(method, url, headers=self.headers, **kwargs)
+        # Las URLs de paginación (header Link) ya vienen completas
+        if endpoint.startswith('http'):
+            url = endpoint
+        else:
+            url = f"{self.api_url}/{endpoint}"
+        response = self.client.request(method, url, headers=self.headers, **kwargs)
         
-        if response.status_code not in [200, 201]:
-            print(f"❌ Error en petición a Tiendanube: {response.status_code}")
-            print(f"   Respuesta: {response.text}")
+        if response.status_code not in expected_status:
+            logger.error("❌ Error en petición a Tiendanube: %s", response.status_code,
+                         extra={'status': response.status_code, 'response': response.text[:500]})
             raise Exception(f"Error en petición a Tiendanube: {response.status_code}")
             
         return response
 
-    def get_products(self) -> List[Dict]:
+    # Tamaño máximo de página que acepta la API de Tiendanube
+    PAGE_SIZE = 200
+
+    def get_products(self, updated_at_min: Optional[datetime] = None) -> List[Product]:
         """
-        Obtiene los productos modificados en los últimos 15 minutos
+        Obtiene los productos modificados desde una fecha (por defecto, los últimos 15 minutos)
         
+        Args:
+            updated_at_min (datetime, optional): Fecha mínima de modificación
+            
         Returns:
-            List[Dict]: Lista de productos actualizados
+            List[Product]: Lista de productos actualizados
         """
-        try:
-            # Calcular tiempo hace 15 minutos con formato ISO 8601 exacto
-            hora_actual = datetime.now(pytz.UTC)
-            quince_minutos = hora_actual - timedelta(minutes=15)
-            updated_at_min = quince_minutos.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-            
-            # Parámetros de consulta
-            params = {
-                'q': '',
-                'per_page': 1,
-                'published': "true",
-                'min_stock': 1,
-                'updated_at_min': updated_at_min
-            }
-            
-            print(f"\n⏰ Información de fechas:")
-            print(f"🔹 Hora actual UTC: {hora_actual.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]}Z")
-            print(f"🔹 Buscando desde: {updated_at_min}")
-            
-            response = self._make_request('GET', 'products', params=params)
-            products = response.json()
-            
-            if not isinstance(products, list):
-                print("❌ Respuesta inesperada de la API:")
-                print(products)
-                return []
+        return list(self.iter_products(updated_at_min))
+
+    def iter_products(self, updated_at_min: Optional[datetime] = None, full_catalog: bool = False) -> Iterator[Product]:
+        """
+        Recorre página por página los productos modificados desde una fecha
+        
+        Los productos se entregan a medida que llega cada página, siguiendo el header
+        Link de la API, para poder sincronizarlos sin esperar al catálogo completo.
+        Cada página se convierte en productos compactos mientras se lee (ver parse_products).
+        Al terminar, last_fetch_complete indica si se recorrieron todas las páginas.
+        
+        Args:
+            updated_at_min (datetime, optional): Fecha mínima de modificación. Si no se
+                proporciona, se usan los últimos 15 minutos
+            full_catalog (bool): Si es True, recorre todo el catálogo publicado, sin filtrar
+                por fecha (para la reconciliación completa)
             
-            print(f"\n📦 Productos encontrados: {len(products)}")
+        Yields:
+            Product: Producto actualizado con su stock
+        """
+        self.last_fetch_complete = False
+        hora_actual = datetime.now(pytz.UTC)
+        params = self._products_params(updated_at_min, full_catalog, hora_actual)
+        
+        endpoint = 'products'
+        pagina = 1
+        total = 0
+        sin_stock = 0
+        while endpoint:
+            try:
+                response = self._make_request('GET', endpoint, expected_status=(200, 404), params=params,
+                                              stream=True)
+            except Exception as e:
+                logger.error("❌ Error obteniendo productos (página %s): %s", pagina, e, extra={'page': pagina})
+                break
             
-            # Imprimir información detallada de cada producto
-            for product in products:
-                print(f"\n🔍 Producto:")
-                print(f"   ID: {product.get('id')}")
-                print(f"   Nombre: {product.get('name', {}).get('es', 'Sin nombre')}")
-                ultima_actualizacion = product.get('updated_at', '')
-                print(f"   Última actualización: {ultima_actualizacion}")
+            try:
+                # Tiendanube responde 404 cuando no hay resultados
+                if response.status_code == 404:
+                    self.last_fetch_complete = True
+                    break
                 
-                # Verificar si el producto está dentro del rango de 15 minutos
-                try:
-                    # Convertir la fecha de actualización a objeto datetime
-                    updated_at = datetime.strptime(ultima_actualizacion.replace('+0000', 'Z'), 
-                                                 '%Y-%m-%dT%H:%M:%S%z')
-                    diferencia = hora_actual - updated_at
-                    minutos_diferencia = diferencia.total_seconds() / 60
-                    print(f"   Minutos desde última actualización: {minutos_diferencia:.2f}")
-                except Exception as e:
-                    print(f"   ⚠️ Error procesando fecha: {str(e)}")
+                # La página se lee completa antes de entregar productos, para no dejar
+                # la conexión abierta mientras se sincronizan
+                response.raw.decode_content = True
+                products = parse_products(response.raw)
+            finally:
+                response.close()
+            if products is None:
+                logger.error("❌ Respuesta inesperada de la API en la página %s: no es una lista de productos", pagina)
+                break
+            
+            logger.debug("📦 Página %s: %s productos", pagina, len(products))
+            total += len(products)
             
-            # Filtrar productos con stock
-            filtered_products = []
             for product in products:
-                variants = product.get('variants', [])
-                if variants:
-                    has_stock = any(
-                        variant.get('stock') is None or variant.get('stock', 0) > 0 
-                        for variant in variants
-                    )
-                    if has_stock:
-                        for variant in variants:
-                            variant['sku'] = str(variant['id'])
-                        filtered_products.append(product)
-                else:
-                    if product.get('stock') is None or product.get('stock', 0) > 0:
-                        product['sku'] = str(product['id'])
-                        filtered_products.append(product)
+                if not full_catalog:
+                    self._log_product(product, hora_actual)
+                sin_stock += product.out_of_stock
+                yield product
             
-            print(f"\n✅ Productos con stock encontrados: {len(filtered_products)}")
-            return filtered_products
+            # La URL de la página siguiente ya incluye los parámetros
+            endpoint = response.links.get('next', {}).get('url')
+            params = None
+            pagina += 1
+            if not endpoint:
+                self.last_fetch_complete = True
+        
+        self._log_fetch_summary(total, sin_stock, pagina - 1)
+
+    def _products_params(self, updated_at_min: Optional[datetime], full_catalog: bool, hora_actual: datetime) -> Dict:
+        """
+        Parámetros de la primera página de productos
+        
+        Args:
+            updated_at_min (datetime, optional): Fecha mínima de modificación (por defecto, 15 minutos atrás)
+            full_catalog (bool): Si es True, no se filtra por fecha
+            hora_actual (datetime): Momento de la consulta
             
-        except Exception as e:
-            print(f"❌ Error obteniendo productos: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Respuesta de la API: {e.response.text}")
-            return []
+        Returns:
+            Dict: Parámetros de consulta
+        """
+        if updated_at_min is None:
+            updated_at_min = hora_actual - timedelta(minutes=15)
+        
+        # Parámetros de consulta (sin min_stock: los productos agotados también se sincronizan)
+        params = {
+            'q': '',
+            'per_page': self.PAGE_SIZE,
+            'published': "true"
+        }
+        if full_catalog:
+            logger.info("📚 Recorriendo el catálogo completo")
+        else:
+            params['updated_at_min'] = format_updated_at(updated_at_min)
+            logger.info("⏰ Buscando productos modificados desde %s", params['updated_at_min'],
+                        extra={'updated_at_min': params['updated_at_min']})
+        return params
+
+    def _log_fetch_summary(self, total: int, sin_stock: int, paginas: int) -> None:
+        logger.info("✅ Productos encontrados: %s, agotados: %s", total, sin_stock,
+                    extra={'products': total, 'out_of_stock': sin_stock, 'pages': paginas,
+                           'complete': self.last_fetch_complete})
+
+    def _log_product(self, product: Product, hora_actual: datetime) -> None:
+        """Registra (muestreado, en DEBUG) la información de un producto"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        updated_at = parse_updated_at(product.updated_at)
+        if updated_at is None:
+            logger.warning("⚠️ Error procesando fecha del producto %s: %r", product.id, product.updated_at)
+            return
+        minutos = (hora_actual - updated_at).total_seconds() / 60
+        logger.debug("🔍 Producto %s (%s), actualizado hace %.2f minutos", product.id,
+                     product.name or 'Sin nombre', minutos, extra=SAMPLED)
 
-    def get_product(self, product_id: str) -> Optional[Dict]:
+    def get_product(self, product_id: str) -> Optional[Product]:
         """
         Obtiene un producto específico
         
@@ -162,22 +254,28 @@ class TiendanubeAPI:
             product_id (str): ID del producto
             
         Returns:
-            Optional[Dict]: Producto encontrado o None
+            Optional[Product]: Producto encontrado o None
         """
         try:
             response = self._make_request('GET', f'products/{product_id}')
-            product = response.json()
-            
-            # Configurar SKUs
-            variants = product.get('variants', [])
-            if variants:
-                for variant in variants:
-                    variant['sku'] = str(variant['id'])
-            else:
-                product['sku'] = str(product['id'])
-                
-            return product
+            return Product.from_json(response.json())
         except Exception as e:
-            print(f"❌ Error obteniendo producto {product_id}: {e}")
+            logger.error("❌ Error obteniendo producto %s: %s", product_id, e)
             return None
+
+    def get_order(self, order_id: str) -> Optional[Dict]:
+        """
+        Obtiene una orden específica
+        
+        Args:
+            order_id (str): ID de la orden
             
+        Returns:
+            Optional[Dict]: Orden encontrada o None
+        """
+        try:
+            response = self._make_request('GET', f'orders/{order_id}')
+            return response.json()
+        except Exception as e:
+            logger.error("❌ Error obteniendo orden %s: %s", order_id, e)
+            return None
@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from src.store_config import StoreConfig
+from src.shopify import ShopifyAPI
+from src.sync_products import _create_tiendanube, sync_products_by_id
+from src import log, metrics
+
+logger = log.get_logger(__name__)
+
+# Header con la firma HMAC-SHA256 (hex) del cuerpo del webhook
+SIGNATURE_HEADER = 'x-linkedstore-hmac-sha256'
+
+PRODUCT_EVENTS = {'product/created', 'product/updated'}
+ORDER_EVENTS = {'order/created', 'order/paid', 'order/updated', 'order/cancelled', 'order/edited'}
+
+# Espera máxima entre reintentos de un evento que no se pudo procesar
+RETRY_MAX_SECONDS = 300
+
+def sign(body: bytes, secret: str) -> str:
+    """Calcula la firma HMAC-SHA256 que Tiendanube envía con cada webhook"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+def verify_signature(body: bytes, signature: Optional[str], secret: str) -> bool:
+    """
+    Verifica la firma HMAC de un webhook
+    
+    Args:
+        body (bytes): Cuerpo crudo de la petición
+        signature (str, optional): Valor del header x-linkedstore-hmac-sha256
+        secret (str): Secreto de la aplicación de Tiendanube
+    
+    Returns:
+        bool: True si la firma es válida
+    """
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(body, secret), signature.strip())
+
+class WebhookProcessor:
+    def __init__(self, shopify: ShopifyAPI, store_config: StoreConfig, debounce_seconds: Optional[float] = None,
+                 max_wait_seconds: Optional[float] = None):
+        """
+        Agrupa los eventos de webhooks por producto y los sincroniza tras una ventana de espera
+        
+        Args:
+            shopify (ShopifyAPI): Instancia de ShopifyAPI compartida
+            store_config (StoreConfig): Configuración de tiendas
+            debounce_seconds (float, optional): Segundos de espera tras el último evento de un
+                producto antes de sincronizarlo. Si no se proporciona, se usa WEBHOOK_DEBOUNCE_SECONDS
+            max_wait_seconds (float, optional): Espera máxima desde el primer evento, para que un producto
+                que recibe eventos seguidos no se posponga indefinidamente. Si no se proporciona, se usa
+                WEBHOOK_MAX_WAIT_SECONDS
+        """
+        self.shopify = shopify
+        self.store_config = store_config
+        self.debounce_seconds = (
+            debounce_seconds if debounce_seconds is not None
+            else float(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', 5))
+        )
+        self.max_wait_seconds = (
+            max_wait_seconds if max_wait_seconds is not None
+            else float(os.getenv('WEBHOOK_MAX_WAIT_SECONDS', 30))
+        )
+        self.max_attempts = max(1, int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5)))
+        
+        # (store_id, tipo, id) -> (primer evento, momento en que vence la ventana de espera)
+        self._pending: Dict[Tuple[str, str, str], Tuple[float, float]] = {}
+        # (store_id, tipo, id) -> intentos fallidos de los eventos que se están reintentando
+        self._attempts: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_event(self, payload: Dict) -> bool:
+        """
+        Registra un evento de webhook; los eventos repetidos del mismo producto se combinan
+        
+        Args:
+            payload (Dict): Cuerpo del webhook ({'store_id', 'event', 'id'})
+        
+        Returns:
+            bool: True si el evento es de un tipo que se sincroniza
+        """
+        event = payload.get('event')
+        if event in PRODUCT_EVENTS:
+            kind = 'product'
+        elif event in ORDER_EVENTS:
+            kind = 'order'
+        else:
+            logger.debug("ℹ️ Evento ignorado: %s", event)
+            return False
+        
+        key = (str(payload['store_id']), kind, str(payload['id']))
+        now = time.monotonic()
+        with self._lock:
+            first_seen = self._pending[key][0] if key in self._pending else now
+            self._pending[key] = (first_seen, min(now + self.debounce_seconds, first_seen + self.max_wait_seconds))
+        return True
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Sincroniza los productos cuya ventana de espera venció
+        
+        Args:
+            force (bool): Si es True, sincroniza todo lo pendiente sin esperar
+        
+        Returns:
+            int: Número de productos sincronizados
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, (_, due_at) in self._pending.items() if force or due_at <= now]
+            for key in due:
+                del self._pending[key]
+        
+        by_store: Dict[str, Dict[str, Set[str]]] = {}
+        for store_id, kind, item_id in due:
+            by_store.setdefault(store_id, {'product': set(), 'order': set()})[kind].add(item_id)
+        
+        total = 0
+        for store_id, items in by_store.items():
+            keys = [(store_id, kind, item_id) for kind, item_ids in items.items() for item_id in item_ids]
+            try:
+                store = self.store_config.get_store_by_id(store_id)
+            except ValueError as e:
+                logger.error("❌ %s", e)
+                continue
+            
+            try:
+                product_ids = set(items['product'])
+                if items['order']:
+                    order_product_ids, failed_orders = self._order_product_ids(store, items['order'])
+                    product_ids |= order_product_ids
+                    # Una orden que no se pudo obtener (por ejemplo, un error pasajero de Tiendanube) se reintenta
+                    failed = [(store_id, 'order', order_id) for order_id in failed_orders]
+                    self._retry(failed, 'no se pudo obtener la orden')
+                    keys = [key for key in keys if key not in failed]
+                if product_ids:
+                    with log.store_context(store['api_url']), metrics.timer('webhook_flush'):
+                        logger.info("🔔 Sincronizando %s productos por webhook", len(product_ids),
+                                    extra={'products': len(product_ids)})
+                        total += sync_products_by_id(store, sorted(product_ids), self.shopify)
+                    metrics.ITEMS.inc(len(product_ids), stage='webhook', result='recibido')
+            except Exception as e:
+                logger.exception("❌ Error sincronizando productos por webhook de la tienda %s: %s", store_id, e)
+                self._retry(keys, str(e))
+                continue
+            with self._lock:
+                for key in keys:
+                    self._attempts.pop(key, None)
+        return total
+
+    def _retry(self, keys: List[Tuple[str, str, str]], reason: str) -> None:
+        """
+        Vuelve a dejar pendientes eventos que no se pudieron procesar, con espera exponencial
+        
+        Tras WEBHOOK_MAX_ATTEMPTS intentos el evento se descarta; la sincronización programada
+        recoge igual el cambio cuando el producto aparece como modificado.
+        
+        Args:
+            keys (List[Tuple[str, str, str]]): Eventos (store_id, tipo, id)
+            reason (str): Motivo del fallo, para el log
+        """
+        if not keys:
+            return
+        now = time.monotonic()
+        descartados = []
+        with self._lock:
+            for key in keys:
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(key, None)
+                    descartados.append(key)
+                    continue
+                self._attempts[key] = attempts
+                delay = min(self.debounce_seconds * 2 ** attempts, RETRY_MAX_SECONDS)
+                # Si llegó un evento nuevo mientras tanto, se respeta su ventana
+                self._pending.setdefault(key, (now, now + delay))
+        
+        reintentos = len(keys) - len(descartados)
+        if reintentos:
+            logger.warning("⚠️ %s eventos de webhook se reintentarán (%s)", reintentos, reason,
+                           extra={'events': [list(key) for key in keys[:50]]})
+            metrics.ITEMS.inc(reintentos, stage='webhook', result='reintento')
+        if descartados:
+            logger.error("❌ %s eventos de webhook descartados tras %s intentos (%s)", len(descartados),
+                         self.max_attempts, reason, extra={'events': [list(key) for key in descartados[:50]]})
+            metrics.ITEMS.inc(len(descartados), stage='webhook', result='descartado')
+
+    def _order_product_ids(self, store: Dict, order_ids: Set[str]) -> Tuple[Set[str], List[str]]:
+        """
+        Obtiene los IDs de los productos incluidos en varias órdenes
+        
+        Args:
+            store (Dict): Configuración de la tienda
+            order_ids (Set[str]): IDs de órdenes
+        
+        Returns:
+            Tuple[Set[str], List[str]]: IDs de productos y órdenes que no se pudieron obtener
+        """
+        tiendanube = _create_tiendanube(store)
+        product_ids = set()
+        failed = []
+        try:
+            for order_id in order_ids:
+                order = tiendanube.get_order(order_id)
+                if order is None:
+                    failed.append(order_id)
+                    continue
+                for item in order.get('products', []):
+                    if item.get('product_id'):
+                        product_ids.add(str(item['product_id']))
+        finally:
+            tiendanube.client.close()
+        return product_ids, failed
+
+    def start(self) -> None:
+        """Inicia el hilo que sincroniza los productos pendientes"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='webhook-debouncer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Detiene el hilo y sincroniza lo que quedó pendiente"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush(force=True)
+
+    def _run(self) -> None:
+        interval = max(min(self.debounce_seconds / 2, 1.0), 0.1)
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("❌ Error sincronizando productos por webhook: %s", e)
+
+def make_handler(processor: WebhookProcessor, secret: str):
+    """Crea el handler HTTP que recibe los webhooks de Tiendanube"""
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            
+            if not verify_signature(body, self.headers.get(SIGNATURE_HEADER), secret):
+                self.send_response(401)
+                self.end_headers()
+                return
+            
+            try:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    raise ValueError(f"se esperaba un objeto JSON, llegó {type(payload).__name__}")
+                processor.handle_event(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("❌ Webhook inválido: %s", e)
+                self.send_response(400)
+                self.end_headers()
+                return
+            
+            # Responder enseguida: la sincronización ocurre al vencer la ventana de espera
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+    
+    return WebhookHandler
+
+def serve(port: int) -> None:
+    """Levanta el servidor de webhooks"""
+    secret = os.getenv('TIENDANUBE_APP_SECRET')
+    if not secret:
+        raise ValueError("TIENDANUBE_APP_SECRET no está configurado en .env")
+    
+    metrics.start_from_env()
+    processor = WebhookProcessor(ShopifyAPI(), StoreConfig())
+    processor.start()
+    server = ThreadingHTTPServer(('', port), make_handler(processor, secret))
+    
+    logger.info("🔔 Escuchando webhooks de Tiendanube en el puerto %s", port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("👋 Deteniendo servidor de webhooks...")
+    finally:
+        server.server_close()
+        processor.stop()
+
+def replay(path: str, url: Optional[str] = None) -> None:
+    """
+    Reproduce webhooks guardados (un JSON por línea)
+    
+    Args:
+        path (str): Archivo JSONL con los cuerpos de los webhooks
+        url (str, optional): Si se indica, se envían firmados a un servidor en ejecución;
+            si no, se procesan directamente en este proceso
+    """
+    with open(path, encoding='utf-8') as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    
+    if url:
+        import requests
+        
+        secret = os.getenv('TIENDANUBE_APP_SECRET', '')
+        for payload in payloads:
+            body = json.dumps(payload).encode('utf-8')
+            response = requests.post(url, data=body, headers={
+                'Content-Type': 'application/json',
+                SIGNATURE_HEADER: sign(body, secret)
+            })
+            logger.info("📨 %s %s: %s", payload.get('event'), payload.get('id'), response.status_code)
+        return
+    
+    processor = WebhookProcessor(ShopifyAPI(), StoreConfig())
+    accepted = sum(1 for payload in payloads if processor.handle_event(payload))
+    logger.info("📨 Eventos reproducidos: %s/%s", accepted, len(payloads))
+    logger.info("📊 Productos sincronizados: %s", processor.flush(force=True))
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Receptor de webhooks de Tiendanube')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    serve_parser = subparsers.add_parser('serve', help='Levanta el servidor de webhooks')
+    serve_parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', 8080)))
+    
+    replay_parser = subparsers.add_parser('replay', help='Reproduce webhooks guardados en un archivo JSONL')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--url', help='URL de un servidor en ejecución (si no, se procesan localmente)')
+    
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.port)
+    else:
+        replay(args.path, args.url)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.exception("❌ Error: %s", e)
+        sys.exit(1)
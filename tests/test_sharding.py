@@ -0,0 +1,32 @@
+import contextlib
+import io
+import unittest
+from src.sharding import HashRing, check, shard_name, shard_stores
+
+STORES = [{'api_url': f'https://api.tiendanube.com/v1/{1000 + i}'} for i in range(60)]
+
+class HashRingTest(unittest.TestCase):
+    def test_reparto_sin_perdidas_ni_repetidas(self):
+        """Cada tienda cae en exactamente un shard"""
+        count = 3
+        repartidas = [store['api_url'] for i in range(count) for store in shard_stores(STORES, i, count)]
+        self.assertCountEqual(repartidas, [store['api_url'] for store in STORES])
+
+    def test_agregar_un_shard_mueve_pocas_tiendas(self):
+        """Al pasar de 3 a 4 shards solo cambia de worker una parte de las tiendas"""
+        before = HashRing([shard_name(i) for i in range(3)])
+        after = HashRing([shard_name(i) for i in range(4)])
+        moved = sum(before.node_for(store['api_url']) != after.node_for(store['api_url']) for store in STORES)
+        self.assertLess(moved, len(STORES) / 2)
+
+class CheckTest(unittest.TestCase):
+    def test_procesos_reales_no_pierden_ni_repiten_tiendas(self):
+        """La verificación con varios procesos termina sin tiendas perdidas, repetidas ni simultáneas"""
+        salida = io.StringIO()
+        with contextlib.redirect_stdout(salida):
+            ok = check(workers=3, store_count=30)
+        self.assertTrue(ok, salida.getvalue())
+        self.assertIn('perdidas=0, repetidas=0, simultáneas=0', salida.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()